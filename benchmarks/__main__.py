@@ -0,0 +1,287 @@
+# Benchmark suite for snowflash, using synthetic FLASH models and a stub snowglobes
+#
+# Each scale generates a workspace of synthetic models (in a temporary
+# directory, unless --workdir is given), runs the pipeline through once
+# to prepare every stage's inputs, then times each scenario --repeat times.
+# Nothing is read from or written to the real config, output, or snowglobes trees.
+#
+# Results are written to benchmarks/results/latest.json (or --output), and
+# --save NAME also stores them as the baseline benchmarks/baselines/NAME.json.
+# compare checks results against a baseline, flagging every scenario whose
+# best time is slower by more than --threshold, and exits 1 if any are.
+#
+# Usage (from the top-level repo directory):
+#   python -m benchmarks run [--scales small medium large] [--scenarios ...]
+#                            [--repeat N] [--output PATH] [--save NAME]
+#                            [--workdir PATH]
+#   python -m benchmarks compare NAME [--results PATH] [--threshold FRAC]
+#                                     [--min_diff SEC]
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+# snowflash
+from snowflash.utils import paths
+from benchmarks import scenarios
+
+bench_path = os.path.dirname(os.path.abspath(__file__))
+baselines_path = os.path.join(bench_path, 'baselines')
+results_filepath = os.path.join(bench_path, 'results', 'latest.json')
+
+
+# =======================================================
+#                 Run
+# =======================================================
+def run(scales, names, repeat, workdir=None):
+    """Run benchmark scenarios at each scale
+
+    Returns : {}
+        results, with run metadata
+
+    Parameters
+    ----------
+    scales : [str]
+    names : [str]
+        scenarios to run
+    repeat : int
+    workdir : str
+        directory for workspaces, defaults to a temporary directory (deleted after)
+    """
+    tmp_path = None
+
+    if workdir is None:
+        tmp_path = workdir = tempfile.mkdtemp(prefix='snowflash_bench_')
+
+    results = {}
+
+    try:
+        for scale in scales:
+            print(f'\n=== {scale}: {scenarios.scales[scale]} ===')
+            t0 = time.perf_counter()
+
+            with scenarios.quiet():
+                bench = scenarios.Bench(path=os.path.join(workdir, scale), scale=scale)
+                bench.prepare()
+
+            print(f'prepared in {time.perf_counter() - t0:.1f} s')
+
+            for name in names:
+                result = scenarios.time_scenario(scenarios.scenarios[name],
+                                                 bench=bench,
+                                                 repeat=repeat)
+                results[f'{scale}/{name}'] = result
+                print(f"{name:<22}min {result['min']:9.4f} s   "
+                      f"median {result['median']:9.4f} s")
+    finally:
+        if tmp_path is not None:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    return {'metadata': get_metadata(repeat=repeat),
+            'results': results}
+
+
+def get_metadata(repeat):
+    """Return description of the machine and code benchmarked
+
+    Returns : {}
+
+    Parameters
+    ----------
+    repeat : int
+    """
+    commit = subprocess.run(['git', '-C', paths.top_path(), 'describe',
+                             '--always', '--dirty'],
+                            capture_output=True, text=True).stdout.strip()
+
+    return {'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'commit': commit or None,
+            'host': socket.gethostname(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'repeat': repeat}
+
+
+def save_results(results, filepath):
+    """Save results as JSON
+
+    Parameters
+    ----------
+    results : {}
+    filepath : str
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+
+    with open(filepath, 'w') as f:
+        json.dump(results, f, indent=1)
+
+    print(f'Results saved: {filepath}')
+
+
+def load_results(filepath):
+    """Load results from JSON
+
+    Returns : {}
+
+    Parameters
+    ----------
+    filepath : str
+    """
+    with open(filepath, 'r') as f:
+        return json.load(f)
+
+
+def baseline_filepath(name):
+    """Return filepath to named baseline
+
+    Returns : str
+
+    Parameters
+    ----------
+    name : str
+    """
+    return os.path.join(baselines_path, f'{name}.json')
+
+
+def list_baselines():
+    """Return names of saved baselines
+
+    Returns : [str]
+    """
+    if not os.path.isdir(baselines_path):
+        return []
+
+    return sorted(os.path.splitext(filename)[0] for filename in os.listdir(baselines_path)
+                  if filename.endswith('.json'))
+
+
+# =======================================================
+#                 Compare
+# =======================================================
+def compare(baseline, results, threshold=0.1, min_diff=0.005):
+    """Compare results against baseline, printing a table of ratios
+
+    Returns : [str]
+        scenarios that regressed
+
+    Parameters
+    ----------
+    baseline : {}
+    results : {}
+    threshold : float
+        fractional slowdown of best time counted as a regression
+    min_diff : float
+        slowdowns smaller than this are never counted [s], to ignore timer noise
+    """
+    regressions = []
+    print(f"\n{'scenario':<32}{'baseline [s]':>14}{'current [s]':>14}{'ratio':>9}")
+
+    for key, result in results['results'].items():
+        base = baseline['results'].get(key)
+
+        if base is None:
+            print(f"{key:<32}{'-':>14}{result['min']:>14.4f}{'new':>9}")
+            continue
+
+        ratio = result['min'] / base['min'] if base['min'] > 0 else np.inf
+        slower = (ratio > 1 + threshold) and (result['min'] - base['min'] > min_diff)
+        flag = '  REGRESSION' if slower else ''
+
+        print(f"{key:<32}{base['min']:>14.4f}{result['min']:>14.4f}{ratio:>9.2f}{flag}")
+
+        if slower:
+            regressions += [key]
+
+    for key in baseline['results']:
+        if key not in results['results']:
+            print(f"{key:<32}{baseline['results'][key]['min']:>14.4f}{'-':>14}{'missing':>9}")
+
+    return regressions
+
+
+# =======================================================
+#                 Main
+# =======================================================
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Benchmark snowflash on synthetic models')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run benchmarks')
+    run_parser.add_argument('--scales', nargs='+', default=['small', 'medium'],
+                            choices=list(scenarios.scales))
+    run_parser.add_argument('--scenarios', nargs='+', default=list(scenarios.scenarios),
+                            choices=list(scenarios.scenarios))
+    run_parser.add_argument('--repeat', type=int, default=5,
+                            help='timed runs per scenario, after one warm-up run')
+    run_parser.add_argument('--output', default=results_filepath,
+                            help='results filepath')
+    run_parser.add_argument('--save', default=None, metavar='NAME',
+                            help='also save results as baseline NAME')
+    run_parser.add_argument('--workdir', default=None,
+                            help='directory for synthetic workspaces (kept afterwards)')
+
+    compare_parser = commands.add_parser('compare', help='compare results to a baseline')
+    compare_parser.add_argument('baseline',
+                                help='baseline name in benchmarks/baselines/, or filepath')
+    compare_parser.add_argument('--results', default=results_filepath,
+                                help='results filepath')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='fractional slowdown counted as a regression')
+    compare_parser.add_argument('--min_diff', type=float, default=0.005,
+                                help='ignore slowdowns smaller than this [s]')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run(scales=args.scales,
+                      names=args.scenarios,
+                      repeat=args.repeat,
+                      workdir=args.workdir)
+        save_results(results, filepath=args.output)
+
+        if args.save is not None:
+            save_results(results, filepath=baseline_filepath(args.save))
+
+    elif args.command == 'compare':
+        filepath = args.baseline
+
+        if not os.path.exists(filepath):
+            filepath = baseline_filepath(args.baseline)
+
+        if not os.path.exists(filepath):
+            sys.exit(f"Baseline not found: {args.baseline} "
+                     f"(available: {', '.join(list_baselines()) or 'none'})")
+
+        if not os.path.exists(args.results):
+            sys.exit(f'Results not found: {args.results} (run benchmarks first)')
+
+        baseline = load_results(filepath)
+        results = load_results(args.results)
+        print(f"baseline: {filepath} ({baseline['metadata']['commit']}, "
+              f"{baseline['metadata']['host']})")
+        print(f"results:  {args.results} ({results['metadata']['commit']}, "
+              f"{results['metadata']['host']})")
+
+        regressions = compare(baseline, results,
+                              threshold=args.threshold,
+                              min_diff=args.min_diff)
+
+        if regressions:
+            print(f'\n{len(regressions)} regression(s): {", ".join(regressions)}')
+            sys.exit(1)
+
+        print('\nNo regressions')
+
+
+if __name__ == '__main__':
+    main()
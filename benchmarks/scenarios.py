@@ -0,0 +1,261 @@
+import io
+import os
+import sys
+import time
+import subprocess
+import contextlib
+import numpy as np
+
+# snowflash
+from snowflash.flash import flash_io, flash_fluences, flash_mixing
+from snowflash.flash2snowglobes import analysis, snow_run
+from snowflash.snow.snow_model import SnowModel
+from snowflash.snow.snow_model_set import SnowModelSet
+from snowflash.utils import Config, paths
+from benchmarks import synthetic
+
+"""
+Timed benchmark scenarios, covering each stage of the pipeline
+
+Each scale is a synthetic workspace (see synthetic.py), prepared once by
+running the whole pipeline (with the stub snowglobes), so that every
+scenario has its inputs on disk. Scenarios then time a single stage,
+on the first progenitor (or on all of them, for SnowModelSet).
+The import scenarios time package start-up, and don't depend on scale
+"""
+
+scales = {'small': {'duration': 0.5, 't_step': 0.02, 'n_models': 2},
+          'medium': {'duration': 1.0, 't_step': 0.01, 'n_models': 4},
+          'large': {'duration': 2.0, 't_step': 0.01, 'n_models': 8},
+          }
+
+
+class Bench:
+    def __init__(self, path, scale):
+        """Synthetic workspace and pipeline state of one benchmark scale
+
+        Parameters
+        ----------
+        path : str
+            workspace directory
+        scale : str
+            one of scales
+        """
+        self.scale = scale
+        self.config = Config(synthetic.create_workspace(path=path,
+                                                        name=f'bench_{scale}',
+                                                        **scales[scale]))
+        self.model_set = self.config.model_sets[0]
+        self.zams = self.config.zams_list[0]
+        self.mixing = self.config.mixing[0]
+
+        self.t_bins = self.config.t_bins
+        self.e_bins = self.config.e_bins
+        self.dat = None
+        self.fluences = {}
+
+    def prepare(self):
+        """Run all progenitors through the pipeline (first mixing only),
+        leaving every stage's output on disk
+        """
+        for zams in self.config.zams_list:
+            dat = read_datfile(self, zams=zams)
+            raw = calc_fluences(self, dat=dat)
+            mixed = mix_fluences(self, raw=raw)
+
+            if zams == self.zams:
+                self.dat = dat
+                self.fluences = {'raw': raw, 'mixed': mixed}
+
+            self.run_snowglobes(zams=zams, mixed=mixed, mixing=self.mixing)
+            extract_counts(self, zams=zams)
+            analyze_output(self, zams=zams)
+
+    def run_snowglobes(self, zams, mixed, mixing):
+        """Write flux files and run stub snowglobes on them
+
+        Parameters
+        ----------
+        zams : str
+        mixed : xr.DataArray
+        mixing : str
+        """
+        write_snow_fluences(self, zams=zams, mixed=mixed, mixing=mixing)
+
+        snow_run.run(model_set=self.model_set,
+                     zams=zams,
+                     n_bins=len(self.t_bins),
+                     material=self.config.material,
+                     detector=self.config.detector,
+                     channels=analysis.get_all_channels(self.config.channel_groups),
+                     concurrency=4)
+
+
+# =======================================================
+#                 Scenarios
+# =======================================================
+def read_datfile(bench, zams=None):
+    """Read FLASH dat file
+    """
+    filepath = paths.flash_dat_filepath(models_path=bench.config.paths['models'],
+                                        model_set=bench.model_set,
+                                        zams=bench.zams if zams is None else zams,
+                                        run='run')
+
+    return flash_io.read_datfile(filepath,
+                                 t_start=bench.config.bins['t_start'],
+                                 t_end=bench.config.bins['t_end'])
+
+
+def calc_fluences(bench, dat=None):
+    """Calculate raw fluences from FLASH data
+    """
+    dat = bench.dat if dat is None else dat
+
+    return flash_fluences.calc_fluences(time=dat['time'],
+                                        lum=dat['lum'],
+                                        avg=dat['avg'],
+                                        rms=dat['rms'],
+                                        distance=bench.config.distance,
+                                        t_bins=bench.t_bins,
+                                        e_bins=bench.e_bins)
+
+
+def mix_fluences(bench, raw=None):
+    """Apply flavor mixing to raw fluences
+    """
+    raw = bench.fluences['raw'] if raw is None else raw
+
+    return flash_mixing.mix_fluences(fluences=raw, mixing=bench.config.mixing)
+
+
+def write_snow_fluences(bench, zams=None, mixed=None, mixing=None):
+    """Write snowglobes flux files
+    """
+    mixed = bench.fluences['mixed'] if mixed is None else mixed
+    mixing = bench.mixing if mixing is None else mixing
+
+    flash_io.write_snow_fluences(model_set=bench.model_set,
+                                 zams=bench.zams if zams is None else zams,
+                                 t_bins=bench.t_bins,
+                                 e_bins=bench.e_bins,
+                                 fluences=mixed.sel(mix=mixing))
+
+
+def extract_counts(bench, zams=None, mixing=None):
+    """Extract counts file from snowglobes output
+    """
+    analysis.extract_counts(model_set=bench.model_set,
+                            zams=bench.zams if zams is None else zams,
+                            detector=bench.config.detector,
+                            channel_groups=bench.config.channel_groups,
+                            mixing=bench.mixing if mixing is None else mixing)
+
+
+def analyze_output(bench, zams=None, mixing=None):
+    """Analyze snowglobes output into timebin table
+    """
+    analysis.analyze_output(model_set=bench.model_set,
+                            zams=bench.zams if zams is None else zams,
+                            detector=bench.config.detector,
+                            channel_groups=bench.config.channel_groups,
+                            mixing=bench.mixing if mixing is None else mixing)
+
+
+def snow_model(bench):
+    """Extract SnowModel dataset from counts file
+    """
+    SnowModel(zams=bench.zams,
+              model_set=bench.model_set,
+              detector=bench.config.detector,
+              mixing=bench.mixing,
+              recalc=True,
+              config=bench.config.name)
+
+
+def snow_model_set(bench):
+    """Load and integrate timebin tables of all progenitors
+    """
+    SnowModelSet(bench.config.name, mixing=bench.mixing)
+
+
+def import_snowflash(bench):
+    """Import snowflash and its Config, in a fresh interpreter
+    """
+    run_import('import snowflash; snowflash.Config')
+
+
+def import_pipeline(bench):
+    """Import the pipeline, as every driver and pool worker does, in a fresh interpreter
+    """
+    run_import('import snowflash.flash2snowglobes.pipeline')
+
+
+def run_import(statement):
+    """Run import statement in a fresh interpreter
+
+    Includes interpreter start-up time (~tens of ms),
+    which is the same before and after any change to snowflash
+
+    Parameters
+    ----------
+    statement : str
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([paths.top_path()] +
+                                        env.get('PYTHONPATH', '').split(os.pathsep))
+
+    subprocess.run([sys.executable, '-c', statement], env=env, check=True)
+
+
+scenarios = {'import_snowflash': import_snowflash,
+             'import_pipeline': import_pipeline,
+             'read_datfile': read_datfile,
+             'calc_fluences': calc_fluences,
+             'mix_fluences': mix_fluences,
+             'write_snow_fluences': write_snow_fluences,
+             'extract_counts': extract_counts,
+             'analyze_output': analyze_output,
+             'snow_model': snow_model,
+             'snow_model_set': snow_model_set,
+             }
+
+
+# =======================================================
+#                 Timing
+# =======================================================
+def time_scenario(func, bench, repeat=5):
+    """Time repeated runs of a scenario, after an untimed warm-up
+
+    Returns : {min, median, mean, times}
+        run times [s]
+
+    Parameters
+    ----------
+    func : callable
+        scenario function, taking bench
+    bench : Bench
+    repeat : int
+    """
+    times = []
+
+    with quiet():
+        func(bench)
+
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            func(bench)
+            times += [time.perf_counter() - t0]
+
+    return {'min': float(np.min(times)),
+            'median': float(np.median(times)),
+            'mean': float(np.mean(times)),
+            'times': times}
+
+
+@contextlib.contextmanager
+def quiet():
+    """Suppress progress printouts of the pipeline
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
@@ -0,0 +1,54 @@
+#!/usr/bin/perl
+# Stand-in for SNOwGLoBES supernova.pl, for benchmarks
+#
+# Takes the same arguments and writes the same files as the real script,
+# with counts computed cheaply from the total input flux:
+#   out/<flux>_<channel>_<detector>_events_smeared.dat
+#   out/<flux>_<channel>_<detector>_events.dat
+# Channels are read from the first column of channels/channels_<material>.dat
+#
+# Usage: ./supernova.pl <flux_name> <material> <detector>
+
+$fluxname = $ARGV[0];
+$material = $ARGV[1];
+$detector = $ARGV[2];
+
+open(CHANS, "channels/channels_$material.dat") || die("cannot open channels for $material");
+@chans = ();
+while (<CHANS>) {
+    @c = split;
+    push(@chans, $c[0]) if @c;
+}
+close(CHANS);
+
+open(FLUX, "fluxes/$fluxname.dat") || die("cannot open flux $fluxname");
+$total = 0;
+while (<FLUX>) {
+    @c = split;
+    shift @c;
+    $total += $_ for @c;
+}
+close(FLUX);
+
+$k = 0;
+foreach $chan (@chans) {
+    $k++;
+    $scale = 0.005 + 0.002 * $k;  # spectral width [GeV]
+
+    open(OUT, ">out/${fluxname}_${chan}_${detector}_events_smeared.dat");
+    $sum = 0;
+    for ($i = 0; $i < 200; $i++) {
+        $e = $i * 0.0005 + 0.00025;
+        $c = $total * 1e-9 * $k * ($e / $scale) * exp(-$e / $scale);
+        $sum += $c;
+        printf OUT "%.6f %.6e\n", $e, $c;
+    }
+    printf OUT "----\nTotal: %e\n", $sum;
+    close(OUT);
+
+    open(OUT, ">out/${fluxname}_${chan}_${detector}_events.dat");
+    print OUT "0.000250 0.000000e+00\n----\nTotal: 0.000000e+00\n";
+    close(OUT);
+}
+
+exit 0;
@@ -0,0 +1,211 @@
+import os
+import shutil
+import numpy as np
+
+# snowflash
+from snowflash.utils import Config, paths
+
+"""
+Synthetic stand-ins for FLASH models and SNOwGLoBES, for benchmarks
+
+A workspace is a self-contained directory holding everything a run needs:
+    models/   synthetic FLASH .dat files
+    config/   model config (found via SNOWFLASH_CONFIG)
+    runtime/  snowglobes runtime, running supernova_stub.pl
+    output/   snowflash output tree
+
+Everything is generated from fixed seeds, so repeated runs
+(and runs on different machines) benchmark identical inputs
+"""
+
+n_dat_columns = 42
+flash_columns = {'time': 0, 'rshock': 11, 'lum': [33, 34, 35],
+                 'avg': [36, 37, 38], 'rms': [39, 40, 41]}
+
+stub_filepath = os.path.join(os.path.dirname(__file__), 'supernova_stub.pl')
+
+
+# =======================================================
+#                 Workspace
+# =======================================================
+def create_workspace(path, name, duration, t_step, n_models,
+                     detector='wc100kt15prct',
+                     dt=1e-4):
+    """Create workspace of synthetic models, config, and snowglobes runtime
+
+    Returns : str
+        config name
+
+    Parameters
+    ----------
+    path : str
+        workspace directory
+    name : str
+        name of config and model set
+    duration : float
+        time simulated after bounce [s]
+    t_step : float
+        time bin size [s]
+    n_models : int
+        no. of progenitors
+    detector : str
+    dt : float
+        FLASH output timestep [s]
+    """
+    set_environment(path)
+    zams_list = [f'{10 + i}' for i in range(n_models)]
+
+    for i, zams in enumerate(zams_list):
+        filepath = paths.flash_dat_filepath(models_path=os.path.join(path, 'models'),
+                                            model_set=name,
+                                            zams=zams,
+                                            run='run')
+        write_datfile(filepath, duration=duration, dt=dt, seed=i)
+
+    write_config(path=path,
+                 name=name,
+                 zams_list=zams_list,
+                 duration=duration,
+                 t_step=t_step,
+                 detector=detector)
+
+    config = Config(name)
+    create_runtime(path, material=config.material, channel_groups=config.channel_groups)
+
+    return name
+
+
+def set_environment(path):
+    """Point snowflash config, runtime, and output paths into workspace
+
+    Parameters
+    ----------
+    path : str
+        workspace directory
+    """
+    os.environ['SNOWFLASH_CONFIG'] = os.path.join(path, 'config')
+    os.environ['SNOWFLASH_RUNTIME'] = os.path.join(path, 'runtime')
+    os.environ['SNOWFLASH_OUTPUT'] = os.path.join(path, 'output')
+    os.environ['SNOWFLASH_CACHE'] = os.path.join(path, 'output', 'snow_cache')
+
+
+def write_config(path, name, zams_list, duration, t_step, detector):
+    """Write model config for synthetic models
+
+    Parameters
+    ----------
+    path : str
+        workspace directory
+    name : str
+    zams_list : [str]
+    duration : float
+    t_step : float
+    detector : str
+    """
+    config_path = os.path.join(path, 'config')
+    os.makedirs(config_path, exist_ok=True)
+
+    lines = ['[paths]',
+             f"snowglobes = '{os.path.join(path, 'runtime')}'",
+             f"models = '{os.path.join(path, 'models')}'",
+             '',
+             '[flash]',
+             f"model_sets = ['{name}']",
+             f'run_list = {["run"] * len(zams_list)}',
+             'model_set_map = {}',
+             f'zams_list = {zams_list}',
+             '',
+             '[snow]',
+             f"detector = '{detector}'",
+             "mixing = ['nomix', 'normal']",
+             'distance = 10.0',
+             '',
+             '[bins]',
+             'n_integrate = 10',
+             't_start = 0.0',
+             f't_end = {duration}',
+             f't_step = {t_step}',
+             'e_start = 0.0',
+             'e_end = 0.1',
+             'e_step = 0.0002',
+             '']
+
+    with open(os.path.join(config_path, f'{name}.ini'), 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def create_runtime(path, material, channel_groups):
+    """Create snowglobes runtime running the stub supernova.pl
+
+    Parameters
+    ----------
+    path : str
+        workspace directory
+    material : str
+    channel_groups : {group: [channel]}
+    """
+    runtime_path = os.path.join(path, 'runtime')
+
+    for folder in ['fluxes', 'out', 'channels']:
+        os.makedirs(os.path.join(runtime_path, folder), exist_ok=True)
+
+    script_filepath = os.path.join(runtime_path, 'supernova.pl')
+    shutil.copy(stub_filepath, script_filepath)
+    os.chmod(script_filepath, 0o755)
+
+    channels = [chan for group in channel_groups.values() for chan in group]
+
+    with open(os.path.join(runtime_path, 'channels', f'channels_{material}.dat'), 'w') as f:
+        for i, channel in enumerate(channels):
+            f.write(f'{channel} {i} + e 1.0\n')
+
+
+# =======================================================
+#                 FLASH dat files
+# =======================================================
+def write_datfile(filepath, duration,
+                  dt=1e-4,
+                  t_bounce=0.3,
+                  seed=0):
+    """Write synthetic FLASH .dat file
+
+    Only the columns read by flash_io.read_datfile() are filled:
+    time, shock radius (zero before bounce), and luminosity [1e51 erg/s],
+    average energy [MeV], and rms energy [MeV] of each flavor,
+    following a smooth accretion-phase decline with mild noise
+
+    Parameters
+    ----------
+    filepath : str
+    duration : float
+        time simulated after bounce [s]
+    dt : float
+        output timestep [s]
+    t_bounce : float
+        bounce time [s]
+    seed : int
+        random seed, for distinct but reproducible models
+    """
+    rng = np.random.default_rng(seed)
+    time = np.arange(0, t_bounce + duration + 0.05, dt)
+    n_steps = len(time)
+    t_pb = np.clip(time - t_bounce, 0, None)
+
+    dat = np.zeros((n_steps, n_dat_columns))
+    dat[:, flash_columns['time']] = time
+    dat[:, flash_columns['rshock']] = np.where(time >= t_bounce, 1e7 * (1 + t_pb), 0.0)
+
+    lum_peak = np.array([60., 50., 20.]) * (1 + 0.05 * seed)
+    avg_peak = np.array([11., 14., 16.])
+    noise = 1 + 0.02 * rng.standard_normal((n_steps, 3))
+
+    decline = np.exp(-t_pb / 0.5)[:, np.newaxis]
+    lum = lum_peak * (0.1 + decline) * noise
+    avg = avg_peak * (1 + 0.2 * t_pb[:, np.newaxis]) * noise
+
+    dat[:, flash_columns['lum']] = lum
+    dat[:, flash_columns['avg']] = avg
+    dat[:, flash_columns['rms']] = 1.15 * avg
+
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    np.savetxt(filepath, dat, fmt='%.6e')
@@ -1,8 +1,35 @@
-from .flash.flash_model import FlashModel
-from .snow.snow_model_set import SnowModelSet
-from .snow.snow_model import SnowModel
-from .utils.config import Config
-
-from . import flash
-from . import flash2snowglobes
-from . import snow
+import importlib
+
+"""
+Top-level names are imported on first use (PEP 562), so that
+'import snowflash' doesn't pull in xarray, pandas, scipy, or matplotlib
+until they're needed, e.g. for short CLI invocations and pool workers
+"""
+
+_lazy_names = {'FlashModel': '.flash.flash_model',
+               'SnowModelSet': '.snow.snow_model_set',
+               'SnowModel': '.snow.snow_model',
+               'SnowModelBatch': '.snow.snow_model_batch',
+               'Config': '.utils.config',
+               }
+
+_lazy_modules = ['flash', 'flash2snowglobes', 'snow']
+
+__all__ = list(_lazy_names) + _lazy_modules
+
+
+def __getattr__(name):
+    if name in _lazy_names:
+        module = importlib.import_module(_lazy_names[name], __name__)
+        value = getattr(module, name)
+    elif name in _lazy_modules:
+        value = importlib.import_module(f'.{name}', __name__)
+    else:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
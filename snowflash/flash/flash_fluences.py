@@ -33,7 +33,7 @@ def fluences_to_xarray(fluences, t_bins, e_bins):
     return fx
 
 
-def calc_fluences(time, lum, avg, rms, distance, t_bins, e_bins):
+def calc_fluences(time, lum, avg, rms, distance, t_bins, e_bins, t_step=None):
     """Calculate pinched neutrino fluences at Earth for snowglobes input
 
     Returns: xr.DataArray
@@ -54,6 +54,8 @@ def calc_fluences(time, lum, avg, rms, distance, t_bins, e_bins):
         time bins to sample over [leftside]
     e_bins : [e_bins]
         neutrino energy bins to sample [GeV]
+    t_step : float
+        time bin size [s]. If None, inferred from t_bins
     """
     print('Calculating neutrino fluences')
     flavors = ['e', 'eb', 'x']  # nu_e, nu_ebar, nu_x
@@ -61,7 +63,9 @@ def calc_fluences(time, lum, avg, rms, distance, t_bins, e_bins):
     n_timebins = len(t_bins)
     n_ebins = len(e_bins)
 
-    t_step = np.diff(t_bins)[0]
+    if t_step is None:
+        t_step = np.diff(t_bins)[0]
+
     full_timebins = np.append(t_bins, t_bins[-1] + t_step)
 
     flu_dict = {f: np.zeros([n_timebins, n_ebins]) for f in flavors}
@@ -1,12 +1,18 @@
 import os
+import threading
 import xarray as xr
 import numpy as np
-from astropy import units
 import pandas as pd
 
 # snowflash
 from snowflash.utils import paths
 
+# the netCDF/HDF5 libraries aren't thread-safe, so models running
+# concurrently in threads must take turns reading/writing netCDF files
+netcdf_lock = threading.RLock()
+
+erg_to_gev = 624.1509074460764  # = astropy units.erg.to(units.GeV)
+
 
 # =======================================================
 #                 FLASH files
@@ -42,7 +48,7 @@ def read_datfile(filepath, t_start, t_end):
     sliced = dat_raw[i_start:i_end]
 
     dat = {'time': sliced[:, 0] - bounce_time,
-           'lum': sliced[:, 2:5] * 1e51 * units.erg.to(units.GeV),
+           'lum': sliced[:, 2:5] * 1e51 * erg_to_gev,
            'avg': sliced[:, 5:8] / 1000,
            'rms': sliced[:, 8:11] / 1000}
 
@@ -99,7 +105,13 @@ def save_fluences(fluences, zams, model_set, flu_type):
 
     paths.check_dir_exists(os.path.dirname(filepath))
     print(f'Saving {flu_type} fluences: {filepath}')
-    fluences.to_netcdf(filepath)
+
+    # atomic, as other runs (e.g. shards) may share the file
+    tmp_filepath = f'{filepath}.{os.getpid()}.tmp'
+
+    with netcdf_lock:
+        fluences.to_netcdf(tmp_filepath)
+        os.replace(tmp_filepath, filepath)
 
 
 def load_fluences(zams, model_set, flu_type):
@@ -118,7 +130,8 @@ def load_fluences(zams, model_set, flu_type):
                                              flu_type=flu_type)
 
     print(f'Loading raw fluences: {filepath}')
-    fluences = xr.load_dataarray(filepath)
+    with netcdf_lock:
+        fluences = xr.load_dataarray(filepath)
 
     return fluences
 
@@ -127,7 +140,8 @@ def write_snow_fluences(model_set,
                         zams,
                         t_bins,
                         e_bins,
-                        fluences):
+                        fluences,
+                        i_start=0):
     """Writes input files for snowglobes in fluxes directory
 
     Creates key file to indicate how file index is related to time
@@ -144,26 +158,79 @@ def write_snow_fluences(model_set,
         energy bins (leftside) for neutrino spectra [GeV]
     fluences : xr.DataArray
         neutrino fluences over all time and energy bins [GeV/s/cm^2]
+    i_start : int
+        index of first time bin to write fluence files for.
+        The key file always includes all bins
+    """
+    write_snow_key(model_set=model_set, zams=zams, t_bins=t_bins)
+
+    for i in range(i_start, len(t_bins)):
+        write_snow_fluence_bin(i=i,
+                               model_set=model_set,
+                               zams=zams,
+                               e_bins=e_bins,
+                               fluences=fluences)
+
+
+def write_snow_key(model_set, zams, t_bins):
+    """Write key file relating snowglobes file index to time
+
+    Parameters
+    ----------
+    model_set : str
+    zams : float
+    t_bins : []
     """
     t_step = np.diff(t_bins)[0]
 
-    # write key table
     key_table = get_key_table(t_bins=t_bins, t_step=t_step)
     key_filepath = paths.snow_channel_dat_key_filepath(zams=zams, model_set=model_set)
 
     with open(key_filepath, 'w') as keyfile:
         key_table.to_string(keyfile, index=False)
 
-    # write fluence files
-    for i in range(len(t_bins)):
-        out_filepath = paths.snow_fluence_filepath(i=i + 1, zams=zams, model_set=model_set)
 
-        table = format_fluence_table(time_i=i,
-                                     e_bins=e_bins,
-                                     fluences=fluences)
+def write_snow_fluence_bin(i, model_set, zams, e_bins, fluences):
+    """Write pinched fluence file of a single time bin for snowglobes input
+
+    Parameters
+    ----------
+    i : int
+        time bin index
+    model_set : str
+    zams : float
+    e_bins : []
+    fluences : xr.DataArray
+    """
+    out_filepath = paths.snow_fluence_filepath(i=i + 1, zams=zams, model_set=model_set)
+
+    table = format_fluence_table(time_i=i,
+                                 e_bins=e_bins,
+                                 fluences=fluences)
+
+    with open(out_filepath, 'w') as outfile:
+        table.to_string(outfile, header=None, index=False)
+
+
+def count_leading_bins(prev_bins, bins, atol=1e-8):
+    """Return number of previous bins that match the leading current bins
+
+    Returns : int
+        0 if previous bins aren't a leading subset of current bins
+
+    Parameters
+    ----------
+    prev_bins : []
+    bins : []
+    atol : float
+        absolute tolerance for matching bin edges
+    """
+    n_prev = len(prev_bins)
+
+    if (n_prev > len(bins)) or not np.allclose(prev_bins, bins[:n_prev], rtol=0, atol=atol):
+        return 0
 
-        with open(out_filepath, 'w') as outfile:
-            table.to_string(outfile, header=None, index=False)
+    return n_prev
 
 
 def get_key_table(t_bins, t_step):
@@ -1,5 +1,8 @@
+import numpy as np
+import xarray as xr
+
 # snowflash
-from snowflash.utils import Config, paths, plot
+from snowflash.utils import Config, paths, plot, provenance, profiling
 from snowflash.flash import flash_fluences, flash_mixing, flash_io
 
 
@@ -27,6 +30,8 @@ class FlashModel:
                  run,
                  config_name,
                  recalc=False,
+                 incremental=False,
+                 save=True,
                  ):
         """
         Parameters
@@ -36,6 +41,13 @@ class FlashModel:
         run : str or None
         config_name : str
         recalc : bool
+        incremental : bool
+            if cached fluences are stale, but their time bins are a leading
+            subset of the current bins (e.g. t_end was extended),
+            only calculate the new bins and append them
+        save : bool
+            save calculated fluences to file. If False (and recalc=True),
+            nothing is read from or written to fluence files
         """
         self.config = Config(config_name)
         self.zams = zams
@@ -43,8 +55,11 @@ class FlashModel:
         self.run = run
         self.models_path = self.config.paths['models']
         self.recalc = recalc
+        self.incremental = incremental
+        self.save = save
 
         self.dat = None
+        self.n_prev_bins = 0
         self.t_bins = None
         self.e_bins = None
         self.fluences = {}
@@ -73,21 +88,92 @@ class FlashModel:
             except (FileNotFoundError, ValueError) as err:
                 if isinstance(err, FileNotFoundError):
                     print('No fluence file found. Reloading dat')
+                    recalc()
+                elif self.incremental and self.extend_fluences():
+                    pass
                 else:
-                    print('Fluence file incompatible with config. Reloading dat')
-                recalc()
+                    print(f'Fluence file incompatible with config ({err}). Reloading dat')
+                    recalc()
+
+    def extend_fluences(self):
+        """Extend cached raw fluences with any new time bins
+
+        The cached bins are reused only if they were derived with the
+        same parameters (other than t_end), the dat file has only been
+        appended to since, and their edges are identical to
+        the leading bins of the current config
 
-    def read_datfile(self):
+        Returns : bool
+            whether cached fluences could be extended
+        """
+        cached = flash_io.load_fluences(zams=self.zams,
+                                        model_set=self.model_set,
+                                        flu_type='raw')
+        params, _ = self.get_provenance('raw')
+
+        try:
+            record = provenance.check_provenance(cached.attrs, params=params,
+                                                 sources={}, ignore=['t_end'])
+        except provenance.ProvenanceError as err:
+            print(f"Cached fluences can't be extended ({err})")
+            return False
+
+        if not provenance.is_appended(record['sources'].get('dat'), self.dat_filepath()):
+            print("Cached fluences can't be extended "
+                  "(dat file has been modified, not only appended to)")
+            return False
+
+        self.n_prev_bins = flash_io.count_leading_bins(prev_bins=cached['time'].values,
+                                                       bins=self.t_bins)
+
+        if (self.n_prev_bins == 0) \
+                or (not np.array_equal(cached['energy'].values, self.e_bins)):
+            self.n_prev_bins = 0
+            return False
+
+        n_new = len(self.t_bins) - self.n_prev_bins
+        print(f'Extending fluences: reusing {self.n_prev_bins} bins, '
+              f'calculating {n_new} new bins')
+
+        cached = cached.isel(time=slice(0, self.n_prev_bins))
+
+        if n_new > 0:
+            new_bins = self.t_bins[self.n_prev_bins:]
+            self.read_datfile(t_start=new_bins[0])
+
+            with profiling.stage('fluences', model_set=self.model_set, zams=self.zams):
+                new = flash_fluences.calc_fluences(time=self.dat['time'],
+                                                   lum=self.dat['lum'],
+                                                   avg=self.dat['avg'],
+                                                   rms=self.dat['rms'],
+                                                   distance=self.config.distance,
+                                                   t_bins=new_bins,
+                                                   e_bins=self.e_bins,
+                                                   t_step=self.config.bins['t_step'])
+
+            cached = xr.concat([cached, new.transpose(*cached.dims)], dim='time')
+
+        self.fluences['raw'] = cached
+        self.set_provenance('raw')
+        self.save_fluences('raw')
+
+        return True
+
+    def read_datfile(self, t_start=None):
         """Read time-dependent neutrino data from flash dat file
+
+        Parameters
+        ----------
+        t_start : float
+            start of time slice. Defaults to config t_start
         """
-        filepath = paths.flash_dat_filepath(models_path=self.models_path,
-                                            zams=self.zams,
-                                            model_set=self.model_set,
-                                            run=self.run)
+        if t_start is None:
+            t_start = self.config.bins['t_start']
 
-        self.dat = flash_io.read_datfile(filepath=filepath,
-                                         t_start=self.config.bins['t_start'],
-                                         t_end=self.config.bins['t_end'])
+        with profiling.stage('flash_read', model_set=self.model_set, zams=self.zams):
+            self.dat = flash_io.read_datfile(filepath=self.dat_filepath(),
+                                             t_start=t_start,
+                                             t_end=self.config.bins['t_end'])
 
     def load_fluences(self, flu_type):
         """Load fluences from file
@@ -96,13 +182,13 @@ class FlashModel:
         ----------
         flu_type : 'raw' or 'mixed'
         """
-        fluences = flash_io.load_fluences(zams=self.zams,
-                                          model_set=self.model_set,
-                                          flu_type=flu_type)
+        with profiling.stage('fluences_load', model_set=self.model_set, zams=self.zams):
+            fluences = flash_io.load_fluences(zams=self.zams,
+                                              model_set=self.model_set,
+                                              flu_type=flu_type)
 
-        if (len(self.t_bins) not in fluences.shape) \
-                or (len(self.e_bins) not in fluences.shape):
-            raise ValueError
+        params, sources = self.get_provenance(flu_type)
+        provenance.check_provenance(fluences.attrs, params=params, sources=sources)
 
         self.fluences[flu_type] = fluences
 
@@ -116,68 +202,112 @@ class FlashModel:
         ----------
         flu_type : 'raw' or 'mixed'
         """
-        flash_io.save_fluences(fluences=self.fluences[flu_type],
-                               zams=self.zams,
-                               model_set=self.model_set,
-                               flu_type=flu_type)
+        if not self.save:
+            return
+
+        with profiling.stage('fluences_save', model_set=self.model_set, zams=self.zams):
+            flash_io.save_fluences(fluences=self.fluences[flu_type],
+                                   zams=self.zams,
+                                   model_set=self.model_set,
+                                   flu_type=flu_type)
 
-    def write_snow_fluences(self, mixing):
+    def write_snow_fluences(self, mixing, i_start=0):
         """Write fluence tables to file for snowglobes input
 
         Parameters
         ----------
         mixing : str
+        i_start : int
+            index of first time bin to write
         """
         print('Writing fluences to file')
-        flash_io.write_snow_fluences(model_set=self.model_set,
-                                     zams=self.zams,
-                                     t_bins=self.t_bins,
-                                     e_bins=self.e_bins,
-                                     fluences=self.fluences['mixed'].sel(mix=mixing))
+        with profiling.stage('flux_write', model_set=self.model_set, zams=self.zams,
+                             mixing=mixing):
+            flash_io.write_snow_fluences(model_set=self.model_set,
+                                         zams=self.zams,
+                                         t_bins=self.t_bins,
+                                         e_bins=self.e_bins,
+                                         fluences=self.fluences['mixed'].sel(mix=mixing),
+                                         i_start=i_start)
 
     # =======================================================
     #                 Fluences
     # =======================================================
-    def get_bins(self, decimals=5):
-        """Generate time and energy bin coordinates
-
-        Parameters
-        ----------
-        decimals : int
-            number of decimals to round to
+    def get_bins(self):
+        """Get time and energy bin coordinates, shared with config
         """
-        self.t_bins = flash_fluences.get_bins(x0=self.config.bins['t_start'],
-                                              x1=self.config.bins['t_end'],
-                                              dx=self.config.bins['t_step'],
-                                              endpoint=False,
-                                              decimals=decimals)
-
-        self.e_bins = flash_fluences.get_bins(x0=self.config.bins['e_start'],
-                                              x1=self.config.bins['e_end'],
-                                              dx=self.config.bins['e_step'],
-                                              endpoint=True,
-                                              decimals=decimals)
+        self.t_bins = self.config.t_bins
+        self.e_bins = self.config.e_bins
 
     def calc_fluences(self):
         """Calculate neutrino fluences from flash in time and energy bins
         """
-        self.fluences['raw'] = flash_fluences.calc_fluences(time=self.dat['time'],
-                                                            lum=self.dat['lum'],
-                                                            avg=self.dat['avg'],
-                                                            rms=self.dat['rms'],
-                                                            distance=self.config.distance,
-                                                            t_bins=self.t_bins,
-                                                            e_bins=self.e_bins)
+        with profiling.stage('fluences', model_set=self.model_set, zams=self.zams):
+            self.fluences['raw'] = flash_fluences.calc_fluences(time=self.dat['time'],
+                                                                lum=self.dat['lum'],
+                                                                avg=self.dat['avg'],
+                                                                rms=self.dat['rms'],
+                                                                distance=self.config.distance,
+                                                                t_bins=self.t_bins,
+                                                                e_bins=self.e_bins)
+        self.set_provenance('raw')
         self.save_fluences('raw')
 
     def mix_fluences(self):
         """Apply flavor mixing to neutrino fluences
         """
         print('Applying flavor mixing to fluences')
-        self.fluences['mixed'] = flash_mixing.mix_fluences(fluences=self.fluences['raw'],
-                                                           mixing=self.config.mixing)
+        with profiling.stage('mixing', model_set=self.model_set, zams=self.zams):
+            self.fluences['mixed'] = flash_mixing.mix_fluences(fluences=self.fluences['raw'],
+                                                               mixing=self.config.mixing)
+        self.set_provenance('mixed')
         self.save_fluences('mixed')
 
+    # =======================================================
+    #                 Provenance
+    # =======================================================
+    def dat_filepath(self):
+        """Return path to flash dat file
+        """
+        return paths.flash_dat_filepath(models_path=self.models_path,
+                                        zams=self.zams,
+                                        model_set=self.model_set,
+                                        run=self.run)
+
+    def get_provenance(self, flu_type):
+        """Return expected provenance of fluences
+
+        Returns : params, sources
+
+        Parameters
+        ----------
+        flu_type : 'raw' or 'mixed'
+        """
+        params = provenance.get_bin_params(self.config)
+        params['distance'] = self.config.distance
+
+        if flu_type == 'raw':
+            sources = {'dat': provenance.file_stamp(self.dat_filepath(), checksum=True)}
+        else:
+            params['mixing'] = list(self.config.mixing)
+            raw_filepath = paths.model_fluences_filepath(model_set=self.model_set,
+                                                         zams=self.zams,
+                                                         flu_type='raw')
+            sources = {'raw': provenance.file_stamp(raw_filepath, checksum=True)}
+
+        return params, sources
+
+    def set_provenance(self, flu_type):
+        """Attach provenance metadata to fluences
+
+        Parameters
+        ----------
+        flu_type : 'raw' or 'mixed'
+        """
+        params, sources = self.get_provenance(flu_type)
+        attrs = provenance.get_provenance(params=params, sources=sources)
+        self.fluences[flu_type].attrs.update(attrs)
+
     # =======================================================
     #                 Plotting
     # =======================================================
@@ -1,17 +1,18 @@
-import os
 import numpy as np
 import pandas as pd
 import xarray as xr
 
 # snowflash
-from snowflash.utils import paths
+from snowflash.utils import paths, provenance
+from snowflash.flash.flash_io import count_leading_bins, netcdf_lock
 
 
 def analyze_output(model_set,
                    zams,
                    detector,
                    channel_groups,
-                   mixing):
+                   mixing,
+                   i_start=0):
     """Analyze snowglobes output and writes to ascii files
 
     Currently calculating mean energy and total counts for each detector channel
@@ -24,66 +25,49 @@ def analyze_output(model_set,
     detector : str
     channel_groups : {}
     mixing : str
+    i_start : int
+        index of first time bin to analyze. Earlier bins are taken from
+        the existing timebin table (incremental mode)
     """
     channels = get_all_channels(channel_groups)
-
-    filepath = paths.snow_channel_dat_key_filepath(zams=zams, model_set=model_set)
-    time = np.loadtxt(filepath,
-                      skiprows=1,
-                      usecols=[1],
-                      unpack=True)
+    time = load_key_times(model_set=model_set, zams=zams)[i_start:]
 
     energy_bins = load_energy_bins(channel=channels[0],
-                                   i=1,
+                                   i=i_start + 1,
                                    model_set=model_set,
                                    zams=zams,
                                    detector=detector)
-    n_time = len(time)
-    n_bins = len(energy_bins)
-
-    time_totals = {'total': np.zeros(n_time)}
-    time_avg = {'total': np.zeros(n_time)}
+    group_counts = []
 
-    for group in channel_groups:
-        time_totals[group] = np.zeros(n_time)
-        time_avg[group] = np.zeros(n_time)
-
-    for i in range(n_time):
+    for i in range(len(time)):
         channel_counts = load_channel_counts(channels=channels,
-                                             i=i + 1,
+                                             i=i_start + i + 1,
                                              model_set=model_set,
                                              zams=zams,
                                              detector=detector)
 
-        group_counts = get_group_counts(channel_counts,
-                                        groups=channel_groups,
-                                        n_bins=n_bins)
-
-        group_totals = get_totals(group_counts)
-        group_avg = get_avg(group_counts=group_counts,
-                            group_totals=group_totals,
-                            energy_bins=energy_bins)
-
-        for group in group_totals:
-            time_totals[group][i] = group_totals[group]
-            time_avg[group][i] = group_avg[group]
+        group_counts += [get_group_counts(channel_counts,
+                                          groups=channel_groups,
+                                          n_bins=len(energy_bins))]
 
-    timebin_table = create_timebin_table(timesteps=time,
-                                         time_totals=time_totals,
-                                         time_avg=time_avg)
-
-    save_timebin_table(table=timebin_table,
-                       detector=detector,
-                       model_set=model_set,
-                       zams=zams,
-                       mixing=mixing)
+    save_timebins(timesteps=time,
+                  group_counts=group_counts,
+                  energy_bins=energy_bins,
+                  channel_groups=channel_groups,
+                  detector=detector,
+                  model_set=model_set,
+                  zams=zams,
+                  mixing=mixing,
+                  i_start=i_start)
 
 
 def extract_counts(model_set,
                    zams,
                    detector,
                    channel_groups,
-                   mixing):
+                   mixing,
+                   attrs=None,
+                   i_start=0):
     """Extract snowglobes output counts and write to file
 
     parameters
@@ -93,14 +77,17 @@ def extract_counts(model_set,
     detector : str
     channel_groups : {}
     mixing : str
+    attrs : {}
+        metadata (e.g. provenance) to attach to counts file
+    i_start : int
+        index of first time bin to extract. Earlier bins are taken from
+        the existing counts file (incremental mode)
     """
     channels = get_all_channels(channel_groups)
-
-    filepath = paths.snow_channel_dat_key_filepath(zams=zams, model_set=model_set)
-    t_bins = np.loadtxt(filepath, skiprows=1, usecols=[1], unpack=True)
+    t_bins = load_key_times(model_set=model_set, zams=zams)[i_start:]
 
     e_bins = load_energy_bins(channel=channels[0],
-                              i=1,
+                              i=i_start + 1,
                               model_set=model_set,
                               zams=zams,
                               detector=detector)
@@ -111,23 +98,69 @@ def extract_counts(model_set,
     count_array = np.zeros((n_tbins, n_groups, n_ebins))
 
     for i in range(n_tbins):
-        channel_counts = load_channel_counts(channels=channels,
-                                             i=i + 1,
-                                             model_set=model_set,
-                                             zams=zams,
-                                             detector=detector)
+        count_array[i, :, :] = load_group_counts(channels=channels,
+                                                 channel_groups=channel_groups,
+                                                 i=i_start + i + 1,
+                                                 n_ebins=n_ebins,
+                                                 model_set=model_set,
+                                                 zams=zams,
+                                                 detector=detector)
+
+    save_count_array(count_array,
+                     t_bins=t_bins,
+                     e_bins=e_bins,
+                     channel_groups=channel_groups,
+                     detector=detector,
+                     model_set=model_set,
+                     zams=zams,
+                     mixing=mixing,
+                     attrs=attrs,
+                     i_start=i_start)
+
+
+def save_count_array(count_array,
+                     t_bins,
+                     e_bins,
+                     channel_groups,
+                     detector,
+                     model_set,
+                     zams,
+                     mixing,
+                     attrs=None,
+                     i_start=0):
+    """Construct counts DataArray and save to file
 
-        group_counts = get_group_counts(channel_counts,
-                                        groups=channel_groups,
-                                        n_bins=n_ebins)
-
-        count_array[i, :, :] = np.stack(list(group_counts.values()))
-
-    counts = xr.DataArray(count_array,
-                          dims=['time', 'channel', 'energy'],
-                          coords={'time': t_bins,
-                                  'channel': list(channel_groups.keys()),
-                                  'energy': e_bins})
+    parameters
+    ----------
+    count_array : [time, channel, energy]
+    t_bins : []
+    e_bins : []
+    channel_groups : {}
+    detector : str
+    model_set : str
+    zams : float or int
+    mixing : str
+    attrs : {}
+        metadata (e.g. provenance) to attach to counts file
+    i_start : int
+        index of first time bin in count_array. Earlier bins are taken from
+        the existing counts file (incremental mode)
+    """
+    counts = create_counts(count_array,
+                           t_bins=t_bins,
+                           e_bins=e_bins,
+                           channel_groups=channel_groups)
+
+    if i_start > 0:
+        prev_counts = load_counts(detector=detector,
+                                  model_set=model_set,
+                                  zams=zams,
+                                  mixing=mixing)
+        counts = xr.concat([prev_counts.isel(time=slice(0, i_start)), counts],
+                           dim='time')
+
+    if attrs is not None:
+        counts.attrs.update(attrs)
 
     save_counts(counts,
                 detector=detector,
@@ -136,6 +169,103 @@ def extract_counts(model_set,
                 mixing=mixing)
 
 
+def create_counts(count_array, t_bins, e_bins, channel_groups):
+    """Construct counts DataArray from array of group counts
+
+    Returns : xr.DataArray
+
+    parameters
+    ----------
+    count_array : [time, channel, energy]
+    t_bins : []
+    e_bins : []
+    channel_groups : {}
+    """
+    return xr.DataArray(count_array,
+                        dims=['time', 'channel', 'energy'],
+                        coords={'time': t_bins,
+                                'channel': list(channel_groups.keys()),
+                                'energy': e_bins})
+
+
+def save_timebins(timesteps,
+                  group_counts,
+                  energy_bins,
+                  channel_groups,
+                  detector,
+                  model_set,
+                  zams,
+                  mixing,
+                  i_start=0):
+    """Construct timebin table from group counts and save to file
+
+    parameters
+    ----------
+    timesteps : []
+    group_counts : [{group: []}]
+        group counts per energy bin, for each time bin
+    energy_bins : []
+    channel_groups : {}
+    detector : str
+    model_set : str
+    zams : float or int
+    mixing : str
+    i_start : int
+        index of first time bin in group_counts. Earlier bins are taken from
+        the existing timebin table (incremental mode)
+    """
+    n_time = len(timesteps)
+
+    time_totals = {'total': np.zeros(n_time)}
+    time_avg = {'total': np.zeros(n_time)}
+
+    for group in channel_groups:
+        time_totals[group] = np.zeros(n_time)
+        time_avg[group] = np.zeros(n_time)
+
+    for i, counts in enumerate(group_counts):
+        group_totals = get_totals(counts)
+        group_avg = get_avg(group_counts=counts,
+                            group_totals=group_totals,
+                            energy_bins=energy_bins)
+
+        for group in group_totals:
+            time_totals[group][i] = group_totals[group]
+            time_avg[group][i] = group_avg[group]
+
+    timebin_table = create_timebin_table(timesteps=timesteps,
+                                         time_totals=time_totals,
+                                         time_avg=time_avg)
+
+    if i_start > 0:
+        prev_table = load_timebin_table(detector=detector,
+                                        model_set=model_set,
+                                        zams=zams,
+                                        mixing=mixing)
+        timebin_table = pd.concat([prev_table.iloc[:i_start], timebin_table],
+                                  ignore_index=True)
+
+    save_timebin_table(table=timebin_table,
+                       detector=detector,
+                       model_set=model_set,
+                       zams=zams,
+                       mixing=mixing)
+
+
+def load_key_times(model_set, zams):
+    """Load time bins from snowglobes key file
+
+    Returns : []
+
+    parameters
+    ----------
+    model_set : str
+    zams : float or int
+    """
+    filepath = paths.snow_channel_dat_key_filepath(zams=zams, model_set=model_set)
+    return np.loadtxt(filepath, skiprows=1, usecols=[1], unpack=True, ndmin=1)
+
+
 # ===========================================================
 #                   Raw channel counts
 # ===========================================================
@@ -153,6 +283,34 @@ def get_all_channels(groups):
     return channels
 
 
+def load_group_counts(channels, channel_groups, i, n_ebins, model_set, zams, detector):
+    """Load counts of all channel groups for a single time bin
+
+    Returns : [groups, energy]
+
+    Parameters
+    ----------
+    channels : [str]
+    channel_groups : {}
+    i : int
+    n_ebins : int
+    model_set : str
+    zams : str, int or float
+    detector : str
+    """
+    channel_counts = load_channel_counts(channels=channels,
+                                         i=i,
+                                         model_set=model_set,
+                                         zams=zams,
+                                         detector=detector)
+
+    group_counts = get_group_counts(channel_counts,
+                                    groups=channel_groups,
+                                    n_bins=n_ebins)
+
+    return np.stack(list(group_counts.values()))
+
+
 def load_channel_counts(channels, i, model_set, zams, detector):
     """Load all raw channel counts into dict
 
@@ -321,8 +479,7 @@ def save_timebin_table(table, detector, model_set, zams, mixing):
     mixing : str
     """
     path = paths.snow_model_path(model_set=model_set, detector=detector, mixing=mixing)
-    if not os.path.isdir(path):
-        os.makedirs(path)
+    paths.check_dir_exists(path)
 
     filepath = paths.snow_timebin_filepath(zams=zams,
                                            model_set=model_set,
@@ -335,6 +492,98 @@ def save_timebin_table(table, detector, model_set, zams, mixing):
         f.write(string)
 
 
+def load_counts(detector, model_set, zams, mixing):
+    """Load previously extracted count table
+
+    Returns : xr.DataArray
+
+    Parameters
+    ----------
+    detector : str
+    model_set : str
+    zams : str, int or float
+    mixing : str
+    """
+    filepath = paths.snow_counts_filepath(zams=zams,
+                                          model_set=model_set,
+                                          detector=detector,
+                                          mixing=mixing)
+
+    with netcdf_lock:
+        return xr.load_dataarray(filepath)
+
+
+def load_timebin_table(detector, model_set, zams, mixing):
+    """Load previously saved timebinned table
+
+    Returns : pd.DataFrame
+
+    Parameters
+    ----------
+    detector : str
+    model_set : str
+    zams : str, int or float
+    mixing : str
+    """
+    filepath = paths.snow_timebin_filepath(zams=zams,
+                                           model_set=model_set,
+                                           detector=detector,
+                                           mixing=mixing)
+
+    return pd.read_csv(filepath, delim_whitespace=True)
+
+
+def count_completed_bins(t_bins, detector, model_set, zams, mixing, params, fluences):
+    """Return number of leading time bins already in both counts and timebin files
+
+    Bins are only reused if the counts file was derived with the same
+    parameters (other than t_end), from fluences that are identical to
+    the leading time bins of the current fluences of this mixing.
+    Files with more bins than t_bins (i.e. t_end was reduced) aren't reused
+
+    Returns : int
+
+    Parameters
+    ----------
+    t_bins : []
+        current time bins
+    detector : str
+    model_set : str
+    zams : str, int or float
+    mixing : str
+    params : {}
+        expected counts parameters
+    fluences : [time, energy, flav]
+        current mixed fluences of this mixing, or None if there are none
+    """
+    try:
+        counts = load_counts(detector=detector, model_set=model_set,
+                             zams=zams, mixing=mixing)
+        table = load_timebin_table(detector=detector, model_set=model_set,
+                                   zams=zams, mixing=mixing)
+    except FileNotFoundError:
+        return 0
+
+    try:
+        record = provenance.check_provenance(counts.attrs, params=params, sources={},
+                                             ignore=['t_end'])
+    except provenance.ProvenanceError as err:
+        print(f"Counts file can't be extended ({err})")
+        return 0
+
+    if not provenance.is_leading_slice(record['sources'].get('fluences'), fluences):
+        print("Counts file can't be extended (its fluences have changed)")
+        return 0
+
+    if (len(counts['time']) > len(t_bins)) or (len(table) > len(t_bins)):
+        return 0
+
+    n_counts = count_leading_bins(prev_bins=counts['time'].values, bins=t_bins)
+    n_table = count_leading_bins(prev_bins=table['time'].values, bins=t_bins, atol=1e-6)
+
+    return min(n_counts, n_table)
+
+
 def save_counts(counts, detector, model_set, zams, mixing):
     """Save count table to file
 
@@ -347,12 +596,12 @@ def save_counts(counts, detector, model_set, zams, mixing):
     mixing : str
     """
     path = paths.snow_model_path(model_set=model_set, detector=detector, mixing=mixing)
-    if not os.path.isdir(path):
-        os.makedirs(path)
+    paths.check_dir_exists(path)
 
     filepath = paths.snow_counts_filepath(zams=zams,
                                           model_set=model_set,
                                           detector=detector,
                                           mixing=mixing)
 
-    counts.to_netcdf(filepath)
+    with netcdf_lock:
+        counts.to_netcdf(filepath)
@@ -0,0 +1,145 @@
+import os
+import abc
+import itertools
+import numpy as np
+
+# snowflash
+from snowflash.flash import flash_io
+from snowflash.flash2snowglobes import snow_run, snow_cache, snow_cleanup
+from snowflash.utils import paths
+
+"""
+Detector folding backends, which turn neutrino fluences into detector counts
+
+A backend takes fluence arrays and returns counts arrays,
+so that callers (e.g. in_memory.run_pipeline()) never handle files.
+Backends subclass FoldingBackend and implement:
+    fold(fluences, t_bins, e_bins) -> e_out, {channel: [time, energy]}
+"""
+
+
+class FoldingBackend(abc.ABC):
+    @abc.abstractmethod
+    def fold(self, fluences, t_bins, e_bins):
+        """Fold neutrino fluences with detector response
+
+        Returns : e_out, channel_counts
+            e_out : []
+                energy bins of counts [MeV]
+            channel_counts : {channel: [time, energy]}
+
+        Parameters
+        ----------
+        fluences : xr.DataArray
+            mixed fluences of a single mixing [time, energy, flav]
+        t_bins : []
+            time bins (leftside) [s]
+        e_bins : []
+            energy bins (leftside) [GeV]
+        """
+
+
+class SnowglobesBackend(FoldingBackend):
+    # unique file prefixes of concurrent folds in this process
+    _ids = itertools.count()
+
+    def __init__(self, material, detector, channels,
+                 batch_size=1,
+                 concurrency=1,
+                 timeout=None,
+                 retries=2,
+                 cache=None):
+        """Fold fluences by running snowglobes in the current runtime
+
+        The only files touched are snowglobes' own flux/output files,
+        which are deleted as soon as they're parsed. Point the runtime
+        to memory (e.g. SNOWFLASH_SCRATCH=/dev/shm with
+        snow_run.create_runtime()) to avoid disk I/O entirely.
+        Requires snow_run.setup_snowglobes()
+
+        Parameters
+        ----------
+        material : str
+        detector : str
+        channels : [str]
+            snowglobes channels to fold into, e.g. from analysis.get_all_channels()
+        batch_size : int
+            no. of time bins per snowglobes invocation
+        concurrency : int
+            max no. of snowglobes processes running at once
+        timeout : float
+            max run time per time bin [s]
+        retries : int
+        cache : snow_cache.ResultCache
+        """
+        self.material = material
+        self.detector = detector
+        self.channels = channels
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.cache = cache
+
+    def fold(self, fluences, t_bins, e_bins):
+        """Fold neutrino fluences with detector response, using snowglobes
+
+        Returns : e_out, channel_counts
+            e_out : []
+                energy bins of counts [MeV]
+            channel_counts : {channel: [time, energy]}
+
+        Parameters
+        ----------
+        fluences : xr.DataArray
+            mixed fluences of a single mixing [time, energy, flav]
+        t_bins : []
+            time bins (leftside) [s]
+        e_bins : []
+            energy bins (leftside) [GeV]
+        """
+        # files named as for a model, unique to this fold
+        model_set = f'mem{os.getpid()}'
+        zams = f'{next(self._ids)}'
+        n_bins = len(t_bins)
+        out_path = os.path.join(paths.snow_runtime_path(), 'out')
+
+        try:
+            flash_io.write_snow_fluences(model_set=model_set,
+                                         zams=zams,
+                                         t_bins=t_bins,
+                                         e_bins=e_bins,
+                                         fluences=fluences)
+
+            snow_run.run(model_set=model_set,
+                         zams=zams,
+                         n_bins=n_bins,
+                         material=self.material,
+                         detector=self.detector,
+                         channels=self.channels,
+                         batch_size=self.batch_size,
+                         concurrency=self.concurrency,
+                         timeout=self.timeout,
+                         retries=self.retries,
+                         cache=self.cache)
+
+            e_out = None
+            channel_counts = {}
+
+            for i in range(n_bins):
+                energy, counts = snow_cache.load_outputs(
+                                    input_file=f'pinched_{model_set}_m{zams}_{i + 1}',
+                                    detector=self.detector,
+                                    channels=self.channels,
+                                    out_path=out_path)
+                e_out = energy * 1000  # GeV to MeV
+
+                for channel, chan_counts in counts.items():
+                    channel_counts.setdefault(channel, []).append(chan_counts)
+        finally:
+            snow_cleanup.clean_model(model_set=model_set, zams=zams)
+
+        channel_counts = {channel: np.stack(counts)
+                          for channel, counts in channel_counts.items()}
+
+        return e_out, channel_counts
@@ -0,0 +1,143 @@
+import numpy as np
+
+# snowflash
+from snowflash.flash.flash_model import FlashModel
+from snowflash.flash2snowglobes import analysis, pipeline, snow_run
+from snowflash.flash2snowglobes.folding import SnowglobesBackend
+from snowflash.utils.config import Config
+
+"""
+Run a model through snowglobes entirely in memory, for interactive studies
+
+    FLASH dat -> fluences -> mixing -> detector folding -> counts
+
+Nothing is read from or written to the output tree (fluence, counts,
+or timebin files) unless save=True. The returned counts can be passed
+straight to SnowModel, e.g.:
+
+    counts = run_pipeline(config, zams='12', mixing='normal')
+    model = SnowModel(zams='12', model_set=..., detector=..., mixing='normal',
+                      counts=counts)
+"""
+
+
+def run_pipeline(config, zams, mixing,
+                 model_set=None,
+                 run=None,
+                 backend=None,
+                 save=False):
+    """Run a single model through snowglobes, keeping all data in memory
+
+    Returns : xr.DataArray
+        counts [time, channel, energy], as saved in counts files
+
+    Parameters
+    ----------
+    config : str or Config
+    zams : str
+    mixing : str
+    model_set : str
+        defaults to first of config.model_sets
+    run : str or None
+        defaults to run of zams in config.run_list
+    backend : FoldingBackend
+        defaults to SnowglobesBackend for config detector
+    save : bool
+        also save fluences, counts, and timebin table to the output tree,
+        as pipeline.run_model() would (without a manifest)
+    """
+    config = Config(config)
+
+    if model_set is None:
+        model_set = config.model_sets[0]
+
+    if run is None:
+        run = config.run_list[config.zams_list.index(zams)]
+
+    if backend is None:
+        snow_run.setup_snowglobes(config.paths['snowglobes'])
+        backend = SnowglobesBackend(material=config.material,
+                                    detector=config.detector,
+                                    channels=analysis.get_all_channels(config.channel_groups),
+                                    batch_size=config.batch_size)
+
+    flash_model = FlashModel(zams=zams,
+                             model_set=model_set,
+                             run=run,
+                             config_name=config.name,
+                             recalc=not save,
+                             save=save)
+
+    fluences = flash_model.fluences['mixed'].sel(mix=mixing)
+
+    e_out, channel_counts = backend.fold(fluences=fluences,
+                                         t_bins=flash_model.t_bins,
+                                         e_bins=flash_model.e_bins)
+
+    count_array = get_group_array(channel_counts, channel_groups=config.channel_groups)
+
+    counts = analysis.create_counts(count_array,
+                                    t_bins=flash_model.t_bins,
+                                    e_bins=e_out,
+                                    channel_groups=config.channel_groups)
+
+    if save:
+        save_counts(counts, config=config, model_set=model_set, zams=zams, mixing=mixing,
+                    fluences=flash_model.fluences['mixed'])
+
+    return counts
+
+
+def get_group_array(channel_counts, channel_groups):
+    """Sum channel counts by group
+
+    Returns : [time, group, energy]
+
+    Parameters
+    ----------
+    channel_counts : {channel: [time, energy]}
+    channel_groups : {group: [channel]}
+    """
+    return np.stack([np.sum([channel_counts[chan] for chan in channels], axis=0)
+                     for channels in channel_groups.values()], axis=1)
+
+
+def save_counts(counts, config, model_set, zams, mixing, fluences=None):
+    """Save counts and timebin table to the output tree
+
+    Parameters
+    ----------
+    counts : xr.DataArray
+    config : Config
+    model_set : str
+    zams : str
+    mixing : str
+    fluences : xr.DataArray
+        mixed fluences the counts were folded from, loaded from file if not given
+    """
+    channel_groups = config.channel_groups
+
+    analysis.save_count_array(counts.values,
+                              t_bins=counts['time'].values,
+                              e_bins=counts['energy'].values,
+                              channel_groups=channel_groups,
+                              detector=config.detector,
+                              model_set=model_set,
+                              zams=zams,
+                              mixing=mixing,
+                              attrs=pipeline.get_counts_provenance(config=config,
+                                                                   model_set=model_set,
+                                                                   zams=zams,
+                                                                   mixing=mixing,
+                                                                   fluences=fluences))
+
+    group_counts = [dict(zip(channel_groups, time_counts)) for time_counts in counts.values]
+
+    analysis.save_timebins(timesteps=counts['time'].values,
+                           group_counts=group_counts,
+                           energy_bins=counts['energy'].values,
+                           channel_groups=channel_groups,
+                           detector=config.detector,
+                           model_set=model_set,
+                           zams=zams,
+                           mixing=mixing)
@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import hashlib
+
+# snowflash
+from snowflash.utils import paths, provenance
+
+"""
+Manifest of completed pipeline stages for a single model
+
+Each (model_set, zams, detector, mixing) unit has its own manifest file,
+so concurrent jobs never write to the same manifest.
+
+Each stage entry is keyed by a hash of its inputs and relevant config.
+Keys are chained, so that changing an upstream input invalidates
+all downstream stages.
+"""
+
+stages = ['flash_read', 'fluences', 'mixing', 'flux_write',
+          'snowglobes', 'extraction', 'analysis']
+
+
+class Manifest:
+    def __init__(self, model_set, zams, detector, mixing):
+        """Record of completed pipeline stages for a single model
+
+        Parameters
+        ----------
+        model_set : str
+        zams : str
+        detector : str
+        mixing : str
+        """
+        self.filepath = paths.manifest_filepath(model_set=model_set,
+                                                zams=zams,
+                                                detector=detector,
+                                                mixing=mixing)
+        self.entries = self.load()
+
+    def load(self):
+        """Load manifest entries from file
+
+        Returns : {stage: entry}
+        """
+        try:
+            with open(self.filepath, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save(self):
+        """Atomically write manifest to file
+        """
+        paths.check_dir_exists(os.path.dirname(self.filepath))
+        tmp_filepath = f'{self.filepath}.{os.getpid()}.tmp'
+
+        with open(tmp_filepath, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+
+        os.replace(tmp_filepath, self.filepath)
+
+    def record(self, stage, key, outputs=(), transient=(), stats=None):
+        """Record completed stage
+
+        Parameters
+        ----------
+        stage : str
+        key : str
+            hash of stage inputs, from stage_key()
+        outputs : [str]
+            filepaths of persistent outputs, validated by size/mtime
+        transient : [str]
+            filepaths of temporary outputs, validated by existence only
+        stats : {}
+            measurements of stage run, e.g. duration, used by plan.py
+            to calibrate cost estimates
+        """
+        self.entries[stage] = {'key': key,
+                               'outputs': {f: provenance.file_stamp(f) for f in outputs},
+                               'transient': list(transient),
+                               'time': time.time()}
+        if stats is not None:
+            self.entries[stage]['stats'] = stats
+
+        self.save()
+
+    def is_valid(self, stage, key):
+        """Return True if stage was completed with same inputs, and outputs are intact
+
+        Parameters
+        ----------
+        stage : str
+        key : str
+        """
+        entry = self.entries.get(stage)
+
+        if (entry is None) or (entry['key'] != key):
+            return False
+
+        for filepath, stamp in entry['outputs'].items():
+            current = provenance.file_stamp(filepath)
+
+            if (current is None) or (not provenance.stamps_match(stamp, current)):
+                return False
+
+        return all(os.path.isfile(f) for f in entry['transient'])
+
+
+def stage_key(*inputs):
+    """Return hash of stage inputs
+
+    Returns : str
+
+    Parameters
+    ----------
+    inputs
+        JSON-serializable inputs, e.g. upstream stage keys and config values
+    """
+    string = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha1(string.encode()).hexdigest()
@@ -0,0 +1,962 @@
+import os
+import time
+import queue
+import asyncio
+import shutil
+import threading
+import numpy as np
+
+# snowflash
+from snowflash.flash.flash_model import FlashModel
+from snowflash.flash import flash_io
+from snowflash.flash2snowglobes import analysis, snow_run, snow_cleanup
+from snowflash.flash2snowglobes.manifest import Manifest, stage_key
+from snowflash.utils import paths, provenance, profiling, progress
+
+"""
+Pipeline stages for running a single model through snowglobes:
+    FLASH read -> fluences -> mixing -> flux write
+        -> snowglobes -> extraction -> analysis
+
+Completed stages are recorded in a manifest (see manifest.py),
+so that a rerun skips everything that's already valid
+"""
+
+# rough upper bounds for estimating disk usage
+flux_line_bytes = 120  # one energy bin of a pinched flux file
+out_file_bytes = 10_000  # one snowglobes output file (smeared or unsmeared)
+n_out_ebins = 200  # energy bins of snowglobes output
+n_flavors = 4
+
+
+class DiskSpaceError(Exception):
+    pass
+
+
+def run_model(config, model_set, zams, run, mixing,
+              recalc=False,
+              incremental=False,
+              streaming=False,
+              queue_size=2,
+              max_bins=None,
+              batch_size=None,
+              concurrency=1,
+              timeout=None,
+              retries=2,
+              cache=None):
+    """Run all pipeline stages for a single model
+
+    Blocking wrapper of run_model_async()
+
+    Parameters
+    ----------
+    config : Config
+    model_set : str
+    zams : str
+    run : str or None
+    mixing : str
+    recalc : bool
+        rerun all stages, ignoring manifest and cached fluences
+    incremental : bool
+        only calculate and run time bins that aren't already in the
+        fluence/counts files (e.g. after extending t_end)
+    streaming : bool
+        overlap flux writing, snowglobes, and output parsing of
+        consecutive time bins (see stream_model())
+    queue_size : int
+        max no. of time bins waiting between streaming stages
+    max_bins : int
+        max no. of time bins with files on disk at once when streaming.
+        Defaults to config.max_bins_on_disk
+    batch_size : int
+        no. of time bins per snowglobes invocation.
+        Defaults to config.batch_size
+    concurrency : int
+        max no. of snowglobes processes running at once
+    timeout : float
+        max snowglobes run time per time bin [s]
+    retries : int
+        no. of times to retry a failed time bin
+    cache : snow_cache.ResultCache
+        cache of snowglobes results, to skip runs of identical flux files
+    """
+    asyncio.run(run_model_async(config=config,
+                                model_set=model_set,
+                                zams=zams,
+                                run=run,
+                                mixing=mixing,
+                                recalc=recalc,
+                                incremental=incremental,
+                                streaming=streaming,
+                                queue_size=queue_size,
+                                max_bins=max_bins,
+                                batch_size=batch_size,
+                                concurrency=concurrency,
+                                timeout=timeout,
+                                retries=retries,
+                                cache=cache))
+
+
+async def run_model_async(config, model_set, zams, run, mixing,
+                          recalc=False,
+                          incremental=False,
+                          streaming=False,
+                          queue_size=2,
+                          max_bins=None,
+                          batch_size=None,
+                          concurrency=1,
+                          timeout=None,
+                          retries=2,
+                          slots=None,
+                          cache=None):
+    """Run all pipeline stages for a single model, without blocking the event loop
+
+    Python stages run in a worker thread, and snowglobes as asyncio subprocesses,
+    so that many models can be scheduled concurrently, e.g.:
+        slots = snow_run.get_slots(concurrency=4)
+        await asyncio.gather(*[run_model_async(..., zams=zams, slots=slots)
+                               for zams in zams_list])
+    Concurrent calls must be for different models (model_set, zams)
+
+    Parameters
+    ----------
+    (see run_model)
+    slots : asyncio.Queue
+        runtime slots, from snow_run.get_slots(), shared between concurrent
+        calls to limit the total no. of snowglobes processes
+    """
+    progress.start_unit(model_set, zams, mixing, n_bins=len(config.t_bins))
+    failed = True
+
+    try:
+        await run_stages_async(config=config,
+                               model_set=model_set,
+                               zams=zams,
+                               run=run,
+                               mixing=mixing,
+                               recalc=recalc,
+                               incremental=incremental,
+                               streaming=streaming,
+                               queue_size=queue_size,
+                               max_bins=max_bins,
+                               batch_size=batch_size,
+                               concurrency=concurrency,
+                               timeout=timeout,
+                               retries=retries,
+                               slots=slots,
+                               cache=cache)
+        failed = False
+    finally:
+        progress.finish_unit(model_set, zams, failed=failed)
+
+
+async def run_stages_async(config, model_set, zams, run, mixing,
+                           recalc=False,
+                           incremental=False,
+                           streaming=False,
+                           queue_size=2,
+                           max_bins=None,
+                           batch_size=None,
+                           concurrency=1,
+                           timeout=None,
+                           retries=2,
+                           slots=None,
+                           cache=None):
+    """Run pipeline stages for a single model, skipping those already complete
+
+    Parameters
+    ----------
+    (see run_model_async)
+    """
+    manifest = Manifest(model_set=model_set,
+                        zams=zams,
+                        detector=config.detector,
+                        mixing=mixing)
+
+    keys = get_stage_keys(config=config,
+                          model_set=model_set,
+                          zams=zams,
+                          run=run,
+                          mixing=mixing)
+
+    if batch_size is None:
+        batch_size = config.batch_size
+    if max_bins is None:
+        max_bins = config.max_bins_on_disk
+
+    def is_valid(stage):
+        return (not recalc) and manifest.is_valid(stage, keys[stage])
+
+    if is_valid('extraction') and is_valid('analysis'):
+        print(f'=== Already complete: {model_set} {zams} {mixing} ===')
+        progress.add_bins(model_set, zams, len(config.t_bins), skipped=True)
+        return
+
+    counts_filepath = paths.snow_counts_filepath(zams=zams,
+                                                 model_set=model_set,
+                                                 detector=config.detector,
+                                                 mixing=mixing)
+    timebin_filepath = paths.snow_timebin_filepath(zams=zams,
+                                                   model_set=model_set,
+                                                   detector=config.detector,
+                                                   mixing=mixing)
+    t_bins = config.t_bins
+    n_bins = len(t_bins)
+    channels = analysis.get_all_channels(config.channel_groups)
+    i_start = 0
+
+    if incremental and not recalc:
+        i_start = await snow_run.run_in_thread(count_completed_bins,
+                                               config=config,
+                                               model_set=model_set,
+                                               zams=zams,
+                                               mixing=mixing)
+        print(f'=== Incremental: {i_start}/{n_bins} bins already complete ===')
+        progress.add_bins(model_set, zams, i_start, skipped=True)
+
+        if i_start == n_bins:
+            # counts are reused as they are, so stages aren't recorded as re-run
+            return
+
+    n_new = n_bins - i_start
+    flux_files = flux_filepaths(model_set=model_set, zams=zams,
+                                n_bins=n_bins, i_start=i_start)
+    out_files = out_filepaths(model_set=model_set,
+                              zams=zams,
+                              n_bins=n_bins,
+                              channels=channels,
+                              detector=config.detector,
+                              i_start=i_start)
+
+    if streaming:
+        flash_model = await snow_run.run_in_thread(convert_flash,
+                                                   config=config,
+                                                   model_set=model_set,
+                                                   zams=zams,
+                                                   run=run,
+                                                   recalc=recalc,
+                                                   incremental=incremental,
+                                                   manifest=manifest,
+                                                   keys=keys)
+
+        counts_attrs = get_counts_provenance(config=config,
+                                             model_set=model_set,
+                                             zams=zams,
+                                             mixing=mixing,
+                                             fluences=flash_model.fluences['mixed'])
+
+        # hold one runtime slot for the whole stream
+        slot_path = None if slots is None else await slots.get()
+        t0 = time.time()
+
+        try:
+            with profiling.stage('stream', model_set=model_set, zams=zams, mixing=mixing):
+                await snow_run.run_in_thread(stream_model,
+                                             flash_model=flash_model,
+                                             config=config,
+                                             mixing=mixing,
+                                             i_start=i_start,
+                                             queue_size=queue_size,
+                                             max_bins=max_bins,
+                                             batch_size=batch_size,
+                                             timeout=timeout,
+                                             retries=retries,
+                                             slot_path=slot_path,
+                                             cache=cache,
+                                             attrs=counts_attrs)
+        finally:
+            if slot_path is not None:
+                slots.put_nowait(slot_path)
+
+        stream_stats = {'duration': time.time() - t0, 'n_bins': n_new, 'streaming': True}
+        manifest.record('extraction', keys['extraction'], outputs=[counts_filepath],
+                        stats=stream_stats)
+        manifest.record('analysis', keys['analysis'], outputs=[timebin_filepath])
+
+        print('=== Cleaning up files ===')
+        snow_cleanup.clean_model(model_set=model_set, zams=zams)
+        return
+
+    if not (is_valid('flux_write') and is_valid('snowglobes')):
+        flash_model = await snow_run.run_in_thread(convert_flash,
+                                                   config=config,
+                                                   model_set=model_set,
+                                                   zams=zams,
+                                                   run=run,
+                                                   recalc=recalc,
+                                                   incremental=incremental,
+                                                   manifest=manifest,
+                                                   keys=keys)
+
+        t0 = time.time()
+        await snow_run.run_in_thread(flash_model.write_snow_fluences, mixing, i_start=i_start)
+        manifest.record('flux_write', keys['flux_write'], transient=flux_files,
+                        stats={'duration': time.time() - t0, 'n_bins': n_new})
+
+    if not is_valid('snowglobes'):
+        print('=== Running snowglobes ===')
+        t0 = time.time()
+        with profiling.stage('snowglobes', model_set=model_set, zams=zams, mixing=mixing):
+            await snow_run.run_async(model_set=model_set,
+                                     zams=zams,
+                                     n_bins=n_bins,
+                                     material=config.material,
+                                     detector=config.detector,
+                                     channels=channels,
+                                     i_start=i_start,
+                                     batch_size=batch_size,
+                                     concurrency=concurrency,
+                                     timeout=timeout,
+                                     retries=retries,
+                                     slots=slots,
+                                     cache=cache)
+
+        manifest.record('snowglobes', keys['snowglobes'], transient=out_files,
+                        stats={'duration': time.time() - t0, 'n_bins': n_new})
+    else:
+        progress.add_bins(model_set, zams, n_new, skipped=True)
+
+    print('=== Extracting output ===')
+    if not is_valid('extraction'):
+        t0 = time.time()
+        with profiling.stage('extraction', model_set=model_set, zams=zams, mixing=mixing):
+            await snow_run.run_in_thread(analysis.extract_counts,
+                                         model_set=model_set,
+                                         zams=zams,
+                                         detector=config.detector,
+                                         channel_groups=config.channel_groups,
+                                         mixing=mixing,
+                                         attrs=get_counts_provenance(config=config,
+                                                                     model_set=model_set,
+                                                                     zams=zams,
+                                                                     mixing=mixing),
+                                         i_start=i_start)
+
+        manifest.record('extraction', keys['extraction'], outputs=[counts_filepath],
+                        stats={'duration': time.time() - t0, 'n_bins': n_new})
+
+    if not is_valid('analysis'):
+        t0 = time.time()
+        with profiling.stage('analysis', model_set=model_set, zams=zams, mixing=mixing):
+            await snow_run.run_in_thread(analysis.analyze_output,
+                                         model_set=model_set,
+                                         zams=zams,
+                                         detector=config.detector,
+                                         channel_groups=config.channel_groups,
+                                         mixing=mixing,
+                                         i_start=i_start)
+
+        manifest.record('analysis', keys['analysis'], outputs=[timebin_filepath],
+                        stats={'duration': time.time() - t0, 'n_bins': n_new})
+
+    print('=== Cleaning up files ===')
+    snow_cleanup.clean_model(model_set=model_set, zams=zams)
+
+
+def convert_flash(config, model_set, zams, run, recalc, incremental, manifest, keys):
+    """Load FLASH model and calculate mixed fluences, recording stages in manifest
+
+    Returns : FlashModel
+
+    Parameters
+    ----------
+    config : Config
+    model_set : str
+    zams : str
+    run : str or None
+    recalc : bool
+    incremental : bool
+    manifest : Manifest
+    keys : {stage: key}
+    """
+    print('=== Converting flash data ===')
+    t0 = time.time()
+    flash_model = FlashModel(zams=zams,
+                             model_set=model_set,
+                             run=run,
+                             config_name=config.name,
+                             recalc=recalc,
+                             incremental=incremental)
+    read_stats = None
+
+    if flash_model.dat is not None:  # dat file was read, rather than cached fluences
+        read_stats = {'duration': time.time() - t0,
+                      'dat_bytes': os.path.getsize(flash_model.dat_filepath())}
+
+    fluence_files = {flu_type: paths.model_fluences_filepath(model_set=model_set,
+                                                             zams=zams,
+                                                             flu_type=flu_type)
+                     for flu_type in ['raw', 'mixed']}
+
+    manifest.record('flash_read', keys['flash_read'], stats=read_stats)
+    manifest.record('fluences', keys['fluences'], outputs=[fluence_files['raw']])
+    manifest.record('mixing', keys['mixing'], outputs=[fluence_files['mixed']])
+
+    return flash_model
+
+
+# =======================================================
+#                 Streaming
+# =======================================================
+def stream_model(flash_model, config, mixing,
+                 i_start=0,
+                 queue_size=2,
+                 max_bins=None,
+                 batch_size=1,
+                 timeout=None,
+                 retries=2,
+                 slot_path=None,
+                 cache=None,
+                 attrs=None):
+    """Run time bins through snowglobes as a streaming pipeline
+
+    Three stages run concurrently, connected by bounded queues:
+        write flux file (bin i+2) -> snowglobes (bin i+1) -> parse output (bin i)
+    so that total time approaches that of the slowest stage.
+    If batch_size > 1, each stage handles a batch of bins at a time.
+    Each bin's flux and output files are deleted as soon as they're parsed.
+    Counts and timebin table are saved as by extract_counts()/analyze_output()
+
+    Parameters
+    ----------
+    flash_model : FlashModel
+    config : Config
+    mixing : str
+    i_start : int
+        index of first time bin to run
+    queue_size : int
+        max no. of time bins (or batches) waiting between stages
+    max_bins : int
+        max no. of time bins with files on disk at once (high-water mark),
+        rounded up to a whole no. of batches. If None, limited only by queue_size
+    batch_size : int
+        no. of time bins per snowglobes invocation
+    timeout : float
+        max snowglobes run time per time bin [s]
+    retries : int
+        no. of times to retry a failed time bin
+    slot_path : str
+        runtime slot to run snowglobes in (see snow_run.get_slots()),
+        defaults to the runtime itself
+    cache : snow_cache.ResultCache
+    attrs : {}
+        metadata (e.g. provenance) to attach to counts file
+    """
+    print('=== Streaming snowglobes ===')
+    model_set = flash_model.model_set
+    zams = flash_model.zams
+    t_bins = flash_model.t_bins
+    fluences = flash_model.fluences['mixed'].sel(mix=mixing)
+    channels = analysis.get_all_channels(config.channel_groups)
+    n_groups = len(config.channel_groups)
+
+    flash_io.write_snow_key(model_set=model_set, zams=zams, t_bins=t_bins)
+
+    def write(batch):
+        for i in batch:
+            flash_io.write_snow_fluence_bin(i=i,
+                                            model_set=model_set,
+                                            zams=zams,
+                                            e_bins=flash_model.e_bins,
+                                            fluences=fluences)
+        return batch
+
+    def fold(batch):
+        if len(batch) > 1:
+            snow_run.run_batch(model_set=model_set,
+                               zams=zams,
+                               idxs=np.array(batch) + 1,
+                               material=config.material,
+                               detector=config.detector,
+                               channels=channels,
+                               timeout=timeout,
+                               retries=retries,
+                               slot_path=slot_path,
+                               cache=cache)
+        else:
+            snow_run.run_bin(model_set=model_set,
+                             zams=zams,
+                             i=batch[0] + 1,
+                             material=config.material,
+                             detector=config.detector,
+                             channels=channels,
+                             timeout=timeout,
+                             retries=retries,
+                             slot_path=slot_path,
+                             cache=cache)
+        return batch
+
+    n_new = len(t_bins) - i_start
+    batches = snow_run.get_batches(list(range(i_start, len(t_bins))), batch_size=batch_size)
+    max_batches = None if max_bins is None else max(1, -(-max_bins // batch_size))
+    e_bins = None
+    count_array = None
+
+    for batch in stream(batches,
+                        stages=[write, fold],
+                        queue_size=queue_size,
+                        max_pending=max_batches):
+        for i in batch:
+            if e_bins is None:
+                e_bins = analysis.load_energy_bins(channel=channels[0],
+                                                   i=i + 1,
+                                                   model_set=model_set,
+                                                   zams=zams,
+                                                   detector=config.detector)
+                count_array = np.zeros([n_new, n_groups, len(e_bins)])
+
+            count_array[i - i_start] = analysis.load_group_counts(
+                                            channels=channels,
+                                            channel_groups=config.channel_groups,
+                                            i=i + 1,
+                                            n_ebins=len(e_bins),
+                                            model_set=model_set,
+                                            zams=zams,
+                                            detector=config.detector)
+
+            snow_cleanup.clean_bin(model_set=model_set, zams=zams, i=i + 1)
+
+    group_counts = [dict(zip(config.channel_groups, counts)) for counts in count_array]
+
+    save_kwargs = {'channel_groups': config.channel_groups,
+                   'detector': config.detector,
+                   'model_set': model_set,
+                   'zams': zams,
+                   'mixing': mixing,
+                   'i_start': i_start}
+
+    analysis.save_count_array(count_array,
+                              t_bins=t_bins[i_start:],
+                              e_bins=e_bins,
+                              attrs=attrs,
+                              **save_kwargs)
+
+    analysis.save_timebins(timesteps=t_bins[i_start:],
+                           group_counts=group_counts,
+                           energy_bins=e_bins,
+                           **save_kwargs)
+
+
+class _StageError:
+    def __init__(self, err):
+        """Wraps an exception raised in a streaming stage
+        """
+        self.err = err
+
+
+def stream(items, stages, queue_size=2, max_pending=None):
+    """Pass items through a chain of stages, each running in its own thread
+
+    Stages are connected by bounded queues, so that while the consumer
+    handles item i, item i+1 can be in the last stage, item i+2 in the one
+    before, and so on. An exception in any stage is re-raised in the consumer.
+
+    If max_pending is given, no new item enters the first stage until the
+    consumer has finished with an earlier one (i.e. requests the next result)
+
+    Returns : generator
+        results of final stage, in order
+
+    Parameters
+    ----------
+    items : iterable
+    stages : [callable]
+        functions applied in order to each item
+    queue_size : int
+        max no. of items waiting between stages
+    max_pending : int
+        max no. of items between entering first stage and being released
+        by the consumer, including any waiting in queues
+    """
+    done = object()
+    stop = threading.Event()
+    pending = None if max_pending is None else threading.Semaphore(max_pending)
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def acquire():
+        while not stop.is_set():
+            if (pending is None) or pending.acquire(timeout=0.1):
+                return True
+        return False
+
+    def feed():
+        for item in items:
+            if not acquire():
+                return
+            put(queues[0], item)
+        put(queues[0], done)
+
+    def work(func, q_in, q_out):
+        while not stop.is_set():
+            try:
+                item = q_in.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            if (item is done) or isinstance(item, _StageError):
+                put(q_out, item)
+                return
+
+            try:
+                put(q_out, func(item))
+            except Exception as err:
+                put(q_out, _StageError(err))
+                return
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for k, func in enumerate(stages):
+        threads += [threading.Thread(target=work,
+                                     args=(func, queues[k], queues[k + 1]),
+                                     daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = queues[-1].get()
+
+            if item is done:
+                break
+            elif isinstance(item, _StageError):
+                raise item.err
+
+            yield item
+
+            if pending is not None:
+                pending.release()
+    finally:
+        stop.set()
+
+        for thread in threads:
+            thread.join()
+
+
+# =======================================================
+#                 Stage keys
+# =======================================================
+def get_stage_keys(config, model_set, zams, run, mixing):
+    """Return hash keys of all pipeline stages
+
+    Returns : {stage: key}
+
+    Parameters
+    ----------
+    config : Config
+    model_set : str
+    zams : str
+    run : str or None
+    mixing : str
+    """
+    dat_filepath = paths.flash_dat_filepath(models_path=config.paths['models'],
+                                            model_set=model_set,
+                                            zams=zams,
+                                            run=run)
+    bins = provenance.get_bin_params(config)
+    keys = {}
+
+    keys['flash_read'] = stage_key(provenance.file_stamp(dat_filepath),
+                                   bins['t_start'], bins['t_end'])
+    keys['fluences'] = stage_key(keys['flash_read'], bins, config.distance)
+    keys['mixing'] = stage_key(keys['fluences'], list(config.mixing))
+    keys['flux_write'] = stage_key(keys['mixing'], mixing)
+    keys['snowglobes'] = stage_key(keys['flux_write'],
+                                   config.detector,
+                                   config.material,
+                                   config.paths['snowglobes'])
+    keys['extraction'] = stage_key(keys['snowglobes'], config.channel_groups)
+    keys['analysis'] = stage_key(keys['extraction'])
+
+    return keys
+
+
+def count_completed_bins(config, model_set, zams, mixing):
+    """Return number of leading time bins already counted, for incremental runs
+
+    Returns : int
+
+    Parameters
+    ----------
+    config : Config
+    model_set : str
+    zams : str
+    mixing : str
+    """
+    fluences = get_mixing_fluences(model_set=model_set, zams=zams, mixing=mixing)
+
+    return analysis.count_completed_bins(t_bins=config.t_bins,
+                                         detector=config.detector,
+                                         model_set=model_set,
+                                         zams=zams,
+                                         mixing=mixing,
+                                         params=get_counts_params(config=config,
+                                                                  mixing=mixing),
+                                         fluences=fluences)
+
+
+def get_counts_provenance(config, model_set, zams, mixing, fluences=None):
+    """Return provenance attributes for counts file
+
+    Returns : {}
+
+    Parameters
+    ----------
+    config : Config
+    model_set : str
+    zams : str
+    mixing : str
+    fluences : xr.DataArray
+        mixed fluences the counts were folded from (see get_counts_sources())
+    """
+    params = get_counts_params(config=config, mixing=mixing)
+    sources = get_counts_sources(model_set=model_set, zams=zams, mixing=mixing,
+                                 fluences=fluences)
+
+    return provenance.get_provenance(params=params, sources=sources)
+
+
+def get_counts_params(config, mixing):
+    """Return parameters that counts files depend on
+
+    Returns : {}
+
+    Parameters
+    ----------
+    config : Config
+    mixing : str
+    """
+    params = provenance.get_bin_params(config)
+    params.update({'distance': config.distance,
+                   'mixing': mixing,
+                   'detector': config.detector,
+                   'material': config.material,
+                   'channel_groups': config.channel_groups})
+
+    return params
+
+
+def get_counts_sources(model_set, zams, mixing, fluences=None):
+    """Return stamps of sources that counts files depend on
+
+    The fluences are stamped by the contents of the counts' own mixing,
+    rather than the whole (shared) fluences file, so that extending it
+    in time (e.g. while running another mixing) doesn't invalidate
+    the bins already counted (see analysis.count_completed_bins())
+
+    Returns : {name: stamp}
+
+    Parameters
+    ----------
+    model_set : str
+    zams : str
+    mixing : str
+    fluences : xr.DataArray
+        mixed fluences of all mixings, loaded from file if not given
+    """
+    values = get_mixing_fluences(model_set=model_set, zams=zams, mixing=mixing,
+                                 fluences=fluences)
+    stamp = None
+
+    if values is not None:
+        stamp = provenance.array_stamp(values)
+        stamp['path'] = paths.model_fluences_filepath(model_set=model_set,
+                                                      zams=zams,
+                                                      flu_type='mixed')
+
+    return {'fluences': stamp}
+
+
+def get_mixing_fluences(model_set, zams, mixing, fluences=None):
+    """Return mixed fluences of a single mixing
+
+    Returns : [time, energy, flav]
+        or None if there's no fluences file
+
+    Parameters
+    ----------
+    model_set : str
+    zams : str
+    mixing : str
+    fluences : xr.DataArray
+        mixed fluences of all mixings, loaded from file if not given
+    """
+    if fluences is None:
+        try:
+            fluences = flash_io.load_fluences(zams=zams, model_set=model_set,
+                                              flu_type='mixed')
+        except FileNotFoundError:
+            return None
+
+    return fluences.sel(mix=mixing).transpose('time', ...).values
+
+
+# =======================================================
+#                 Files
+# =======================================================
+def flux_filepaths(model_set, zams, n_bins, i_start=0):
+    """Return filepaths of snowglobes flux inputs, including key file
+
+    Returns : [str]
+
+    Parameters
+    ----------
+    model_set : str
+    zams : str
+    n_bins : int
+    i_start : int
+        index of first time bin
+    """
+    filepaths = [paths.snow_channel_dat_key_filepath(zams=zams, model_set=model_set)]
+
+    for i in np.arange(i_start, n_bins) + 1:
+        filepaths += [paths.snow_fluence_filepath(i=i, zams=zams, model_set=model_set)]
+
+    return filepaths
+
+
+def out_filepaths(model_set, zams, n_bins, channels, detector, i_start=0):
+    """Return filepaths of snowglobes outputs
+
+    Returns : [str]
+
+    Parameters
+    ----------
+    model_set : str
+    zams : str
+    n_bins : int
+    channels : [str]
+    detector : str
+    i_start : int
+        index of first time bin
+    """
+    filepaths = []
+
+    for i in np.arange(i_start, n_bins) + 1:
+        for channel in channels:
+            filepaths += [paths.snow_channel_dat_filepath(channel=channel,
+                                                          i=i,
+                                                          model_set=model_set,
+                                                          zams=zams,
+                                                          detector=detector)]
+    return filepaths
+
+
+# =======================================================
+#                 Disk space
+# =======================================================
+def get_n_parallel(n_models, concurrency=1, workers=1, queue=False):
+    """Return max no. of models running at once
+
+    In a pool of workers, or from a work queue, each worker runs one model at a time.
+    Otherwise, up to `concurrency` models run in the driver's runtime
+
+    Parameters
+    ----------
+    n_models : int
+    concurrency : int
+    workers : int
+    queue : bool
+        whether models are claimed from a work queue
+    """
+    per_run = workers if (workers > 1) or queue else concurrency
+    return max(1, min(n_models, per_run))
+
+
+def check_disk_space(config, streaming=False, max_bins=None, concurrency=1):
+    """Check there is enough free space for the scratch and output files of a run
+
+    Raises DiskSpaceError if not
+
+    Parameters
+    ----------
+    config : Config
+    streaming : bool
+    max_bins : int
+        max no. of time bins with files on disk at once when streaming
+    concurrency : int
+        max no. of models running at once
+    """
+    scratch_bytes, output_bytes = estimate_disk_usage(config=config,
+                                                      streaming=streaming,
+                                                      max_bins=max_bins,
+                                                      concurrency=concurrency)
+    scratch_path = existing_parent(paths.scratch_path())
+    output_path = existing_parent(paths.output_path())
+
+    required = {scratch_path: scratch_bytes, output_path: output_bytes}
+
+    if os.stat(scratch_path).st_dev == os.stat(output_path).st_dev:
+        required = {output_path: scratch_bytes + output_bytes}
+
+    for path, n_bytes in required.items():
+        free = shutil.disk_usage(path).free
+        print(f'Disk space at {path}: {n_bytes / 1e9:.3f} GB needed, '
+              f'{free / 1e9:.3f} GB free')
+
+        if free < n_bytes:
+            raise DiskSpaceError(f'Not enough free space at {path}: '
+                                 f'{n_bytes / 1e9:.3f} GB needed, '
+                                 f'{free / 1e9:.3f} GB free')
+
+
+def estimate_disk_usage(config, streaming=False, max_bins=None, concurrency=1):
+    """Estimate peak scratch usage and total output size of a run
+
+    Scratch holds the flux/output files of the models currently running,
+    while output accumulates fluences, counts, and timebin tables of all models
+
+    Returns : scratch_bytes, output_bytes
+
+    Parameters
+    ----------
+    config : Config
+    streaming : bool
+    max_bins : int
+        max no. of time bins with files on disk at once when streaming
+    concurrency : int
+        max no. of models running at once
+    """
+    n_bins = len(config.t_bins)
+    n_ebins = len(config.e_bins)
+    n_channels = len(analysis.get_all_channels(config.channel_groups))
+    n_groups = len(config.channel_groups)
+    n_mixing = len(config.mixing)
+    n_models = len(config.model_sets) * len(config.zams_list)
+
+    if streaming:
+        max_bins = config.max_bins_on_disk if max_bins is None else max_bins
+
+    bins_on_disk = n_bins if max_bins is None else min(n_bins, max_bins)
+
+    bin_bytes = n_ebins * flux_line_bytes + 2 * n_channels * out_file_bytes
+    scratch_bytes = min(concurrency, n_models) * bins_on_disk * bin_bytes
+
+    fluence_bytes = (1 + n_mixing) * n_bins * n_ebins * n_flavors * 8
+    counts_bytes = n_mixing * n_bins * n_groups * n_out_ebins * 8
+    output_bytes = n_models * (fluence_bytes + counts_bytes)
+
+    return scratch_bytes, output_bytes
+
+
+def existing_parent(path):
+    """Return path, or its closest parent directory that exists
+
+    Returns : str
+
+    Parameters
+    ----------
+    path : str
+    """
+    path = os.path.abspath(path)
+
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+
+    return path
@@ -0,0 +1,446 @@
+import os
+import json
+import math
+
+# snowflash
+from snowflash.flash2snowglobes import analysis, pipeline
+from snowflash.utils import paths
+
+"""
+Pre-flight planner: validate a run and estimate its cost before running it
+
+Checks config paths, that every FLASH dat file exists and covers the
+[bins] time range (reading only the head up to bounce, and the last line),
+and that there's enough disk space. Then estimates the no. of snowglobes
+invocations, intermediate files, peak memory, and wall time.
+
+Wall time is projected from the stage durations recorded in the manifests
+of previous runs with the same detector (see Manifest.record()),
+falling back to rough defaults if there are none
+"""
+
+# rough defaults, used if there are no previous runs to calibrate from
+default_rates = {'convert': 2e-8,  # reading dat file and calculating fluences [s/byte]
+                 'bin': 1.0,  # flux write, snowglobes, extraction, analysis [s/time bin]
+                 'stream': 0.5,  # streaming equivalent of 'bin' [s/time bin]
+                 }
+bin_stages = ['flux_write', 'snowglobes', 'extraction', 'analysis']
+
+# rough memory usage
+base_rss = 300e6  # python with numpy/pandas/xarray imported
+snowglobes_rss = 50e6  # single snowglobes process
+loadtxt_overhead = 2  # peak memory of np.loadtxt() relative to its output
+n_dat_cols = 11  # columns read by flash_io.read_datfile()
+i_rshock = 11  # column of shock radius, used to find bounce
+min_dat_cols = 42
+
+
+def plan_run(config, units,
+             streaming=False,
+             max_bins=None,
+             batch_size=None,
+             concurrency=1,
+             workers=1,
+             queue=False):
+    """Validate a run and estimate its cost
+
+    Returns : {}
+        'problems' : [str]
+            anything that would make the run fail
+        'units' : [{}]
+            estimates for each work unit
+        'totals' : {}
+            estimates for the whole run
+        'rates' : {stage: (rate, n_samples)}
+            calibrated cost rates
+
+    Parameters
+    ----------
+    config : Config
+    units : [(model_set, zams, run, mixing)]
+    streaming : bool
+    max_bins : int
+    batch_size : int
+        defaults to config.batch_size
+    concurrency : int
+    workers : int
+    queue : bool
+        whether models are claimed from a work queue
+    """
+    if batch_size is None:
+        batch_size = config.batch_size
+    if streaming and max_bins is None:
+        max_bins = config.max_bins_on_disk
+
+    problems = check_paths(config)
+    rates = get_rates(config)
+
+    t_bins = config.t_bins
+    n_bins = len(t_bins)
+    n_channels = len(analysis.get_all_channels(config.channel_groups))
+    bin_rate = rates['stream' if streaming else 'bin'][0]
+
+    models = {}
+    rows = []
+
+    for model_set, zams, run, mixing in units:
+        model = (model_set, zams, run)
+        is_new = model not in models
+
+        if is_new:
+            models[model] = check_model(config, model_set=model_set, zams=zams, run=run)
+            if models[model]['problem'] is not None:
+                problems += [models[model]['problem']]
+
+        dat_bytes = models[model]['dat_bytes']
+        seconds = n_bins * bin_rate
+
+        if is_new:  # later mixings reuse the model's fluences
+            seconds += dat_bytes * rates['convert'][0]
+
+        rows += [{'model_set': model_set,
+                  'zams': zams,
+                  'mixing': mixing,
+                  'n_bins': n_bins,
+                  'dat_mb': dat_bytes / 1e6,
+                  'invocations': math.ceil(n_bins / batch_size),
+                  'seconds': seconds}]
+
+    n_parallel = pipeline.get_n_parallel(len(models), concurrency=concurrency,
+                                         workers=workers, queue=queue)
+
+    bins_on_disk = n_bins if max_bins is None else min(n_bins, max_bins)
+    bin_files = 1 + 2 * n_channels  # flux file, smeared/unsmeared output per channel
+
+    scratch_bytes, output_bytes = pipeline.estimate_disk_usage(config=config,
+                                                               streaming=streaming,
+                                                               max_bins=max_bins,
+                                                               concurrency=n_parallel)
+    try:
+        pipeline.check_disk_space(config=config,
+                                  streaming=streaming,
+                                  max_bins=max_bins,
+                                  concurrency=n_parallel)
+    except pipeline.DiskSpaceError as err:
+        problems += [str(err)]
+
+    model_rss = max([get_model_rss(config, dat_bytes=m['dat_bytes'],
+                                   line_bytes=m['line_bytes'])
+                     for m in models.values()], default=0)
+
+    totals = {'n_units': len(rows),
+              'invocations': sum(row['invocations'] for row in rows),
+              'files': len(rows) * (n_bins * bin_files + 1),
+              'peak_files': n_parallel * (bins_on_disk * bin_files + 1),
+              'scratch_gb': scratch_bytes / 1e9,
+              'output_gb': output_bytes / 1e9,
+              'peak_rss_gb': (base_rss + n_parallel * model_rss
+                              + workers * concurrency * snowglobes_rss) / 1e9,
+              'serial_hours': sum(row['seconds'] for row in rows) / 3600,
+              'wall_hours': sum(row['seconds'] for row in rows) / 3600 / n_parallel,
+              'n_parallel': n_parallel}
+
+    return {'problems': problems, 'units': rows, 'totals': totals, 'rates': rates}
+
+
+def print_plan(plan):
+    """Print plan from plan_run()
+
+    Parameters
+    ----------
+    plan : {}
+    """
+    print(f"{'model_set':<16}{'zams':<8}{'mixing':<10}{'n_bins':>8}"
+          f"{'dat [MB]':>10}{'calls':>8}{'time [s]':>10}")
+
+    for row in plan['units']:
+        print(f"{row['model_set']:<16}{row['zams']:<8}{row['mixing']:<10}"
+              f"{row['n_bins']:>8}{row['dat_mb']:>10.1f}{row['invocations']:>8}"
+              f"{row['seconds']:>10.1f}")
+
+    totals = plan['totals']
+    print(f"\nWork units:             {totals['n_units']}"
+          f"\nSnowglobes invocations: {totals['invocations']}"
+          f"\nIntermediate files:     {totals['files']} "
+          f"(peak {totals['peak_files']} on disk)"
+          f"\nScratch (peak):         {totals['scratch_gb']:.3f} GB"
+          f"\nOutput:                 {totals['output_gb']:.3f} GB"
+          f"\nMemory (peak):          {totals['peak_rss_gb']:.2f} GB"
+          f"\nSerial time:            {totals['serial_hours']:.2f} h"
+          f"\nWall time:              {totals['wall_hours']:.2f} h "
+          f"({totals['n_parallel']} models at once)")
+
+    print('\nCost rates:')
+    for stage, (rate, n_samples) in plan['rates'].items():
+        source = f'{n_samples} previous runs' if n_samples > 0 else 'default'
+        print(f'  {stage:<8} {rate:.3g} ({source})')
+
+    if len(plan['problems']) > 0:
+        print(f"\n{len(plan['problems'])} PROBLEM(S):")
+        for problem in plan['problems']:
+            print(f'  {problem}')
+    else:
+        print('\nNo problems found')
+
+
+# =======================================================
+#                 Validation
+# =======================================================
+def check_paths(config):
+    """Check that config paths exist, and output/scratch roots are writable
+
+    Returns : [str]
+        problems found
+
+    Parameters
+    ----------
+    config : Config
+    """
+    problems = []
+    snowglobes_path = config.paths['snowglobes']
+
+    if not os.path.isdir(config.paths['models']):
+        problems += [f"models path not found: {config.paths['models']}"]
+
+    if not os.path.isfile(os.path.join(snowglobes_path, 'supernova.pl')):
+        problems += [f'snowglobes installation not found: {snowglobes_path}']
+
+    for name, path in [('output', paths.output_path()),
+                       ('scratch', paths.scratch_path())]:
+        parent = pipeline.existing_parent(path)
+
+        if not os.access(parent, os.W_OK):
+            problems += [f'{name} path not writable: {path}']
+
+    return problems
+
+
+def check_model(config, model_set, zams, run):
+    """Check that a model's dat file exists and covers the config time bins
+
+    Returns : {}
+        'dat_bytes' : int
+        'line_bytes' : int
+        'problem' : str or None
+
+    Parameters
+    ----------
+    config : Config
+    model_set : str
+    zams : str
+    run : str or None
+    """
+    filepath = paths.flash_dat_filepath(models_path=config.paths['models'],
+                                        model_set=model_set,
+                                        zams=zams,
+                                        run=run)
+    model = {'dat_bytes': 0, 'line_bytes': 1, 'problem': None}
+    name = f'{model_set} {zams}'
+
+    try:
+        coverage = read_dat_coverage(filepath)
+    except FileNotFoundError:
+        model['problem'] = f'{name}: dat file not found: {filepath}'
+        return model
+    except ValueError as err:
+        model['problem'] = f'{name}: {err}: {filepath}'
+        return model
+
+    model['dat_bytes'] = coverage['dat_bytes']
+    model['line_bytes'] = coverage['line_bytes']
+
+    t_start = config.bins['t_start']
+    t_end = config.bins['t_end']
+
+    # as in flash_io.get_slice_idxs()
+    if coverage['t_first'] >= coverage['t_bounce'] + t_start:
+        model['problem'] = (f"{name}: t_start={t_start} is outside simulation time "
+                            f"(starts {coverage['t_first'] - coverage['t_bounce']:.4f} s "
+                            f"from bounce)")
+
+    elif coverage['t_last'] < coverage['t_bounce'] + t_end:
+        model['problem'] = (f"{name}: t_end={t_end} is outside simulation time "
+                            f"(ends {coverage['t_last'] - coverage['t_bounce']:.4f} s "
+                            f"after bounce)")
+
+    return model
+
+
+def read_dat_coverage(filepath):
+    """Read time range of a FLASH dat file, without loading all of it
+
+    Reads lines only up to bounce (first non-zero shock radius),
+    then seeks to the last line
+
+    Returns : {}
+        't_first', 't_bounce', 't_last' : float
+            simulation times [s]
+        'dat_bytes' : int
+        'line_bytes' : int
+            length of last line
+
+    Parameters
+    ----------
+    filepath : str
+    """
+    dat_bytes = os.path.getsize(filepath)
+    t_first = None
+    t_bounce = None
+
+    with open(filepath, 'rb') as f:
+        for line in f:
+            cols = line.split()
+
+            if len(cols) == 0:
+                continue
+            if len(cols) < min_dat_cols:
+                raise ValueError(f'dat file has {len(cols)} columns, '
+                                 f'expected {min_dat_cols}')
+            if t_first is None:
+                t_first = float(cols[0])
+            if float(cols[i_rshock]) >= 1:
+                t_bounce = float(cols[0])
+                break
+
+        if t_bounce is None:
+            raise ValueError('no bounce found in dat file')
+
+        last_line = read_last_line(f, dat_bytes=dat_bytes)
+
+    return {'t_first': t_first,
+            't_bounce': t_bounce,
+            't_last': float(last_line.split()[0]),
+            'dat_bytes': dat_bytes,
+            'line_bytes': len(last_line)}
+
+
+def read_last_line(f, dat_bytes, chunk_bytes=4096):
+    """Return last non-empty line of a file
+
+    Returns : bytes
+
+    Parameters
+    ----------
+    f : file
+        opened in binary mode
+    dat_bytes : int
+        file size
+    chunk_bytes : int
+        initial no. of bytes to read from end of file
+    """
+    while True:
+        start = max(0, dat_bytes - chunk_bytes)
+        f.seek(start)
+        lines = f.read().splitlines()
+
+        # first line of chunk may be partial, unless at start of file
+        lines = [line for line in lines[(start > 0):] if line.strip()]
+
+        if len(lines) > 0:
+            return lines[-1]
+        if start == 0:
+            raise ValueError('dat file is empty')
+
+        chunk_bytes *= 2
+
+
+# =======================================================
+#                 Estimates
+# =======================================================
+def get_rates(config):
+    """Calibrate cost rates from stage durations recorded in manifests
+
+    Returns : {stage: (rate, n_samples)}
+        'convert' [s/dat byte], 'bin' and 'stream' [s/time bin]
+
+    Parameters
+    ----------
+    config : Config
+    """
+    sums = {stage: [0.0, 0, 0] for stage in ['flash_read', 'stream'] + bin_stages}
+
+    for entries in load_manifests(config):
+        for stage, entry in entries.items():
+            stats = entry.get('stats')
+
+            if stats is None:
+                continue
+            if stage == 'extraction' and stats.get('streaming'):
+                stage = 'stream'
+
+            size = stats['dat_bytes'] if stage == 'flash_read' else stats['n_bins']
+
+            if size > 0:
+                sums[stage][0] += stats['duration']
+                sums[stage][1] += size
+                sums[stage][2] += 1
+
+    def get_rate(stage, default):
+        duration, size, n_samples = sums[stage]
+        return (duration / size, n_samples) if n_samples > 0 else (default, 0)
+
+    rates = {'convert': get_rate('flash_read', default_rates['convert']),
+             'stream': get_rate('stream', default_rates['stream'])}
+
+    # per-bin stages are calibrated separately, falling back if any are missing
+    bin_rates = [get_rate(stage, None) for stage in bin_stages]
+
+    if all(n_samples > 0 for _, n_samples in bin_rates):
+        rates['bin'] = (sum(rate for rate, _ in bin_rates),
+                        min(n_samples for _, n_samples in bin_rates))
+    else:
+        rates['bin'] = (default_rates['bin'], 0)
+
+    return rates
+
+
+def load_manifests(config):
+    """Load manifest entries of all models in config model sets, for config detector
+
+    Returns : [{stage: entry}]
+
+    Parameters
+    ----------
+    config : Config
+    """
+    manifests = []
+
+    for model_set in config.model_sets:
+        path = os.path.join(paths.model_set_path(model_set), 'manifest')
+        prefix = f'manifest_{config.detector}_'
+
+        if not os.path.isdir(path):
+            continue
+
+        for filename in sorted(os.listdir(path)):
+            if filename.startswith(prefix) and filename.endswith('.json'):
+                try:
+                    with open(os.path.join(path, filename), 'r') as f:
+                        manifests += [json.load(f)]
+                except (OSError, json.JSONDecodeError):
+                    continue
+
+    return manifests
+
+
+def get_model_rss(config, dat_bytes, line_bytes):
+    """Estimate peak memory of running a single model
+
+    Returns : float
+        [bytes]
+
+    Parameters
+    ----------
+    config : Config
+    dat_bytes : int
+    line_bytes : int
+    """
+    n_bins = len(config.t_bins)
+    n_ebins = len(config.e_bins)
+    n_lines = dat_bytes / line_bytes
+
+    dat_rss = loadtxt_overhead * n_lines * n_dat_cols * 8
+    fluence_rss = (1 + len(config.mixing)) * n_bins * n_ebins * pipeline.n_flavors * 8
+    counts_rss = n_bins * len(config.channel_groups) * pipeline.n_out_ebins * 8
+
+    return dat_rss + fluence_rss + counts_rss
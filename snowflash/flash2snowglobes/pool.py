@@ -0,0 +1,193 @@
+import os
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# snowflash
+from snowflash.flash2snowglobes import pipeline, snow_run, snow_cleanup, work_queue
+from snowflash.utils import paths, profiling, progress
+
+"""
+Run models in a pool of worker processes
+
+Each worker process has its own private snowglobes runtime
+(<scratch>/<runtime_name>_w<pid>), and each model (model_set, zams)
+has its own manifest and output files, so workers never share files
+"""
+
+
+def run_pool(config, units, runtime_name, n_workers, **kwargs):
+    """Run models in a pool of worker processes
+
+    A failed model is reported without stopping the others
+
+    Returns : [(model_set, zams, error)]
+        failed models, with error messages
+
+    Parameters
+    ----------
+    config : Config
+    units : [(model_set, zams, run, [mixing])]
+        models to run, each for the given mixings
+    runtime_name : str
+        prefix of worker runtime names
+    n_workers : int
+    **kwargs
+        passed to pipeline.run_model()
+    """
+    failed = []
+
+    # fork, so that workers don't re-run the driver script on import
+    context = multiprocessing.get_context('fork')
+
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 mp_context=context,
+                                 initializer=init_worker,
+                                 initargs=(runtime_name, progress.get_queue())) as executor:
+            futures = {executor.submit(run_unit, config, *unit, **kwargs): unit
+                       for unit in units}
+
+            for future in as_completed(futures):
+                model_set, zams, _, _ = futures[future]
+
+                try:
+                    error, records = future.result()
+                    profiling.add_records(records)
+                except Exception as err:  # e.g. worker killed
+                    error = f'{type(err).__name__}: {err}'
+
+                if error is None:
+                    print(f'=== Finished: {model_set} {zams} ===')
+                else:
+                    print(f'=== FAILED: {model_set} {zams} ===\n{error}')
+                    failed += [(model_set, zams, error)]
+    finally:
+        remove_worker_runtimes(runtime_name)
+
+    return failed
+
+
+def run_queue_pool(config, queue, runtime_name, n_workers, **kwargs):
+    """Run units from a work queue in a pool of worker processes
+
+    Returns : [(model_set, zams, error)]
+        units that failed in this pool
+
+    Parameters
+    ----------
+    config : Config
+    queue : WorkQueue
+    runtime_name : str
+        prefix of worker runtime names
+    n_workers : int
+    **kwargs
+        passed to work_queue.run_worker()
+    """
+    failed = []
+    context = multiprocessing.get_context('fork')
+
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 mp_context=context,
+                                 initializer=init_worker,
+                                 initargs=(runtime_name, progress.get_queue())) as executor:
+            futures = [executor.submit(run_queue_worker, config, queue, **kwargs)
+                       for _ in range(n_workers)]
+
+            for future in as_completed(futures):
+                try:
+                    worker_failed, records = future.result()
+                    failed += worker_failed
+                    profiling.add_records(records)
+                except Exception as err:  # e.g. worker killed; its unit will go stale
+                    print(f'=== Worker FAILED: {type(err).__name__}: {err} ===')
+    finally:
+        remove_worker_runtimes(runtime_name)
+
+    return failed
+
+
+def init_worker(runtime_name, events=None):
+    """Create private runtime for worker process, and send progress to driver
+
+    Parameters
+    ----------
+    runtime_name : str
+    events : multiprocessing.Queue
+        from progress.get_queue()
+    """
+    snow_run.create_runtime(f'{runtime_name}_w{os.getpid()}')
+    progress.set_queue(events)
+
+
+def run_unit(config, model_set, zams, run, mixings, **kwargs):
+    """Run a single model for the given mixings, in a worker process
+
+    Returns : error, records
+        error : str or None
+            error traceback, or None if successful
+        records : [{}]
+            profiled stages, from profiling.pop_records()
+
+    Parameters
+    ----------
+    config : Config
+    model_set : str
+    zams : str
+    run : str or None
+    mixings : [str]
+    **kwargs
+        passed to pipeline.run_model()
+    """
+    try:
+        # mixings share flux filenames, so must run one at a time
+        for mixing in mixings:
+            pipeline.run_model(config=config,
+                               model_set=model_set,
+                               zams=zams,
+                               run=run,
+                               mixing=mixing,
+                               **kwargs)
+    except Exception:
+        return traceback.format_exc(), profiling.pop_records()
+
+    return None, profiling.pop_records()
+
+
+def run_queue_worker(config, queue, **kwargs):
+    """Run units from a work queue until it's empty, in a worker process
+
+    Returns : failed, records
+        failed : [(model_set, zams, error)]
+        records : [{}]
+            profiled stages, from profiling.pop_records()
+
+    Parameters
+    ----------
+    config : Config
+    queue : WorkQueue
+    **kwargs
+        passed to work_queue.run_worker()
+    """
+    failed = work_queue.run_worker(config, queue, **kwargs)
+
+    return failed, profiling.pop_records()
+
+
+def remove_worker_runtimes(runtime_name):
+    """Delete private runtimes of all worker processes
+
+    Parameters
+    ----------
+    runtime_name : str
+    """
+    scratch_path = paths.scratch_path()
+    prefix = f'{runtime_name}_w'
+
+    if not os.path.isdir(scratch_path):
+        return
+
+    for name in os.listdir(scratch_path):
+        if name.startswith(prefix):
+            snow_cleanup.remove_runtime(os.path.join(scratch_path, name))
@@ -0,0 +1,197 @@
+import os
+import json
+import socket
+
+# snowflash
+from snowflash.flash2snowglobes.manifest import stage_key
+from snowflash.utils import paths
+
+"""
+Deterministic sharding of work units across independent (e.g. multi-node) runs
+
+A work unit is a single (model_set, zams, mixing). Units are balanced by
+expected cost, using longest-processing-time-first assignment.
+All units of a config have the same no. of time bins, so the cost of each
+is its FLASH dat file size.
+
+Dat files may still be growing while shards are launched (e.g. FLASH runs
+still appending), so shards can't each compute the assignment themselves.
+Instead, the first shard to start saves it to the shared output tree,
+and every later shard (or rerun) reuses it. Delete the file to rebalance.
+
+Each unit has its own manifest, counts, and timebin files, and fluence files
+shared between mixings of the same model are written atomically,
+so all shards can write into the same output tree
+"""
+
+
+def parse_shard(spec):
+    """Parse shard spec of the form 'k/N'
+
+    Returns : k, n_shards
+        with 1 <= k <= n_shards
+
+    Parameters
+    ----------
+    spec : str
+        e.g. '3/16' for the 3rd of 16 shards
+    """
+    try:
+        k, n_shards = (int(x) for x in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{spec}', must be of the form 'k/N'")
+
+    if not 1 <= k <= n_shards:
+        raise ValueError(f"Invalid shard '{spec}', must have 1 <= k <= N")
+
+    return k, n_shards
+
+
+def get_units(config):
+    """Return all work units of config
+
+    Returns : [(model_set, zams, run, mixing)]
+
+    Parameters
+    ----------
+    config : Config
+    """
+    return [(model_set, zams, config.run_list[i], mixing)
+            for model_set in config.model_sets
+            for i, zams in enumerate(config.zams_list)
+            for mixing in config.mixing]
+
+
+def get_unit_cost(config, model_set, zams, run):
+    """Return expected relative cost of a work unit, i.e. its dat file size
+
+    Returns : int
+
+    Parameters
+    ----------
+    config : Config
+    model_set : str
+    zams : str
+    run : str or None
+    """
+    dat_filepath = paths.flash_dat_filepath(models_path=config.paths['models'],
+                                            model_set=model_set,
+                                            zams=zams,
+                                            run=run)
+    try:
+        dat_bytes = os.path.getsize(dat_filepath)
+    except FileNotFoundError:
+        dat_bytes = 0
+
+    return max(dat_bytes, 1)
+
+
+def assign_shards(units, costs, n_shards):
+    """Assign work units to shards, balancing total cost
+
+    Units are taken in order of decreasing cost, each going to
+    the shard with the least total cost so far.
+    Ties are broken by unit and shard order, so the result is deterministic
+
+    Returns : [[unit]]
+        units of each shard, in the order they were assigned
+
+    Parameters
+    ----------
+    units : [tuple]
+    costs : [int]
+    n_shards : int
+    """
+    shards = [[] for _ in range(n_shards)]
+    loads = [0] * n_shards
+
+    order = sorted(range(len(units)), key=lambda i: (-costs[i], i))
+
+    for i in order:
+        k = min(range(n_shards), key=lambda j: (loads[j], j))
+        shards[k] += [units[i]]
+        loads[k] += costs[i]
+
+    return shards
+
+
+def get_shard_units(config, k, n_shards):
+    """Return work units of a single shard
+
+    Returns : [(model_set, zams, run, mixing)]
+
+    Parameters
+    ----------
+    config : Config
+    k : int
+        shard number, 1 <= k <= n_shards
+    n_shards : int
+    """
+    units = get_units(config)
+    filepath = paths.shard_filepath(config.name, n_shards=n_shards,
+                                    key=stage_key(units)[:12])
+
+    if not os.path.isfile(filepath):
+        costs = [get_unit_cost(config, *unit[:3]) for unit in units]
+        save_shards(assign_shards(units, costs=costs, n_shards=n_shards),
+                    filepath=filepath)
+
+    return load_shards(filepath)[k - 1]
+
+
+def save_shards(shards, filepath):
+    """Save shard assignment, unless one has already been saved (e.g. by another shard)
+
+    The file is hard-linked into place, which fails if it already exists,
+    so that concurrently starting shards all end up using the same assignment
+
+    Parameters
+    ----------
+    shards : [[unit]]
+    filepath : str
+    """
+    paths.check_dir_exists(os.path.dirname(filepath))
+    tmp_filepath = f'{filepath}.{socket.gethostname()}_{os.getpid()}.tmp'
+
+    with open(tmp_filepath, 'w') as f:
+        json.dump(shards, f, indent=1)
+
+    try:
+        os.link(tmp_filepath, filepath)
+        print(f'Shard assignment saved: {filepath}')
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp_filepath)
+
+
+def load_shards(filepath):
+    """Load saved shard assignment
+
+    Returns : [[(model_set, zams, run, mixing)]]
+
+    Parameters
+    ----------
+    filepath : str
+    """
+    with open(filepath, 'r') as f:
+        shards = json.load(f)
+
+    return [[tuple(unit) for unit in units] for units in shards]
+
+
+def group_units(units):
+    """Group work units by model, so each model's mixings run together
+
+    Returns : [(model_set, zams, run, [mixing])]
+
+    Parameters
+    ----------
+    units : [(model_set, zams, run, mixing)]
+    """
+    groups = {}
+
+    for model_set, zams, run, mixing in units:
+        groups.setdefault((model_set, zams, run), []).append(mixing)
+
+    return [(*model, mixings) for model, mixings in groups.items()]
@@ -0,0 +1,246 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+# snowflash
+from snowflash.utils import paths
+
+"""
+Content-addressed cache of snowglobes results
+
+Each entry holds the smeared counts of all channels for a single flux file,
+keyed by a hash of the flux file contents, material, detector,
+and snowglobes version. Identical flux files (e.g. repeated runs of
+the same progenitor) then only need to be run through snowglobes once.
+
+Entries are evicted least-recently-used first once the cache exceeds its size limit.
+The cache size is tracked as entries are added, and only rescanned when evicting,
+so the limit is approximate when a cache is shared between processes
+"""
+
+smeared_suffix = '_events_smeared.dat'
+
+# fraction of size limit that eviction frees space down to,
+# so that the cache isn't rescanned on every put once full
+evict_fraction = 0.9
+
+
+class ResultCache:
+    def __init__(self, max_bytes, version, path=None):
+        """Cache of snowglobes channel counts, keyed by flux file contents
+
+        Parameters
+        ----------
+        max_bytes : int
+            size limit of cache, beyond which oldest entries are evicted
+        version : str
+            snowglobes version, e.g. from snow_run.get_cache_version()
+        path : str
+            cache directory, defaults to paths.snow_cache_path()
+        """
+        self.max_bytes = max_bytes
+        self.version = version
+        self.path = paths.snow_cache_path() if path is None else path
+        self.size = None  # total size of entries [bytes], from last scan plus puts
+
+        paths.check_dir_exists(self.path)
+
+    def get_key(self, flux_filepath, material, detector):
+        """Return cache key of flux file
+
+        Returns : str
+
+        Parameters
+        ----------
+        flux_filepath : str
+        material : str
+        detector : str
+        """
+        with open(flux_filepath, 'rb') as f:
+            flux_hash = hashlib.sha1(f.read()).hexdigest()
+
+        string = json.dumps([flux_hash, material, detector, self.version])
+
+        return hashlib.sha1(string.encode()).hexdigest()
+
+    def entry_filepath(self, key):
+        """Return filepath of cache entry
+
+        Returns : str
+
+        Parameters
+        ----------
+        key : str
+        """
+        return os.path.join(self.path, f'{key}.npz')
+
+    def get(self, key):
+        """Return cached result, or None if not cached
+
+        Returns : (energy, {channel: counts}) or None
+
+        Parameters
+        ----------
+        key : str
+        """
+        filepath = self.entry_filepath(key)
+
+        try:
+            with np.load(filepath) as entry:
+                energy = entry['energy']
+                counts = dict(zip(entry['channels'], entry['counts']))
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            return None
+
+        try:
+            os.utime(filepath)  # mark as recently used
+        except FileNotFoundError:
+            pass
+
+        return energy, counts
+
+    def put(self, key, energy, counts):
+        """Atomically add result to cache, then evict old entries if over size limit
+
+        Parameters
+        ----------
+        key : str
+        energy : []
+        counts : {channel: []}
+        """
+        filepath = self.entry_filepath(key)
+        tmp_filepath = f'{filepath}.{os.getpid()}.tmp.npz'
+
+        np.savez(tmp_filepath,
+                 energy=energy,
+                 channels=np.array(list(counts.keys())),
+                 counts=np.stack(list(counts.values())))
+
+        os.replace(tmp_filepath, filepath)
+
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.scan())
+        else:
+            self.size += os.path.getsize(filepath)
+
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Delete least-recently-used entries until cache is
+        within evict_fraction of its size limit
+        """
+        entries = self.scan()
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, filepath in sorted(entries):
+            if total <= evict_fraction * self.max_bytes:
+                break
+            try:
+                os.remove(filepath)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        self.size = total
+
+    def scan(self):
+        """Return all cache entries
+
+        Returns : [(mtime, size, filepath)]
+        """
+        entries = []
+
+        with os.scandir(self.path) as scan:
+            for entry in scan:
+                if entry.name.endswith('.npz') and '.tmp' not in entry.name:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries += [(stat.st_mtime, stat.st_size, entry.path)]
+
+        return entries
+
+
+# =======================================================
+#                 Flux/output files
+# =======================================================
+def is_zero_flux(flux_filepath):
+    """Return True if all fluences in a snowglobes flux file are zero
+
+    Returns : bool
+
+    Parameters
+    ----------
+    flux_filepath : str
+    """
+    table = np.loadtxt(flux_filepath, ndmin=2)
+    return not np.any(table[:, 1:])
+
+
+def load_outputs(input_file, detector, channels, out_path):
+    """Load smeared counts of channels from snowglobes output files
+
+    Returns : (energy, {channel: counts})
+
+    Parameters
+    ----------
+    input_file : str
+        name of flux file, without extension
+    detector : str
+    channels : [str]
+    out_path : str
+        snowglobes 'out' directory
+    """
+    energy = None
+    counts = {}
+
+    for channel in channels:
+        filepath = os.path.join(out_path, output_filename(input_file, channel, detector))
+
+        if not os.path.isfile(filepath):
+            raise FileNotFoundError(f'No snowglobes output found: {filepath}')
+
+        table = np.genfromtxt(filepath, skip_footer=2)
+        energy = table[:, 0]
+        counts[channel] = table[:, 1]
+
+    return energy, counts
+
+
+def write_outputs(input_file, detector, out_path, energy, counts):
+    """Write smeared counts in the format of snowglobes output files
+
+    Parameters
+    ----------
+    input_file : str
+        name of flux file, without extension
+    detector : str
+    out_path : str
+        snowglobes 'out' directory
+    energy : []
+    counts : {channel: []}
+    """
+    for channel, channel_counts in counts.items():
+        filename = output_filename(input_file, channel, detector)
+        table = np.column_stack([energy, channel_counts])
+
+        np.savetxt(os.path.join(out_path, filename), table, fmt='%.17g',
+                   footer=f'----\nTotal: {np.sum(channel_counts):.17g}', comments='')
+
+
+def output_filename(input_file, channel, detector):
+    """Return name of smeared snowglobes output file
+
+    Returns : str
+
+    Parameters
+    ----------
+    input_file : str
+        name of flux file, without extension
+    channel : str
+    detector : str
+    """
+    return f'{input_file}_{channel}_{detector}{smeared_suffix}'
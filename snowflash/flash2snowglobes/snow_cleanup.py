@@ -3,50 +3,123 @@ import shutil
 
 from snowflash.utils import paths
 
-runtime_path = paths.snow_runtime_path()
 
-
-def clean_model():
+def clean_model(model_set=None, zams=None):
     """Clean up snowglobes input and output files
+
+    Parameters
+    ----------
+    model_set : str
+    zams : str
+        if both given, only delete the files of this model
+        (e.g. while other models run in the same runtime),
+        otherwise delete all files
     """
+    runtime_path = paths.snow_runtime_path()
     dirs = ['fluxes', 'out']
 
     for d in dirs:
-        clear_dir(os.path.join(runtime_path, d))
+        path = os.path.join(runtime_path, d)
+
+        if (model_set is None) or (zams is None):
+            clear_dir(path)
+        else:
+            remove_prefix(path, prefix=f'pinched_{model_set}_m{zams}_')
 
 
 def clean_all():
-    """Clean working directory of all temporary files
+    """Clean shared working directory of all temporary files, including private runtimes
     """
+    runtime_path = paths.snow_shared_runtime_path()
     rm_dirs = ['fluxes', 'out', 'channels', 'backgrounds', 'bin',
-               'smear', 'xscns', 'effic', 'glb', 'src']
+               'smear', 'xscns', 'effic', 'glb', 'src', 'runtimes', 'slots']
 
-    rm_files = ['supernova.pl', 'supernova.glb',
+    rm_files = ['supernova.pl', 'supernova.glb', '.snowflash_setup.json',
                 'detector_configurations.dat', 'make_event_table.pl']
 
-    # Delete directories
+    # Delete directories (or links to them)
     for d in rm_dirs:
-        shutil.rmtree(os.path.join(runtime_path, d), ignore_errors=True)
+        path = os.path.join(runtime_path, d)
+
+        if os.path.islink(path):
+            remove_file(path)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
 
     # Delete files
     for f in rm_files:
-        filepath = os.path.join(runtime_path, f)
-        try:
-            os.remove(filepath)
-        except FileNotFoundError:
-            pass
+        remove_file(os.path.join(runtime_path, f))
+
+
+def clean_bin(model_set, zams, i):
+    """Delete snowglobes input and output files of a single time bin
+
+    Parameters
+    ----------
+    model_set : str
+    zams : str
+    i : int
+        file index (starting at 1)
+    """
+    flux_filepath = paths.snow_fluence_filepath(i=i, zams=zams, model_set=model_set)
+    remove_file(flux_filepath)
+
+    # trailing '_' so that e.g. bin 1 doesn't match bin 10
+    remove_prefix(os.path.join(paths.snow_runtime_path(), 'out'),
+                  prefix=f'pinched_{model_set}_m{zams}_{i}_')
+
+
+def remove_prefix(path, prefix):
+    """Delete all files in a directory starting with prefix
+
+    Parameters
+    ----------
+    path : str
+    prefix : str
+    """
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith(prefix):
+                remove_file(entry.path)
+
+
+def remove_runtime(runtime_path):
+    """Delete private runtime directory
+
+    Only the links to shared tables are removed, not the tables themselves
+
+    Parameters
+    ----------
+    runtime_path : str
+    """
+    shutil.rmtree(runtime_path, ignore_errors=True)
+
+    if os.environ.get('SNOWFLASH_RUNTIME') == runtime_path:
+        del os.environ['SNOWFLASH_RUNTIME']
 
 
 def clear_dir(path):
-    """Delete all files within a directory
+    """Delete and recreate a directory, removing all of its contents
 
     Parameters
     ----------
     path : str
     """
-    files = os.listdir(path)
-    for file in files:
-        os.remove(os.path.join(path, file))
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def remove_file(filepath):
+    """Delete file, if it exists
+
+    Parameters
+    ----------
+    filepath : str
+    """
+    try:
+        os.remove(filepath)
+    except FileNotFoundError:
+        pass
 
 
 if __name__ == '__main__':
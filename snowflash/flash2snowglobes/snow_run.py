@@ -1,65 +1,740 @@
 import os
+import json
+import signal
 import shutil
+import asyncio
+import functools
+import subprocess
+import numpy as np
 
-from snowflash.utils import paths
+from snowflash.flash2snowglobes import snow_cache
+from snowflash.utils import paths, provenance, profiling, progress
 
+# written to by snowglobes, private to each runtime
+work_folders = ['fluxes', 'out']
 
-def run(model_set, zams, n_bins, material, detector):
+# read-only tables, shared by all runtimes
+table_folders = ['channels', 'backgrounds', 'bin', 'smear',
+                 'xscns', 'effic', 'glb', 'src']
+table_files = ['supernova.pl', 'detector_configurations.dat', 'make_event_table.pl']
+
+# snowflash scripts in the shared runtime
+runtime_scripts = ['supernova_batch.pl']
+
+
+class SnowglobesError(Exception):
+    pass
+
+
+# =======================================================
+#                 Synchronous API
+# =======================================================
+def run(model_set, zams, n_bins, material, detector, channels,
+        i_start=0,
+        batch_size=1,
+        concurrency=1,
+        timeout=None,
+        retries=2,
+        cache=None):
     """Runs snowglobes on generated 'pinched' files
 
+    Blocking wrapper of run_async(); raises SnowglobesError if any bins fail
+
+    Parameters
+    ----------
+    model_set : str
+    zams : float
+    n_bins : int
+    material : str
+    detector : str
+    channels : [str]
+        snowglobes channels to read outputs of, e.g. from analysis.get_all_channels()
+    i_start : int
+        index of first time bin to run
+    batch_size : int
+        no. of time bins to run per snowglobes invocation (see run_batch())
+    concurrency : int
+        max no. of snowglobes processes running at once
+    timeout : float
+        max time per time bin [s]
+    retries : int
+        no. of times to retry a failed bin
+    cache : snow_cache.ResultCache
+    """
+    asyncio.run(run_async(model_set=model_set,
+                          zams=zams,
+                          n_bins=n_bins,
+                          material=material,
+                          detector=detector,
+                          channels=channels,
+                          i_start=i_start,
+                          batch_size=batch_size,
+                          concurrency=concurrency,
+                          timeout=timeout,
+                          retries=retries,
+                          cache=cache))
+
+
+def run_bin(model_set, zams, i, material, detector, channels,
+            timeout=None,
+            retries=2,
+            slot_path=None,
+            cache=None):
+    """Runs snowglobes on a single 'pinched' file
+
+    Parameters
+    ----------
+    model_set : str
+    zams : float
+    i : int
+        file index (starting at 1)
+    material : str
+    detector : str
+    channels : [str]
+        snowglobes channels to read outputs of, e.g. from analysis.get_all_channels()
+    timeout : float
+        max run time [s]
+    retries : int
+    slot_path : str
+        runtime slot to run in, defaults to the runtime itself
+    cache : snow_cache.ResultCache
+    """
+    run_batch(model_set=model_set,
+              zams=zams,
+              idxs=[i],
+              material=material,
+              detector=detector,
+              channels=channels,
+              timeout=timeout,
+              retries=retries,
+              slot_path=slot_path,
+              cache=cache)
+
+
+def run_batch(model_set, zams, idxs, material, detector, channels,
+              timeout=None,
+              retries=2,
+              slot_path=None,
+              cache=None):
+    """Runs snowglobes on multiple 'pinched' files in a single invocation
+
+    Uses supernova_batch.pl, which runs supernova.pl on each file in turn.
+    Each file is still a full snowglobes run; batching only saves
+    launching (and waiting on) a separate process per file
+
+    Parameters
+    ----------
+    model_set : str
+    zams : float
+    idxs : [int]
+        file indexes (starting at 1)
+    material : str
+    detector : str
+    channels : [str]
+        snowglobes channels to read outputs of, e.g. from analysis.get_all_channels()
+    timeout : float
+        max run time per file [s]
+    retries : int
+    slot_path : str
+        runtime slot to run in, defaults to the runtime itself
+    cache : snow_cache.ResultCache
+    """
+    asyncio.run(run_async(model_set=model_set,
+                          zams=zams,
+                          idxs=idxs,
+                          material=material,
+                          detector=detector,
+                          channels=channels,
+                          batch_size=len(idxs),
+                          timeout=timeout,
+                          retries=retries,
+                          slot_path=slot_path,
+                          cache=cache))
+
+
+# =======================================================
+#                 Asyncio API
+# =======================================================
+async def run_async(model_set, zams, material, detector, channels,
+                    n_bins=None,
+                    i_start=0,
+                    idxs=None,
+                    batch_size=1,
+                    concurrency=1,
+                    timeout=None,
+                    retries=2,
+                    slots=None,
+                    slot_path=None,
+                    cache=None):
+    """Runs snowglobes on generated 'pinched' files as asyncio subprocesses
+
+    Files with all-zero fluences aren't run, and get zero counts.
+    If a cache is given, files already in it aren't run either,
+    and new results are added to it. Outputs are written to the
+    'out' directory as usual in both cases.
+    Raises SnowglobesError listing any files that still failed after retries
+
     Parameters
     ----------
     model_set : str
     zams : float
+    material : str
+    detector : str
+    channels : [str]
+        snowglobes channels to read outputs of, e.g. from analysis.get_all_channels()
     n_bins : int
+        run time bins from i_start to n_bins, if idxs not given
+    i_start : int
+    idxs : [int]
+        file indexes (starting at 1)
+    batch_size : int
+        no. of time bins to run per snowglobes invocation (see run_batch())
+    concurrency : int
+        max no. of snowglobes processes running at once (ignored if slots given)
+    timeout : float
+        max run time per time bin [s]
+    retries : int
+        no. of times to retry a failed file
+    slots : asyncio.Queue
+        runtime slots, from get_slots(). Share between concurrent calls
+        to limit the total no. of snowglobes processes
+    slot_path : str
+        run in this slot only (overrides slots/concurrency)
+    cache : snow_cache.ResultCache
+    """
+    if idxs is None:
+        idxs = np.arange(i_start, n_bins) + 1
+
+    if slot_path is not None:
+        slots = asyncio.Queue()
+        slots.put_nowait(slot_path)
+    elif slots is None:
+        slots = get_slots(concurrency)
+
+    input_files = [f'pinched_{model_set}_m{zams}_{i}' for i in idxs]
+
+    run_list, cached, zero_files, keys = await run_in_thread(check_cache,
+                                                             input_files=input_files,
+                                                             material=material,
+                                                             detector=detector,
+                                                             cache=cache)
+    batches = get_batches(run_list, batch_size=batch_size)
+    progress.add_bins(model_set, zams, len(input_files) - len(run_list))
+
+    async def run_batch_files(batch):
+        batch_failed = await run_files(input_files=batch,
+                                       material=material,
+                                       detector=detector,
+                                       slots=slots,
+                                       timeout=timeout,
+                                       retries=retries)
+        progress.add_bins(model_set, zams, len(batch) - len(batch_failed))
+        return batch_failed
+
+    results = await asyncio.gather(*[run_batch_files(batch) for batch in batches])
+
+    failed = {f: err for result in results for f, err in result.items()}
+
+    if len(failed) > 0:
+        errors = '\n'.join(f'  {f}: {err}' for f, err in failed.items())
+        raise SnowglobesError(f'{len(failed)} file(s) failed:\n{errors}')
+
+    await run_in_thread(restore_outputs,
+                        run_list=run_list,
+                        cached=cached,
+                        zero_files=zero_files,
+                        keys=keys,
+                        detector=detector,
+                        channels=channels,
+                        cache=cache)
+
+
+def check_cache(input_files, material, detector, cache=None):
+    """Sort input files into those that need running, cached, and all-zero
+
+    Returns : run_list, cached, zero_files, keys
+        run_list : [str]
+        cached : {input_file: (energy, {channel: counts})}
+        zero_files : [str]
+        keys : {input_file: cache key}
+
+    Parameters
+    ----------
+    input_files : [str]
+    material : str
+    detector : str
+    cache : snow_cache.ResultCache
+    """
+    run_list, zero_files = [], []
+    cached, keys = {}, {}
+
+    for input_file in input_files:
+        flux_filepath = os.path.join(paths.snow_runtime_path(), 'fluxes',
+                                     f'{input_file}.dat')
+
+        if snow_cache.is_zero_flux(flux_filepath):
+            zero_files += [input_file]
+            continue
+
+        if cache is not None:
+            keys[input_file] = cache.get_key(flux_filepath,
+                                             material=material,
+                                             detector=detector)
+            result = cache.get(keys[input_file])
+
+            if result is not None:
+                cached[input_file] = result
+                continue
+
+        run_list += [input_file]
+
+    # need at least one output to get energy bins and channels
+    if (len(zero_files) > 0) and (len(run_list) + len(cached) == 0):
+        run_list = zero_files[:1]
+        zero_files = zero_files[1:]
+
+    n_skipped = len(cached) + len(zero_files)
+    if n_skipped > 0:
+        print(f'Skipping snowglobes for {len(cached)} cached '
+              f'and {len(zero_files)} zero-flux file(s)')
+
+    return run_list, cached, zero_files, keys
+
+
+def restore_outputs(run_list, cached, zero_files, keys, detector, channels, cache=None):
+    """Add new results to cache, and write outputs of cached and all-zero files
+
+    Parameters
+    ----------
+    run_list : [str]
+    cached : {input_file: (energy, {channel: counts})}
+    zero_files : [str]
+    keys : {input_file: cache key}
+    detector : str
+    channels : [str]
+    cache : snow_cache.ResultCache
+    """
+    out_path = os.path.join(paths.snow_runtime_path(), 'out')
+    template = None
+
+    for input_file in run_list:
+        store = (cache is not None) and (input_file in keys)
+        need_template = (template is None) and (len(zero_files) > 0)
+
+        if not (store or need_template):
+            continue
+
+        result = snow_cache.load_outputs(input_file, detector=detector, channels=channels,
+                                         out_path=out_path)
+
+        if store:
+            cache.put(keys[input_file], *result)
+
+        template = result
+
+    for input_file, result in cached.items():
+        snow_cache.write_outputs(input_file, detector, out_path, *result)
+        template = result
+
+    if len(zero_files) > 0:
+        energy, counts = template
+        zeros = {channel: np.zeros_like(c) for channel, c in counts.items()}
+
+        for input_file in zero_files:
+            snow_cache.write_outputs(input_file, detector, out_path, energy, zeros)
+
+
+async def run_files(input_files, material, detector, slots, timeout=None, retries=2):
+    """Run snowglobes on input files, retrying on failure
+
+    A failed batch is retried one file at a time (if retries > 0),
+    which counts as the first retry of each file
+
+    Returns : {input_file: error}
+        files that failed on every attempt
+
+    Parameters
+    ----------
+    input_files : [str]
     material : str
     detector : str
+    slots : asyncio.Queue
+    timeout : float
+        max run time per file [s]
+    retries : int
+    """
+    if len(input_files) > 1:
+        error = await exec_snowglobes(['./supernova_batch.pl', material, detector,
+                                       *input_files],
+                                      slots=slots,
+                                      timeout=None if timeout is None
+                                      else timeout * len(input_files))
+        if error is None:
+            return {}
+
+        if retries <= 0:
+            print(f'snowglobes batch failed: {error}')
+            return {f: error for f in input_files}
+
+        print(f'snowglobes batch failed, retrying files individually: {error}')
+        results = await asyncio.gather(*[run_files(input_files=[f],
+                                                   material=material,
+                                                   detector=detector,
+                                                   slots=slots,
+                                                   timeout=timeout,
+                                                   retries=retries - 1)
+                                         for f in input_files])
+        return {f: err for result in results for f, err in result.items()}
+
+    input_file = input_files[0]
+    error = None
+
+    for attempt in range(max(retries, 0) + 1):
+        error = await exec_snowglobes(['./supernova.pl', input_file, material, detector],
+                                      slots=slots,
+                                      timeout=timeout)
+        if error is None:
+            return {}
+
+        print(f'snowglobes failed for {input_file} '
+              f'(attempt {attempt + 1}/{max(retries, 0) + 1}): {error}')
+
+    return {input_file: error}
+
+
+async def exec_snowglobes(cmd, slots, timeout=None):
+    """Run snowglobes command in a free runtime slot
+
+    Returns : str or None
+        error message, or None if successful
+
+    Parameters
+    ----------
+    cmd : [str]
+    slots : asyncio.Queue
+    timeout : float
+        [s]
+    """
+    slot_path = await slots.get()
+
+    try:
+        # new session, so that child processes can be killed with it
+        proc = await asyncio.create_subprocess_exec(*cmd,
+                                                    cwd=slot_path,
+                                                    stdout=asyncio.subprocess.DEVNULL,
+                                                    stderr=asyncio.subprocess.PIPE,
+                                                    start_new_session=True)
+        profiling.count_subprocess()
+
+        try:
+            _, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+        except asyncio.TimeoutError:
+            kill_session(proc.pid)
+            await proc.wait()
+            return f'timed out after {timeout} s'
+        except asyncio.CancelledError:
+            kill_session(proc.pid)
+            raise
+    finally:
+        slots.put_nowait(slot_path)
+
+    if proc.returncode != 0:
+        stderr = stderr.decode(errors='replace').strip()
+        return f'exit code {proc.returncode}: {stderr}'
+
+    return None
+
+
+def kill_session(pid):
+    """Kill process and all of its children
+
+    Parameters
+    ----------
+    pid : int
+    """
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def get_slots(concurrency=1):
+    """Return queue of runtime slot directories, for running snowglobes concurrently
+
+    supernova.pl writes supernova.glb to its working directory,
+    so each concurrent process needs its own. The first slot is the runtime
+    itself, the rest are subdirectories sharing its tables, fluxes/, and out/.
+    Must be called from within a running event loop
+
+    Returns : asyncio.Queue
+
+    Parameters
+    ----------
+    concurrency : int
     """
     runtime_path = paths.snow_runtime_path()
-    os.system(f'cd {runtime_path}')
+    slots = asyncio.Queue()
+    slots.put_nowait(runtime_path)
+
+    for k in range(1, concurrency):
+        slots.put_nowait(create_slot(runtime_path, k))
+
+    return slots
+
+
+def create_slot(runtime_path, k):
+    """Create runtime slot directory, linking to the runtime's tables and work folders
+
+    Returns : str
+
+    Parameters
+    ----------
+    runtime_path : str
+    k : int
+        slot number
+    """
+    slot_path = os.path.join(runtime_path, 'slots', str(k))
+    os.makedirs(slot_path, exist_ok=True)
+
+    for name in work_folders + table_folders + table_files + runtime_scripts:
+        dest = os.path.join(slot_path, name)
+
+        if not os.path.lexists(dest):
+            os.symlink(os.path.join(runtime_path, name), dest)
+
+    return slot_path
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """Run blocking function in the event loop's default thread pool
+
+    Equivalent to asyncio.to_thread(), which needs python 3.9
 
-    for n in range(n_bins):
-        input_file = f'pinched_{model_set}_m{zams}_{n + 1}'
-        run_str = f'{runtime_path}/supernova.pl {input_file} {material} {detector}'
-        os.system(run_str)
+    Returns : result of func
+
+    Parameters
+    ----------
+    func : callable
+    args, kwargs
+        passed to func
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+def get_batches(idxs, batch_size):
+    """Split file indexes (or names) into batches
+
+    Returns : [[int]]
+
+    Parameters
+    ----------
+    idxs : [int]
+    batch_size : int
+    """
+    return [idxs[i:i + batch_size] for i in range(0, len(idxs), batch_size)]
 
 
+# =======================================================
+#                 Setup
+# =======================================================
 def setup_snowglobes(snowglobes_path):
-    """Copies snowglobes installation into working directory
+    """Link snowglobes installation into shared runtime directory
+
+    The read-only tables are symlinked rather than copied, and a stamp file
+    records the source path and version. Setup is skipped if the stamp
+    matches and all links are intact, otherwise the links are rebuilt
 
     Parameters
     ----------
     snowglobes_path : str
         directory path to snowglobes installation
     """
-    runtime_path = paths.snow_runtime_path()
+    runtime_path = paths.snow_shared_runtime_path()
+    snowglobes_path = os.path.realpath(snowglobes_path)
+
+    for folder in work_folders:
+        os.makedirs(os.path.join(runtime_path, folder), exist_ok=True)
+
+    if snowglobes_path == os.path.realpath(runtime_path):
+        return  # running inside the installation itself
+
+    stamp = {'source': snowglobes_path,
+             'version': get_snowglobes_version(snowglobes_path),
+             'tables': table_folders + table_files}
+
+    if check_setup(runtime_path, stamp):
+        return
+
+    print(f'Linking snowglobes installation: {snowglobes_path}')
+    stamp_filepath = setup_stamp_filepath(runtime_path)
+
+    try:
+        os.remove(stamp_filepath)
+    except FileNotFoundError:
+        pass
+
+    for table in stamp['tables']:
+        src = os.path.join(snowglobes_path, table)
+
+        if not os.path.exists(src):
+            raise FileNotFoundError(f'snowglobes table not found: {src}')
+
+        link_table(src=src, dest=os.path.join(runtime_path, table))
+
+    tmp_filepath = f'{stamp_filepath}.{os.getpid()}.tmp'
+
+    with open(tmp_filepath, 'w') as f:
+        json.dump(stamp, f, indent=1)
+
+    os.replace(tmp_filepath, stamp_filepath)
+
+
+def check_setup(runtime_path, stamp):
+    """Return True if runtime setup matches stamp and all links are intact
 
-    # create local dirs
-    new_folders = ['fluxes', 'out']
+    Returns : bool
 
-    for folder in new_folders:
-        fullpath = os.path.join(runtime_path, folder)
+    Parameters
+    ----------
+    runtime_path : str
+    stamp : {}
+    """
+    try:
+        with open(setup_stamp_filepath(runtime_path), 'r') as f:
+            saved = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+
+    if saved != stamp:
+        return False
+
+    for table in stamp['tables']:
+        src = os.path.join(stamp['source'], table)
+        dest = os.path.join(runtime_path, table)
+
+        if (not os.path.islink(dest)) or (os.path.realpath(dest) != os.path.realpath(src)):
+            return False
+
+    return True
+
+
+def link_table(src, dest):
+    """Atomically (re)place dest with a symlink to src
+
+    Parameters
+    ----------
+    src : str
+    dest : str
+    """
+    if os.path.isdir(dest) and not os.path.islink(dest):
+        shutil.rmtree(dest)  # copy from an older setup
+
+    tmp_dest = f'{dest}.{os.getpid()}.tmp'
+    os.symlink(src, tmp_dest)
+    os.replace(tmp_dest, dest)
+
+
+def get_snowglobes_version(snowglobes_path):
+    """Return version identifier of snowglobes installation
+
+    Uses the git commit if it's a git checkout,
+    otherwise a checksum of supernova.pl and detector_configurations.dat
+
+    Returns : str
+
+    Parameters
+    ----------
+    snowglobes_path : str
+    """
+    if os.path.isdir(os.path.join(snowglobes_path, '.git')):
+        result = subprocess.run(['git', '-C', snowglobes_path, 'describe',
+                                 '--always', '--dirty'],
+                                capture_output=True, text=True)
+        if result.returncode == 0:
+            return f'git:{result.stdout.strip()}'
+
+    checksums = []
+    for filename in ['supernova.pl', 'detector_configurations.dat']:
+        checksums += [provenance.file_sha1(os.path.join(snowglobes_path, filename))]
+
+    return 'sha1:' + ','.join(checksums)
+
+
+def get_setup_version():
+    """Return snowglobes version recorded by setup_snowglobes()
+
+    Returns : str or None
+    """
+    try:
+        with open(setup_stamp_filepath(paths.snow_shared_runtime_path()), 'r') as f:
+            return json.load(f)['version']
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
+
+
+def get_cache_version(snowglobes_path):
+    """Return snowglobes version for keying cached results
+
+    Uses the version recorded by setup_snowglobes(), falling back to the
+    installation path and version if there's no setup stamp
+    (e.g. when running inside the installation itself)
+
+    Returns : str
+
+    Parameters
+    ----------
+    snowglobes_path : str
+        directory path to snowglobes installation
+    """
+    version = get_setup_version()
+
+    if version is None:
+        snowglobes_path = os.path.realpath(snowglobes_path)
+        version = f'{snowglobes_path}:{get_snowglobes_version(snowglobes_path)}'
+
+    return version
 
-        if not os.path.isdir(fullpath):
-            os.makedirs(fullpath)
 
-    # copy snowglobes dirs
-    copy_folders = ['channels', 'backgrounds', 'bin', 'smear',
-                    'xscns', 'effic', 'glb', 'src']
+def setup_stamp_filepath(runtime_path):
+    """Return filepath to runtime setup stamp
+
+    Returns : str
+
+    Parameters
+    ----------
+    runtime_path : str
+    """
+    return os.path.join(runtime_path, '.snowflash_setup.json')
+
+
+def create_runtime(name):
+    """Create private runtime directory, linking to tables in the shared runtime
+
+    Sets the environment variable SNOWFLASH_RUNTIME, so that all subsequent
+    runtime paths (including in child processes) point to the private runtime.
+    Must be called after setup_snowglobes()
+
+    Returns : str
+        path to private runtime
+
+    Parameters
+    ----------
+    name : str
+        unique name of runtime, e.g. '<config>_<host>_<pid>'
+    """
+    shared_path = paths.snow_shared_runtime_path()
+    runtime_path = paths.snow_private_runtime_path(name)
 
-    for folder in copy_folders:
-        src = os.path.join(snowglobes_path, folder)
-        dest = os.path.join(runtime_path, folder)
+    for folder in work_folders:
+        os.makedirs(os.path.join(runtime_path, folder), exist_ok=True)
 
-        if not os.path.isdir(dest):
-            shutil.copytree(src, dest)
+    for table in table_folders + table_files + runtime_scripts:
+        dest = os.path.join(runtime_path, table)
 
-    # link files
-    ln_files = ['supernova.pl', 'detector_configurations.dat', 'make_event_table.pl']
+        if not os.path.lexists(dest):
+            os.symlink(os.path.join(shared_path, table), dest)
 
-    for filename in ln_files:
-        src = os.path.join(snowglobes_path, filename)
-        dest = os.path.join(runtime_path, filename)
+    os.environ['SNOWFLASH_RUNTIME'] = runtime_path
 
-        if not os.path.isfile(dest):
-            os.symlink(src, dest)
+    return runtime_path
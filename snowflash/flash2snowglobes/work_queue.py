@@ -0,0 +1,325 @@
+import os
+import time
+import socket
+import sqlite3
+import threading
+import traceback
+import contextlib
+
+# snowflash
+from snowflash.flash2snowglobes import pipeline, shard
+
+"""
+Work queue of (model_set, zams, mixing) units, in a SQLite database
+
+The database file lives on the shared filesystem, so workers on any node
+can take part without an external service. Workers atomically claim
+the most expensive pending unit, and update its heartbeat while running it.
+A unit whose heartbeat is older than stale_after (i.e. its worker died or
+was pre-empted) is returned to the queue the next time a unit is claimed.
+
+Heartbeats use each node's clock, so clocks are assumed to agree
+to well within stale_after.
+
+Completed stages are recorded in the unit manifests as usual,
+so a unit that's requeued part-way through picks up where it left off.
+To retry failed units, delete the database and rerun
+"""
+
+schema = """
+CREATE TABLE IF NOT EXISTS units (
+    model_set TEXT NOT NULL,
+    zams TEXT NOT NULL,
+    run TEXT,
+    mixing TEXT NOT NULL,
+    cost INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    heartbeat REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (model_set, zams, mixing)
+)
+"""
+
+statuses = ['pending', 'running', 'done', 'failed']
+
+
+class WorkQueue:
+    def __init__(self, filepath, stale_after=600, max_attempts=3):
+        """Work queue of (model_set, zams, mixing) units, shared between workers
+
+        Parameters
+        ----------
+        filepath : str
+            path to SQLite database, created if it doesn't exist
+        stale_after : float
+            time since last heartbeat after which a running unit is requeued [s]
+        max_attempts : int
+            max no. of times a unit is claimed, beyond which it's marked failed
+            (e.g. if it keeps killing its worker)
+        """
+        self.filepath = filepath
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+
+        with self.connect() as connection:
+            connection.execute(schema)
+
+    @contextlib.contextmanager
+    def connect(self):
+        """Open database connection, closing it on exit
+
+        A connection is opened per operation, so that the queue
+        can be shared by forked worker processes
+
+        Yields : sqlite3.Connection
+        """
+        # autocommit, with explicit transactions where needed
+        connection = sqlite3.connect(self.filepath, timeout=60, isolation_level=None)
+
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def add_units(self, units, costs):
+        """Add units to the queue, ignoring any already present
+
+        Parameters
+        ----------
+        units : [(model_set, zams, run, mixing)]
+        costs : [int]
+        """
+        rows = [(*unit, cost) for unit, cost in zip(units, costs)]
+
+        with self.connect() as connection:
+            connection.executemany('INSERT OR IGNORE INTO units '
+                                   '(model_set, zams, run, mixing, cost) '
+                                   'VALUES (?, ?, ?, ?, ?)', rows)
+
+    def claim(self, worker):
+        """Atomically claim the most expensive pending unit
+
+        Stale units are requeued first
+
+        Returns : (model_set, zams, run, mixing) or None
+            None if there are no pending units
+
+        Parameters
+        ----------
+        worker : str
+            unique worker name
+        """
+        now = time.time()
+
+        with self.connect() as connection:
+            # take write lock up front, so two workers can't claim the same unit
+            connection.execute('BEGIN IMMEDIATE')
+
+            try:
+                self._requeue_stale(connection, now=now)
+
+                row = connection.execute("SELECT model_set, zams, run, mixing FROM units "
+                                         "WHERE status = 'pending' "
+                                         "ORDER BY cost DESC, model_set, zams, mixing "
+                                         "LIMIT 1").fetchone()
+                if row is not None:
+                    connection.execute("UPDATE units SET status = 'running', worker = ?, "
+                                       "heartbeat = ?, attempts = attempts + 1 "
+                                       "WHERE model_set = ? AND zams = ? AND mixing = ?",
+                                       (worker, now, row[0], row[1], row[3]))
+
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+
+        return row
+
+    def _requeue_stale(self, connection, now):
+        """Return running units with stale heartbeats to the queue
+
+        Parameters
+        ----------
+        connection : sqlite3.Connection
+            with an open transaction
+        now : float
+        """
+        cutoff = now - self.stale_after
+
+        connection.execute("UPDATE units SET status = 'failed', "
+                           "error = 'worker died ' || attempts || ' times' "
+                           "WHERE status = 'running' AND heartbeat < ? "
+                           "AND attempts >= ?", (cutoff, self.max_attempts))
+
+        connection.execute("UPDATE units SET status = 'pending', worker = NULL "
+                           "WHERE status = 'running' AND heartbeat < ?", (cutoff,))
+
+    def heartbeat(self, unit, worker):
+        """Update heartbeat of a claimed unit
+
+        Returns : bool
+            False if the unit is no longer claimed by this worker
+
+        Parameters
+        ----------
+        unit : (model_set, zams, run, mixing)
+        worker : str
+        """
+        with self.connect() as connection:
+            cursor = connection.execute("UPDATE units SET heartbeat = ? "
+                                        "WHERE model_set = ? AND zams = ? AND mixing = ? "
+                                        "AND worker = ? AND status = 'running'",
+                                        (time.time(), unit[0], unit[1], unit[3], worker))
+            return cursor.rowcount > 0
+
+    def finish(self, unit, worker, error=None):
+        """Mark a claimed unit as done, or failed if there's an error
+
+        Parameters
+        ----------
+        unit : (model_set, zams, run, mixing)
+        worker : str
+        error : str
+        """
+        status = 'done' if error is None else 'failed'
+
+        with self.connect() as connection:
+            connection.execute("UPDATE units SET status = ?, error = ?, heartbeat = ? "
+                               "WHERE model_set = ? AND zams = ? AND mixing = ? "
+                               "AND worker = ?",
+                               (status, error, time.time(),
+                                unit[0], unit[1], unit[3], worker))
+
+    def get_summary(self):
+        """Return no. of units with each status
+
+        Returns : {status: int}
+        """
+        with self.connect() as connection:
+            rows = connection.execute('SELECT status, COUNT(*) FROM units '
+                                      'GROUP BY status').fetchall()
+
+        summary = dict.fromkeys(statuses, 0)
+        summary.update(rows)
+
+        return summary
+
+    def get_failed(self):
+        """Return failed units
+
+        Returns : [(model_set, zams, mixing, error)]
+        """
+        with self.connect() as connection:
+            return connection.execute("SELECT model_set, zams, mixing, error "
+                                      "FROM units WHERE status = 'failed' "
+                                      "ORDER BY model_set, zams, mixing").fetchall()
+
+
+def init_queue(config, filepath, **kwargs):
+    """Create work queue and add all units of config
+
+    Safe to call from every worker, as existing units are left as they are
+
+    Returns : WorkQueue
+
+    Parameters
+    ----------
+    config : Config
+    filepath : str
+    **kwargs
+        passed to WorkQueue()
+    """
+    work_queue = WorkQueue(filepath, **kwargs)
+
+    units = shard.get_units(config)
+    costs = [shard.get_unit_cost(config, *unit[:3]) for unit in units]
+
+    work_queue.add_units(units, costs=costs)
+
+    return work_queue
+
+
+def get_worker_name():
+    """Return unique name of this worker process
+
+    Returns : str
+    """
+    return f'{socket.gethostname()}_{os.getpid()}'
+
+
+def run_worker(config, work_queue, interval=30, **kwargs):
+    """Claim and run units until the queue is empty
+
+    Returns : [(model_set, zams, error)]
+        units that failed in this worker
+
+    Parameters
+    ----------
+    config : Config
+    work_queue : WorkQueue
+    interval : float
+        time between heartbeats [s]
+    **kwargs
+        passed to pipeline.run_model()
+    """
+    worker = get_worker_name()
+    failed = []
+
+    while True:
+        unit = work_queue.claim(worker)
+
+        if unit is None:
+            break
+
+        model_set, zams, run, mixing = unit
+        print(f'=== {worker} claimed: {model_set} {zams} {mixing} ===')
+
+        stop = threading.Event()
+        beat = threading.Thread(target=keep_alive,
+                                args=(work_queue, unit, worker, interval, stop),
+                                daemon=True)
+        beat.start()
+        error = None
+
+        try:
+            pipeline.run_model(config=config,
+                               model_set=model_set,
+                               zams=zams,
+                               run=run,
+                               mixing=mixing,
+                               **kwargs)
+        except Exception:
+            error = traceback.format_exc()
+            failed += [(model_set, zams, error)]
+        finally:
+            stop.set()
+            beat.join()
+
+        work_queue.finish(unit, worker=worker, error=error)
+
+    return failed
+
+
+def keep_alive(work_queue, unit, worker, interval, stop):
+    """Update heartbeat of unit every interval, until stopped
+
+    Parameters
+    ----------
+    work_queue : WorkQueue
+    unit : (model_set, zams, run, mixing)
+    worker : str
+    interval : float
+    stop : threading.Event
+    """
+    while not stop.wait(interval):
+        try:
+            alive = work_queue.heartbeat(unit, worker=worker)
+        except sqlite3.OperationalError as err:  # e.g. database busy; retry next beat
+            print(f'Heartbeat failed: {err}')
+            continue
+
+        if not alive:
+            print(f'WARNING: {worker} lost claim on {unit[:2]} {unit[3]}')
+            break
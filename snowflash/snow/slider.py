@@ -1,7 +1,3 @@
-from matplotlib.widgets import Slider
-import matplotlib.pyplot as plt
-
-
 class SnowSlider:
     def __init__(self,
                  y_vars,
@@ -40,6 +36,9 @@ class SnowSlider:
 
         Returns : fig, profile_ax, slider
         """
+        import matplotlib.pyplot as plt
+        from matplotlib.widgets import Slider
+
         fig = plt.figure(figsize=figsize)
         ax = fig.add_axes([0.1, 0.2, 0.8, 0.65])
         slider_ax = fig.add_axes([0.1, 0.05, 0.8, 0.05])
@@ -4,6 +4,7 @@ import xarray as xr
 
 # snowflash
 from snowflash.snow import snow_tools, snow_plot
+from snowflash.utils import paths, provenance, profiling
 from snowflash.utils.config import Config
 
 
@@ -13,8 +14,9 @@ class SnowModel:
                  model_set,
                  detector,
                  mixing,
-                 recalc=True,
+                 recalc=False,
                  config=None,
+                 counts=None,
                  ):
         """Collection of SnowGlobes data
 
@@ -25,7 +27,11 @@ class SnowModel:
         detector : str
         mixing : str
         recalc : bool
+            re-extract dataset from counts, even if cached file is valid
         config : str
+        counts : xr.DataArray
+            counts [time, channel, energy], e.g. from in_memory.run_pipeline().
+            If given, nothing is loaded from or saved to file
         """
         self.zams = zams
         self.model_set = model_set
@@ -35,7 +41,7 @@ class SnowModel:
         self.config = Config({None: model_set}.get(config, config))
 
         self.data = None
-        self.counts = None
+        self.counts = None if counts is None else snow_tools.add_total_channel(counts)
         self.rate = None
         self.cumulative_t = None
         self.cumulative_e = None
@@ -45,6 +51,8 @@ class SnowModel:
         self.e_avg = None
         self.e_percentiles = None
         self._e_percentiles = None
+        self._window_n = None
+        self._window_e = None
         self.summary = None
 
         self.t_bins = None
@@ -59,33 +67,62 @@ class SnowModel:
     def get_data(self):
         """Load dataset from file or re-extract
         """
-        if self.recalc:
-            self.extract_dataset()
-        else:
-            try:
-                self.load_data()
-            except FileNotFoundError:
-                print('Dataset file not found; re-extracting')
+        with profiling.stage('snow_model', model_set=self.model_set, zams=self.zams,
+                             mixing=self.mixing):
+            if self.counts is not None:
+                self.get_vars()
+            elif self.recalc:
                 self.extract_dataset()
+            else:
+                try:
+                    self.load_data()
+                except (FileNotFoundError, ValueError) as err:
+                    if isinstance(err, FileNotFoundError):
+                        print('Dataset file not found; re-extracting')
+                    else:
+                        print(f'Dataset file is stale ({err}); re-extracting')
+                    self.data = None
+                    self.extract_dataset()
 
     def load_data(self):
-        """Load complete dataset
+        """Load complete dataset, checking that it's up to date with counts file
         """
         self.data = snow_tools.load_model_data(zams=self.zams,
                                                model_set=self.model_set,
                                                detector=self.detector,
                                                mixing=self.mixing)
+
+        params, sources = self.get_provenance()
+        provenance.check_provenance(self.data.attrs, params=params, sources=sources)
+
         self.get_vars()
 
+    def get_provenance(self):
+        """Return expected provenance of dataset
+
+        Returns : params, sources
+        """
+        params = provenance.get_bin_params(self.config)
+        params.update({'detector': self.detector, 'mixing': self.mixing})
+
+        counts_filepath = paths.snow_counts_filepath(zams=self.zams,
+                                                     model_set=self.model_set,
+                                                     detector=self.detector,
+                                                     mixing=self.mixing)
+        sources = {'counts': provenance.file_stamp(counts_filepath, checksum=True)}
+
+        return params, sources
+
     def get_vars(self):
         """Set binned variables, either re-calculated or pulled from file
         """
         if self.data is None:
             # 3D arrays
-            self.counts = snow_tools.load_counts(zams=self.zams,
-                                                 model_set=self.model_set,
-                                                 detector=self.detector,
-                                                 mixing=self.mixing)
+            if self.counts is None:
+                self.counts = snow_tools.load_counts(zams=self.zams,
+                                                     model_set=self.model_set,
+                                                     detector=self.detector,
+                                                     mixing=self.mixing)
 
             print('Calculating derived variables')
             self.rate = self.counts / np.diff(self.counts['time'])[0]
@@ -119,6 +156,7 @@ class SnowModel:
 
         self.get_energy_percentiles()
         self.get_summary()
+        self.get_window_tables()
 
     def get_summary(self):
         """Calculate summary stats
@@ -170,12 +208,112 @@ class SnowModel:
                                 'e_avg': self.e_avg,
                                 })
 
+        params, sources = self.get_provenance()
+        self.data.attrs.update(provenance.get_provenance(params=params, sources=sources))
+
         snow_tools.save_model_data(self.data,
                                    detector=self.detector,
                                    model_set=self.model_set,
                                    zams=self.zams,
                                    mixing=self.mixing)
 
+    # ===============================================================
+    #                      Window queries
+    # ===============================================================
+    def get_window_tables(self):
+        """Build 2D cumulative (time, energy) tables for window queries
+        """
+        self._window_n, self._window_e = snow_tools.get_window_tables(self.counts)
+
+    def query_window(self, t0=None, t1=None, e0=None, e1=None):
+        """Get total counts and mean energy per channel over [t0, t1) x [e0, e1)
+
+        Bins are selected by their time/energy coordinate.
+        Each window costs O(channels), independent of the number of bins.
+        Bounds may be arrays (broadcast together) to query many windows at once.
+
+        Returns : xr.Dataset
+            'counts' and 'e_avg', dims [channel] or [window, channel]
+
+        parameters
+        ----------
+        t0 : float or [float]
+            window start [s]. If None, start at first bin
+        t1 : float or [float]
+            window end [s]. If None, include last bin
+        e0 : float or [float]
+            lower energy [MeV]. If None, start at first bin
+        e1 : float or [float]
+            upper energy [MeV]. If None, include last bin
+        """
+        t_idxs, e_idxs, dims = self._get_window_idxs(t0=t0, t1=t1, e0=e0, e1=e1)
+
+        counts = snow_tools.query_window_table(self._window_n, t_idxs, e_idxs)
+        e_tot = snow_tools.query_window_table(self._window_e, t_idxs, e_idxs)
+        e_avg = np.divide(e_tot, counts, out=np.zeros_like(e_tot), where=counts > 0)
+
+        window = xr.Dataset({'counts': (dims, counts),
+                             'e_avg': (dims, e_avg)},
+                            coords={'channel': self.channels})
+        return window
+
+    def window_spectrum(self, t0=None, t1=None, e0=None, e1=None):
+        """Get time-integrated spectrum per channel over [t0, t1)
+
+        Energy bins outside [e0, e1) are zeroed.
+        Bounds may be arrays (broadcast together) to query many windows at once.
+
+        Returns : xr.DataArray
+            dims [channel, energy] or [window, channel, energy]
+
+        parameters
+        ----------
+        t0 : float or [float]
+        t1 : float or [float]
+        e0 : float or [float]
+        e1 : float or [float]
+        """
+        (i_t0, i_t1), (i_e0, i_e1), dims = self._get_window_idxs(t0=t0, t1=t1,
+                                                                   e0=e0, e1=e1)
+
+        table = self._window_n[i_t1] - self._window_n[i_t0]
+        spectrum = np.diff(table, axis=-1)
+
+        e_idx = np.arange(len(self.e_bins))
+        in_window = (e_idx >= i_e0[..., np.newaxis, np.newaxis]) \
+            & (e_idx < i_e1[..., np.newaxis, np.newaxis])
+        spectrum = np.where(in_window, spectrum, 0.0)
+
+        spectrum = xr.DataArray(spectrum,
+                                dims=dims + ['energy'],
+                                coords={'channel': self.channels,
+                                        'energy': self.e_bins})
+        return spectrum
+
+    def _get_window_idxs(self, t0, t1, e0, e1):
+        """Return broadcast bin indexes and output dims of query windows
+
+        Returns : (i_t0, i_t1), (i_e0, i_e1), dims
+
+        parameters
+        ----------
+        t0 : float or [float]
+        t1 : float or [float]
+        e0 : float or [float]
+        e1 : float or [float]
+        """
+        i_t0, i_t1 = snow_tools.get_window_idxs(self.t_bins, lower=t0, upper=t1)
+        i_e0, i_e1 = snow_tools.get_window_idxs(self.e_bins, lower=e0, upper=e1)
+        idxs = np.broadcast_arrays(i_t0, i_t1, i_e0, i_e1)
+
+        if idxs[0].ndim > 1:
+            raise ValueError('Window bounds must be scalars or 1D arrays')
+
+        dims = ['window', 'channel'] if idxs[0].ndim == 1 else ['channel']
+        i_t0, i_t1, i_e0, i_e1 = idxs
+
+        return (i_t0, i_t1), (i_e0, i_e1), dims
+
     # ===============================================================
     #                      Plotting
     # ===============================================================
@@ -0,0 +1,123 @@
+import xarray as xr
+
+# snowflash
+from snowflash.snow import snow_tools
+from snowflash.utils.config import Config
+
+
+class SnowModelBatch:
+    def __init__(self,
+                 config_name,
+                 model_set=None,
+                 detector=None,
+                 mixing='nomix',
+                 zams_list=None,
+                 percentiles=(68, 95, 98),
+                 ):
+        """Binned counts for a whole model set, as a single 4D cube
+
+        All variables share one coordinate index (zams, time, channel, energy),
+        and are calculated for all progenitors with single vectorized reductions
+
+        parameters
+        ----------
+        config_name : str
+            name of config file used in 'snowflash/config/models/'
+        model_set : str
+            defaults to first model_set in config
+        detector : str
+            defaults to config detector
+        mixing : str
+        zams_list : [str]
+            defaults to config zams_list
+        percentiles : [int] or [flt]
+            energy percentile regions to calculate
+        """
+        self.config = Config(config_name)
+        self.model_set = self.config.model_sets[0] if model_set is None else model_set
+        self.detector = self.config.detector if detector is None else detector
+        self.mixing = mixing
+        self.zams_list = self.config.zams_list if zams_list is None else zams_list
+
+        self.data = None
+        self.e_percentiles = None
+        self.summary = None
+        self.channel_fracs = None
+
+        self.load_counts()
+        self.get_vars()
+        self.get_energy_percentiles(percentiles=percentiles)
+        self.get_summary()
+
+    # ===============================================================
+    #                      Loading
+    # ===============================================================
+    def load_counts(self):
+        """Load counts cube for all models
+        """
+        self.data = snow_tools.load_all_counts(zams_list=self.zams_list,
+                                               model_set=self.model_set,
+                                               detector=self.detector,
+                                               mixing=self.mixing)
+
+        self.data['counts'] = self.data.counts.transpose('zams', 'time',
+                                                         'channel', 'energy')
+
+    # ===============================================================
+    #                      Analysis
+    # ===============================================================
+    def get_vars(self):
+        """Calculate binned variables for all models
+        """
+        print('Calculating derived variables')
+        counts = self.data.counts
+
+        self.data['cumulative_e'] = counts.cumsum('energy')
+        self.data['sum_t'] = counts.sum('time')
+        self.data['sum_e'] = counts.sum('energy')
+        self.data['e_tot'] = (counts * counts['energy']).sum('energy')
+        self.data['e_avg'] = self.data.e_tot / self.data.sum_e
+
+    def get_energy_percentiles(self, percentiles=(68, 95, 98)):
+        """Calculate energy percentile regions for all models
+
+        parameters
+        ----------
+        percentiles : [int] or [flt]
+        """
+        print('Calculating energy percentiles')
+        self.e_percentiles = snow_tools.get_energy_percentiles(self.data.cumulative_e,
+                                                               percentiles=percentiles)
+
+    def get_summary(self):
+        """Calculate time-integrated summary stats for all models
+
+        Returns : xr.Dataset
+            dims [zams, channel]
+        """
+        print('Calculating summary stats')
+        counts = self.data.sum_e.sum('time')
+        e_tot = self.data.e_tot.sum('time')
+
+        self.summary = xr.Dataset({'counts': counts,
+                                   'e_avg': e_tot / counts,
+                                   'e_tot': e_tot,
+                                   'frac': counts / counts.sel(channel='all'),
+                                   'e_frac': e_tot / e_tot.sel(channel='all'),
+                                   })
+
+        self.channel_fracs = self.summary.frac
+
+    # ===============================================================
+    #                      Access
+    # ===============================================================
+    def sel_model(self, zams):
+        """Return all binned variables of a single model
+
+        Returns : xr.Dataset
+
+        parameters
+        ----------
+        zams : str
+        """
+        return self.data.sel(zams=zams)
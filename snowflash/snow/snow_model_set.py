@@ -1,5 +1,5 @@
+import itertools
 import numpy as np
-import matplotlib.pyplot as plt
 
 # snowflash
 from snowflash.snow import snow_tools, snow_plot
@@ -13,6 +13,7 @@ class SnowModelSet:
                  load_data=True,
                  mixing='nomix',
                  load_prog=False,
+                 detector=None,
                  ):
         """Collection of SnowGlobes data
 
@@ -23,14 +24,18 @@ class SnowModelSet:
                 e.g. config_name='sn1987a'
         load_data : bool
             immediately load all data
-        mixing : str
+        mixing : str or [str]
+            if list, tables have a 'mixing' dimension
         load_prog : bool
+        detector : str or [str]
+            defaults to config detector.
+            If list, tables have a 'detector' dimension
         """
         self.config = Config(config_name)
 
-        self.detector = self.config.detector
-        self.material = self.config.material
-        self.channels = self.config.channels
+        self.detector = self.config.detector if detector is None else detector
+        self.material = self.get_materials()
+        self.channels = self.get_channels()
 
         self.model_sets = self.config.model_sets
         self.zams_list = self.config.zams_list
@@ -54,21 +59,44 @@ class SnowModelSet:
     # ===============================================================
     #                      Load Tables
     # ===============================================================
-    def load_timebin_tables(self):
+    def load_timebin_tables(self, n_threads=None):
         """Load timebinned tables for all models
+
+        parameters
+        ----------
+        n_threads : int
+            number of I/O threads. Defaults to snow_tools.io_threads()
         """
-        tables = dict.fromkeys(self.model_sets)
+        self.timebin_tables = snow_tools.load_timebin_tables_sets(
+            model_sets=self.model_sets,
+            zams_list=self.zams_list,
+            detector=self.detector,
+            mixing=self.mixing,
+            n_threads=n_threads)
 
-        for model_set in self.model_sets:
-            print(f'Loading {model_set}')
+    def get_materials(self):
+        """Return detector material(s)
+
+        Returns : str or [str]
+        """
+        if isinstance(self.detector, str):
+            return self.config.get_param('detectors', 'materials', self.detector)
+        else:
+            return [self.config.get_param('detectors', 'materials', det)
+                    for det in self.detector]
+
+    def get_channels(self):
+        """Return union of channel groups for all detector materials
+
+        Returns : [str]
+        """
+        channels = []
 
-            tables[model_set] = snow_tools.load_all_timebin_tables(
-                zams_list=self.zams_list,
-                model_set=model_set,
-                detector=self.detector,
-                mixing=self.mixing)
+        for material in np.atleast_1d(self.material):
+            groups = self.config.get_param('detectors', 'channel_groups', material)
+            channels += [chan for chan in groups if chan not in channels]
 
-        self.timebin_tables = tables
+        return channels
 
     def load_prog_table(self):
         """Load progenitor table
@@ -154,7 +182,7 @@ class SnowModelSet:
         """
         fig, ax = plot.setup_fig_ax(ax=ax, figsize=figsize)
 
-        for model_set, integrated in self.integrated_tables.items():
+        for label, color, integrated in self.iter_tables(self.integrated_tables):
             snow_plot.plot_integrated(integrated=integrated,
                                       y_var=y_var,
                                       channel=channel,
@@ -162,8 +190,8 @@ class SnowModelSet:
                                       prog_table=self.prog_table,
                                       marker=marker,
                                       ax=ax,
-                                      label=model_set,
-                                      color=self.config.color(model_set),
+                                      label=label,
+                                      color=color,
                                       data_only=True)
 
         if not data_only:
@@ -215,9 +243,10 @@ class SnowModelSet:
 
         fig = None
         if axes is None:
+            import matplotlib.pyplot as plt
             fig, axes = plt.subplots(len(channels), figsize=figsize, sharex=True)
 
-        for model_set, integrated in self.integrated_tables.items():
+        for label, color, integrated in self.iter_tables(self.integrated_tables):
             snow_plot.plot_channels(integrated=integrated,
                                     y_var=y_var,
                                     channels=channels,
@@ -225,8 +254,8 @@ class SnowModelSet:
                                     prog_table=self.prog_table,
                                     marker=marker,
                                     figsize=figsize,
-                                    label=model_set,
-                                    color=self.config.color(model_set),
+                                    label=label,
+                                    color=color,
                                     legend=False,
                                     axes=axes,
                                     data_only=True)
@@ -275,20 +304,26 @@ class SnowModelSet:
         figsize : (width, length)
         ax : Axis
         """
-        fig = snow_plot.plot_difference(tables=self.integrated_tables,
-                                        y_var=y_var,
-                                        channel=channel,
-                                        ref_model_set=ref_model_set,
-                                        x_var=x_var,
-                                        prog_table=self.prog_table,
-                                        x_scale=x_scale,
-                                        y_scale=y_scale,
-                                        x_lims=x_lims,
-                                        y_lims=y_lims,
-                                        marker=marker,
-                                        figsize=figsize,
-                                        legend=legend,
-                                        ax=ax)
+        fig, ax = plot.setup_fig_ax(ax=ax, figsize=figsize)
+        ref_table = self.integrated_tables[ref_model_set]
+
+        for sel in dim_selections(ref_table):
+            tables = {model_set: table.sel(sel)
+                      for model_set, table in self.integrated_tables.items()}
+
+            snow_plot.plot_difference(tables=tables,
+                                      y_var=y_var,
+                                      channel=channel,
+                                      ref_model_set=ref_model_set,
+                                      x_var=x_var,
+                                      prog_table=self.prog_table,
+                                      x_scale=x_scale,
+                                      y_scale=y_scale,
+                                      x_lims=x_lims,
+                                      y_lims=y_lims,
+                                      marker=marker,
+                                      legend=legend,
+                                      ax=ax)
         return fig
 
     def plot_timebin(self, y_var, zams,
@@ -314,12 +349,12 @@ class SnowModelSet:
         """
         fig, ax = plot.setup_fig_ax(ax=ax, figsize=None)
 
-        for model_set, timebin_table in self.timebin_tables.items():
+        for label, color, timebin_table in self.iter_tables(self.timebin_tables):
             snow_plot.plot_timebin(timebin_table=timebin_table,
                                    y_var=y_var,
                                    zams=zams,
-                                   label=model_set,
-                                   color=self.config.color(model_set),
+                                   label=label,
+                                   color=color,
                                    channel=channel,
                                    ax=ax,
                                    data_only=True)
@@ -363,7 +398,7 @@ class SnowModelSet:
 
         fig, ax = plot.setup_fig_ax(ax=ax, figsize=None)
 
-        for model_set, cumulative in self.cumulative.items():
+        for label, color, cumulative in self.iter_tables(self.cumulative):
             snow_plot.plot_cumulative(cumulative=cumulative,
                                       y_var=y_var,
                                       zams=zams,
@@ -371,8 +406,8 @@ class SnowModelSet:
                                       x_scale=x_scale,
                                       y_scale=y_scale,
                                       ax=ax,
-                                      label=model_set,
-                                      color=self.config.color(model_set),
+                                      label=label,
+                                      color=color,
                                       linestyle=linestyle,
                                       data_only=True)
 
@@ -423,12 +458,12 @@ class SnowModelSet:
         def update_slider(n_integrate):
             n_integrate = int(n_integrate)
 
-            for i, model_set in enumerate(self.model_sets):
-                data = self.cumulative[model_set].isel(time=n_integrate)
+            for label, _, cumulative in self.iter_tables(self.cumulative):
+                data = cumulative.isel(time=n_integrate)
 
                 slider.update_ax_y(y=data[y_col],
                                    y_var=y_col,
-                                   model_set=model_set)
+                                   model_set=label)
 
             slider.fig.canvas.draw_idle()
 
@@ -439,9 +474,11 @@ class SnowModelSet:
 
         y_col = snow_tools.y_column(y_var=y_var, channel=channel)
 
+        labels = [label for label, _, _ in self.iter_tables(self.cumulative)]
+
         slider = SnowSlider(y_vars=[y_col],
                             n_integrate=np.arange(1, self.n_integrate - 1),
-                            model_sets=self.model_sets,
+                            model_sets=labels,
                             x_factor=x_factor,
                             y_factor=y_factor)
 
@@ -465,6 +502,26 @@ class SnowModelSet:
     # ===============================================================
     #                      Misc.
     # ===============================================================
+    def iter_tables(self, tables):
+        """Split tables into individual (model_set, mixing, detector) selections
+
+        Returns : [(label, color, table)]
+
+        parameters
+        ----------
+        tables : {model_set: xr.Dataset}
+        """
+        selections = []
+
+        for model_set, table in tables.items():
+            for sel in dim_selections(table):
+                label = ' '.join([model_set] + [str(v) for v in sel.values()])
+                color = self.config.color(model_set) if len(sel) == 0 else None
+
+                selections += [(label, color, table.sel(sel))]
+
+        return selections
+
     def print_time_slice(self, n_bins):
         """Print time limits for given n_bins
 
@@ -479,3 +536,18 @@ class SnowModelSet:
         t0 = ref_table.time.values[0]
         t1 = ref_table.time.values[n_bins - 1]
         print(f'Using timebins from {t0:.2f} to {t1:.2f} s')
+
+
+def dim_selections(table):
+    """Return selections of every combination of mixing and detector in table
+
+    Returns : [{dim: value}]
+
+    parameters
+    ----------
+    table : xr.Dataset
+    """
+    dims = [dim for dim in ('mixing', 'detector') if dim in table.dims]
+    dim_values = [table[dim].values for dim in dims]
+
+    return [dict(zip(dims, values)) for values in itertools.product(*dim_values)]
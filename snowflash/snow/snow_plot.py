@@ -1,5 +1,3 @@
-import matplotlib.pyplot as plt
-
 # snowglobes
 from snowflash.snow import snow_tools
 from snowflash.utils import plot
@@ -165,6 +163,8 @@ def plot_channels(integrated, y_var, prog_table, channels,
     label : str
     data_only : bool
     """
+    import matplotlib.pyplot as plt
+
     fig = None
     if axes is None:
         fig, axes = plt.subplots(len(channels), figsize=figsize, sharex=True)
@@ -1,7 +1,8 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 import xarray as xr
-from scipy.interpolate import interp1d
 
 # snowflash
 from snowflash.utils import paths
@@ -17,7 +18,8 @@ Tools for handling snowglobes data
 def load_all_timebin_tables(zams_list,
                             model_set,
                             detector,
-                            mixing):
+                            mixing,
+                            n_threads=None):
     """Load and combine timebinned tables for all models
 
     Returns : xr.Dataset
@@ -29,26 +31,137 @@ def load_all_timebin_tables(zams_list,
     model_set : str
     detector : str
     mixing : str
+    n_threads : int
+        number of I/O threads. Defaults to io_threads()
     """
-    tables_dict = {}
-    for j, zams in enumerate(zams_list):
-        print(f'\rLoading timebin tables: {j+1}/{len(zams_list)}', end='')
+    tables = load_timebin_tables_sets(model_sets=[model_set],
+                                      zams_list=zams_list,
+                                      detector=detector,
+                                      mixing=mixing,
+                                      n_threads=n_threads)
+    return tables[model_set]
 
-        table = load_timebin_table(zams=zams,
-                                   model_set=model_set,
-                                   detector=detector,
-                                   mixing=mixing)
 
-        table.set_index('time', inplace=True)
-        tables_dict[zams] = table.to_xarray()
+def load_timebin_tables_sets(model_sets,
+                             zams_list,
+                             detector,
+                             mixing,
+                             n_threads=None):
+    """Load timebinned tables for multiple model sets in parallel
 
-    print()
-    timebin_tables = xr.concat(tables_dict.values(), dim='zams')
-    timebin_tables.coords['zams'] = list(zams_list)
+    Files are read and parsed concurrently across all model sets,
+    detectors, mixings and zams, then assembled into preallocated arrays
+
+    Returns : {model_set: xr.Dataset}
+        dims ([mixing], [detector], zams, time)
+
+    parameters
+    ----------
+    model_sets : [str]
+    zams_list : [str]
+    detector : str or [str]
+        if list, tables have a 'detector' dimension
+    mixing : str or [str]
+        if list, tables have a 'mixing' dimension
+    n_threads : int
+        number of I/O threads. Defaults to io_threads()
+    """
+    if n_threads is None:
+        n_threads = io_threads()
+
+    detectors = list(np.atleast_1d(detector))
+    mixings = list(np.atleast_1d(mixing))
+
+    keys = [(model_set, mix, det, zams) for model_set in model_sets
+            for mix in mixings
+            for det in detectors
+            for zams in zams_list]
+
+    def load(key):
+        return load_timebin_table(zams=key[3],
+                                  model_set=key[0],
+                                  detector=key[2],
+                                  mixing=key[1])
+
+    print(f'Loading {len(keys)} timebin tables ({n_threads} threads)')
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        tables = dict(zip(keys, executor.map(load, keys)))
+
+    timebin_tables = {}
+    for model_set in model_sets:
+        model_tables = {key[1:]: table for key, table in tables.items()
+                        if key[0] == model_set}
+
+        stacked = stack_timebin_tables(model_tables,
+                                       zams_list=zams_list,
+                                       mixings=mixings,
+                                       detectors=detectors)
+
+        squeeze = [dim for dim, sel in [('mixing', mixing), ('detector', detector)]
+                   if isinstance(sel, str)]
+        timebin_tables[model_set] = stacked.squeeze(squeeze, drop=True)
+
+    return timebin_tables
+
+
+def stack_timebin_tables(tables, zams_list, mixings, detectors):
+    """Stack timebin tables into a (mixing, detector, zams, time) Dataset
+
+    Columns and time bins missing from a table (e.g. channels of
+    a different detector material) are filled with NaN
+
+    Returns : xr.Dataset
+
+    parameters
+    ----------
+    tables : {(mixing, detector, zams): pd.DataFrame}
+    zams_list : [str]
+    mixings : [str]
+    detectors : [str]
+    """
+    time = np.unique(np.concatenate([t['time'].to_numpy() for t in tables.values()]))
+    columns = []
+
+    for table in tables.values():
+        columns += [col for col in table.columns
+                    if (col != 'time') and (col not in columns)]
+
+    dims = ['mixing', 'detector', 'zams', 'time']
+    shape = (len(mixings), len(detectors), len(zams_list), len(time))
+    data_vars = {col: np.full(shape, np.nan) for col in columns}
+
+    for (mix, det, zams), table in tables.items():
+        idx = (mixings.index(mix), detectors.index(det), list(zams_list).index(zams))
+        t_idx = np.searchsorted(time, table['time'].to_numpy())
+
+        for col in table.columns.drop('time'):
+            data_vars[col][idx + (t_idx,)] = table[col].to_numpy()
+
+    timebin_tables = xr.Dataset({col: (dims, array) for col, array in data_vars.items()},
+                                coords={'mixing': mixings,
+                                        'detector': detectors,
+                                        'zams': list(zams_list),
+                                        'time': time})
 
     return timebin_tables
 
 
+def io_threads():
+    """Return default number of threads for loading files
+
+    Set with environment variable SNOWFLASH_IO_THREADS,
+    e.g. higher for networked filesystems, lower for a single local disk
+
+    Returns : int
+    """
+    n_threads = os.environ.get('SNOWFLASH_IO_THREADS')
+
+    if n_threads is None:
+        return min(32, (os.cpu_count() or 1) + 4)
+    else:
+        return int(n_threads)
+
+
 def load_all_counts(zams_list,
                     model_set,
                     detector,
@@ -104,13 +217,23 @@ def load_counts(zams,
 
     print(f'Loading counts')
     counts = xr.load_dataarray(filepath)
-    
-    # get sum of all channels
+
+    return add_total_channel(counts)
+
+
+def add_total_channel(counts):
+    """Prepend 'all' channel, the sum of all channels
+
+    Returns : xr.DataArray
+
+    parameters
+    ----------
+    counts : xr.DataArray
+    """
     tot = counts.sum('channel')
     tot.coords['channel'] = 'all'
-    counts = xr.concat([tot, counts], dim='channel')
 
-    return counts
+    return xr.concat([tot, counts], dim='channel')
 
 
 def save_model_data(data,
@@ -202,13 +325,16 @@ def load_prog_table(model_set):
 def time_integrate(timebin_tables, n_bins, channels):
     """Integrate a set of models over a given no. of time bins
 
+    Vectorized over any extra dimensions, e.g. mixing and detector.
+    Channels missing from a detector remain NaN
+
     Returns : xr.Dataset
-        dim: [zams]
+        dim: [..., zams]
 
     parameters
     ----------
     timebin_tables : xr.Dataset
-        3D table of timebinned models, dim: [zams, time]
+        table of timebinned models, dim: [..., zams, time]
     n_bins : int
         no. of time bins to integrate over. Currently each bin is 5 ms
     channels : [str]
@@ -217,7 +343,7 @@ def time_integrate(timebin_tables, n_bins, channels):
     channels = ['total'] + channels
 
     time_slice = timebin_tables.isel(time=slice(0, n_bins))
-    totals = time_slice.sum(dim='time')
+    totals = time_slice.sum(dim='time', min_count=1)
     table = xr.Dataset()
 
     for channel in channels:
@@ -225,7 +351,7 @@ def time_integrate(timebin_tables, n_bins, channels):
         avg = f'energy_{channel}'
 
         total_counts = totals[tot]
-        total_energy = (time_slice[avg] * time_slice[tot]).sum(dim='time')
+        total_energy = (time_slice[avg] * time_slice[tot]).sum(dim='time', min_count=1)
 
         table[tot] = total_counts
         table[avg] = total_energy / total_counts
@@ -233,28 +359,50 @@ def time_integrate(timebin_tables, n_bins, channels):
     return table
 
 
-def get_cumulative(counts):
-    """Calculate cumulative neutrino counts for each time bin
+def get_cumulative(timebin_tables, max_n_bins, channels):
+    """Calculate cumulative counts and mean energies versus time
 
-    Returns : xr.DataArray
+    Vectorized over any extra dimensions, e.g. mixing and detector
+
+    Returns : xr.Dataset
+        dim: [..., zams, time]
 
     parameters
     ----------
-    counts : xr.DataArray
+    timebin_tables : xr.Dataset
+        table of timebinned models, dim: [..., zams, time]
+    max_n_bins : int
+        no. of time bins to integrate up to
+    channels : [str]
+        list of channel names
     """
-    cumulative = counts.copy()
-    cumulative[:] = 0
+    channels = ['total'] + channels
+
+    time_slice = timebin_tables.isel(time=slice(0, max_n_bins))
+    table = xr.Dataset()
+
+    for channel in channels:
+        tot = f'counts_{channel}'
+        avg = f'energy_{channel}'
+
+        cumul_counts = time_slice[tot].cumsum(dim='time')
+        cumul_energy = (time_slice[avg] * time_slice[tot]).cumsum(dim='time')
 
-    cumulative[0] = counts[0]
-    for i in range(1, len(counts)):
-        cumulative[i] = cumulative[i-1] + counts[i]
+        table[tot] = cumul_counts
+        table[avg] = cumul_energy / cumul_counts
 
-    return cumulative
+    return table
 
 
 def get_energy_percentiles(cumulative_e, percentiles=(68, 95, 98)):
     """Calculate energy percentile regions
 
+    Vectorized over all dimensions other than channel and energy,
+    e.g. [time] for a single model or [zams, time] for a batch
+
+    Returns : xr.DataArray
+        dims [percentile, bound, ...]
+
     parameters
     ----------
     cumulative_e : xr.DataArray
@@ -263,51 +411,162 @@ def get_energy_percentiles(cumulative_e, percentiles=(68, 95, 98)):
     e_cumul = cumulative_e.sel(channel='all')
     p_cumul = e_cumul / e_cumul.isel(energy=-1)
 
-    t_bins = p_cumul['time']
-    e_bins = p_cumul['energy']
-    n_tbins = len(t_bins)
+    dims = [dim for dim in p_cumul.dims if dim != 'energy']
+    p_cumul = p_cumul.transpose(*dims, 'energy')
 
-    energy = np.zeros([len(percentiles), 2, n_tbins])
+    levels = np.zeros([len(percentiles), 2])
 
     for p_idx, p in enumerate(percentiles):
         p_lo = (1 - p/100) / 2
-        p_hi = 1 - p_lo
+        levels[p_idx] = [p_lo, 1 - p_lo]
+
+    energy = interp_cumulative(p_cumul=p_cumul.to_numpy(),
+                               e_bins=p_cumul['energy'].to_numpy(),
+                               levels=levels)
 
-        for t_idx in range(n_tbins):
-            interp = interp1d(x=p_cumul[t_idx], y=e_bins)
-            energy[p_idx, :, t_idx] = interp([p_lo, p_hi])
+    coords = {dim: p_cumul[dim] for dim in dims}
+    coords.update({'percentile': list(percentiles),
+                   'bound': ['lower', 'upper']})
 
     e_percentiles = xr.DataArray(energy,
-                                 dims=['percentile', 'bound', 'time'],
-                                 coords={'percentile': list(percentiles),
-                                         'bound': ['lower', 'upper'],
-                                         'time': t_bins})
+                                 dims=['percentile', 'bound'] + dims,
+                                 coords=coords)
 
     return e_percentiles
 
 
+def interp_cumulative(p_cumul, e_bins, levels):
+    """Invert normalized cumulative distributions by linear interpolation
+
+    Levels below the first cumulative value are clipped to the first energy bin.
+
+    Returns : [levels.shape, p_cumul.shape[:-1]]
+
+    parameters
+    ----------
+    p_cumul : [..., energy]
+        normalized cumulative distributions (non-decreasing along last axis)
+    e_bins : [energy]
+    levels : []
+        cumulative fractions to find energies of
+    """
+    n_ebins = len(e_bins)
+    rows = p_cumul.reshape(-1, n_ebins)
+    q = np.ravel(levels)[:, np.newaxis, np.newaxis]
+
+    # index of first bin at or above each level
+    idx = np.sum(rows < q, axis=-1)
+    idx = np.clip(idx, 1, n_ebins - 1)
+
+    p0 = np.take_along_axis(rows[np.newaxis], idx[..., np.newaxis] - 1, axis=-1)[..., 0]
+    p1 = np.take_along_axis(rows[np.newaxis], idx[..., np.newaxis], axis=-1)[..., 0]
+    e0 = e_bins[idx - 1]
+    e1 = e_bins[idx]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = np.where(p1 > p0, (q[..., 0] - p0) / (p1 - p0), 0.0)
+
+    frac = np.clip(frac, 0, 1)
+    energy = e0 + frac * (e1 - e0)
+    energy[np.isnan(p0) | np.isnan(p1)] = np.nan  # no counts
+
+    return energy.reshape(np.shape(levels) + p_cumul.shape[:-1])
+
+
+def get_window_tables(counts):
+    """Build 2D cumulative tables over (time, energy) for window queries
+
+    Each table is zero-padded at the start of both axes, so that
+        table[i, :, j] = sum(counts[:i, :, :j])
+
+    Returns : cumul_n, cumul_e
+        cumulative counts and count-weighted energies [MeV],
+        shape [n_time+1, channels, n_energy+1]
+
+    parameters
+    ----------
+    counts : xr.DataArray
+        counts with dimensions [time, channel, energy]
+    """
+    counts = counts.transpose('time', 'channel', 'energy')
+    n_tbins, n_channels, n_ebins = counts.shape
+
+    weighted = {'n': counts.to_numpy(),
+                'e': (counts * counts['energy']).to_numpy()}
+    tables = {}
+
+    for key, values in weighted.items():
+        table = np.zeros([n_tbins + 1, n_channels, n_ebins + 1])
+        table[1:, :, 1:] = values.cumsum(axis=0).cumsum(axis=2)
+        tables[key] = table
+
+    return tables['n'], tables['e']
+
+
+def get_window_idxs(bins, lower, upper):
+    """Return index bounds of bins falling within [lower, upper)
+
+    Returns : i_lower, i_upper
+
+    parameters
+    ----------
+    bins : []
+        bin coordinates (sorted)
+    lower : float, [float] or None
+        lower bound (inclusive). If None, use first bin
+    upper : float, [float] or None
+        upper bound (exclusive). If None, include last bin
+    """
+    i_lower = 0 if lower is None else np.searchsorted(bins, lower, side='left')
+    i_upper = len(bins) if upper is None else np.searchsorted(bins, upper, side='left')
+
+    return i_lower, np.maximum(i_upper, i_lower)
+
+
+def query_window_table(table, t_idxs, e_idxs):
+    """Sum a 2D cumulative table over [t0, t1) x [e0, e1) index windows
+
+    Returns : [channels] or [windows, channels]
+
+    parameters
+    ----------
+    table : [n_time+1, channels, n_energy+1]
+        cumulative table from get_window_tables()
+    t_idxs : (t0, t1)
+        time index bounds, int or [int]
+    e_idxs : (e0, e1)
+        energy index bounds, int or [int]
+    """
+    t0, t1 = t_idxs
+    e0, e1 = e_idxs
+
+    return table[t1, :, e1] - table[t0, :, e1] - table[t1, :, e0] + table[t0, :, e0]
+
+
 def get_channel_fractions(tables, channels):
     """Calculate fractional contribution of each channel to total counts
 
+    Averaged over zams, and vectorized over any extra dimensions
+    (e.g. mixing and detector), which become extra index levels
+
     Returns: pd.DataFrame
 
     Parameters
     ----------
-    tables : {model_set: pd.DataFrame}
+    tables : {model_set: xr.Dataset}
     channels : [str]
     """
-    n_channels = len(channels)
-    frac_table = pd.DataFrame()
+    fracs = xr.Dataset()
 
     for model_set, table in tables.items():
-        fracs = np.zeros(n_channels)
+        model_fracs = [table[f'counts_{channel}'] / table['counts_total']
+                       for channel in channels]
 
-        for i, channel in enumerate(channels):
-            fracs[i] = np.mean(table[f'counts_{channel}'] / table['counts_total'])
+        fracs[model_set] = xr.concat(model_fracs, dim='channel').mean('zams')
 
-        frac_table[model_set] = fracs
+    fracs.coords['channel'] = channels
+    frac_table = fracs.to_dataframe()
 
-    frac_table.index = channels
     return frac_table
 
 
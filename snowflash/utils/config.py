@@ -1,13 +1,19 @@
 """Config class
 """
 from configparser import ConfigParser
+from functools import cached_property
+import os
 import ast
-from astropy import units
+import threading
 
 # snowflash
 from snowflash.utils import paths
 
-kpc_to_cm = units.kpc.to(units.cm)
+kpc_to_cm = 3.0856775814913673e21  # = astropy units.kpc.to(units.cm)
+
+# process-wide cache of loaded configs: {(name, file stamps): Config}
+_cache = {}
+_cache_lock = threading.Lock()
 
 
 class ConfigError(Exception):
@@ -15,14 +21,71 @@ class ConfigError(Exception):
 
 
 class Config:
+    def __new__(cls, name):
+        """Return shared Config, loading it only if not already cached
+
+        A Config is reused until any of its .ini files are modified
+        (or a different file is found), so models sharing a config
+        only parse it once per process
+
+        Parameters
+        ----------
+        name : str or Config
+            name of model config to load, e.g. 'sn1987a',
+            or an existing Config (returned as is)
+        """
+        if isinstance(name, Config):
+            return name
+
+        key = (name, get_file_stamps(name))
+
+        with _cache_lock:
+            config = _cache.get(key)
+
+            if config is None:
+                config = super().__new__(cls)
+                config.load(name)
+                _cache[key] = config
+
+        return config
+
     def __init__(self, name):
         """Holds and returns config values
 
+        Instances are shared (see __new__), so attributes can't be
+        set or deleted once loaded. This doesn't extend to the values:
+        lists and dicts (e.g. bins, paths, channel_groups, mixing)
+        are the shared originals, so copy them before modifying
+
         Parameters
         ----------
-        name : str
+        name : str or Config
             name of model config to load, e.g. 'sn1987a'
         """
+        pass  # already loaded by __new__
+
+    def __setattr__(self, key, value):
+        if self.__dict__.get('_frozen', False):
+            raise ConfigError(f"Config is shared, can't set '{key}'")
+
+        super().__setattr__(key, value)
+
+    def __delattr__(self, key):
+        raise ConfigError(f"Config is shared, can't delete '{key}'")
+
+    def __reduce__(self):
+        """Pickle by name only, so that sending a Config to workers is cheap.
+        Unpickling returns the worker's cached Config
+        """
+        return Config, (self.name,)
+
+    def load(self, name):
+        """Load config values from files
+
+        Parameters
+        ----------
+        name : str
+        """
         self.name = name
         self.configs = {'models': load_config(name),
                         'detectors': load_config('detectors'),
@@ -39,12 +102,56 @@ class Config:
         self.bins = self.get_section('models', 'bins')
         self.mixing = self.get_param('models', 'snow', 'mixing')
         self.distance = self.get_param('models', 'snow', 'distance') * kpc_to_cm
+        self.max_bins_on_disk = self.get_section('models', 'snow').get('max_bins_on_disk')
+        self.batch_size = self.get_section('models', 'snow').get('batch_size', 1)
+        self.cache_gb = self.get_section('models', 'snow').get('cache_gb')
 
         self.detector = self.get_param('models', 'snow', 'detector')
         self.material = self.get_param('detectors', 'materials', self.detector)
         self.channel_groups = self.get_param('detectors', 'channel_groups', self.material)
         self.channels = list(self.channel_groups.keys())
 
+        self._frozen = True
+
+    # ===============================================================
+    #                  derived values
+    # ===============================================================
+    @cached_property
+    def t_bins(self):
+        """Time bins (leftside), relative to bounce [s]. Computed once, read-only
+
+        Returns : []
+        """
+        return self.get_bins('t', endpoint=False)
+
+    @cached_property
+    def e_bins(self):
+        """Neutrino energy bins (leftside) [GeV]. Computed once, read-only
+
+        Returns : []
+        """
+        return self.get_bins('e', endpoint=True)
+
+    def get_bins(self, var, endpoint):
+        """Return read-only bin grid from [bins] section
+
+        Returns : []
+
+        parameters
+        ----------
+        var : 't' or 'e'
+        endpoint : bool
+        """
+        from snowflash.flash.flash_fluences import get_bins  # deferred, imports xarray
+
+        bins = get_bins(x0=self.bins[f'{var}_start'],
+                        x1=self.bins[f'{var}_end'],
+                        dx=self.bins[f'{var}_step'],
+                        endpoint=endpoint)
+        bins.flags.writeable = False
+
+        return bins
+
     # ===============================================================
     #                  general config
     # ===============================================================
@@ -164,3 +271,29 @@ def load_config(name):
             config[section][option] = ast.literal_eval(ini.get(section, option))
 
     return config
+
+
+def get_file_stamps(name):
+    """Return (filepath, mtime, size) of each .ini file making up a config
+
+    Returns : ((str, int, int),)
+
+    parameters
+    ----------
+    name : str
+    """
+    stamps = []
+
+    for config_name in [name, 'detectors', 'plotting']:
+        filepath = paths.config_filepath(config_name)
+        stat = os.stat(filepath)
+        stamps += [(filepath, stat.st_mtime_ns, stat.st_size)]
+
+    return tuple(stamps)
+
+
+def clear_cache():
+    """Forget all cached configs, so that the next Config(name) reloads from file
+    """
+    with _cache_lock:
+        _cache.clear()
@@ -25,12 +25,41 @@ def top_path():
 
 def output_path():
     """Return path to top-level output directory
+
+    Overridden by the environment variable SNOWFLASH_OUTPUT
+    """
+    return os.environ.get('SNOWFLASH_OUTPUT', os.path.join(top_path(), 'output'))
+
+
+def scratch_path():
+    """Return path to scratch directory for private snowglobes runtimes
+
+    Overridden by the environment variable SNOWFLASH_SCRATCH,
+    e.g. a RAM disk ('/dev/shm') or node-local SSD
+    """
+    return os.environ.get('SNOWFLASH_SCRATCH',
+                          os.path.join(snow_shared_runtime_path(), 'runtimes'))
+
+
+def set_roots(scratch=None, output=None):
+    """Set scratch and output root directories, unless already set in environment
+
+    Parameters
+    ----------
+    scratch : str
+    output : str
     """
-    return os.path.join(top_path(), 'output')
+    for var, path in [('SNOWFLASH_SCRATCH', scratch),
+                      ('SNOWFLASH_OUTPUT', output)]:
+        if path is not None:
+            os.environ.setdefault(var, os.path.abspath(os.path.expanduser(path)))
 
 
 def config_filepath(name):
     """Return path to config file
+
+    Model configs are also searched for in the directory given by
+    the environment variable SNOWFLASH_CONFIG, if set
     """
     filename = f'{name}.ini'
     filepath = os.path.join(top_path(), 'config', filename)
@@ -38,6 +67,9 @@ def config_filepath(name):
     if not os.path.exists(filepath):
         filepath = os.path.join(top_path(), 'config', 'models', filename)
 
+    if (not os.path.exists(filepath)) and ('SNOWFLASH_CONFIG' in os.environ):
+        filepath = os.path.join(os.environ['SNOWFLASH_CONFIG'], filename)
+
     filepath = os.path.abspath(filepath)
 
     if not os.path.exists(filepath):
@@ -49,8 +81,7 @@ def config_filepath(name):
 def check_dir_exists(path):
     """Create directory (tree) if it doesn't exist
     """
-    if not os.path.isdir(path):
-        os.makedirs(path)
+    os.makedirs(path, exist_ok=True)
 
 
 # ===============================================================
@@ -100,15 +131,62 @@ def model_fluences_filepath(model_set, zams, flu_type):
     return os.path.join(path, filename)
 
 
+def shard_filepath(config_name, n_shards, key):
+    """Return filepath to saved assignment of work units to shards
+
+    Parameters
+    ----------
+    config_name : str
+    n_shards : int
+    key : str
+        hash of the config's work units
+    """
+    filename = f'shards_{config_name}_{n_shards}_{key}.json'
+
+    return os.path.join(output_path(), 'shards', filename)
+
+
+def manifest_filepath(model_set, zams, detector, mixing):
+    """Return filepath to pipeline manifest of a single model
+    """
+    path = os.path.join(model_set_path(model_set), 'manifest')
+    filename = f'manifest_{detector}_{mixing}_{model_set}_{zams}.json'
+
+    return os.path.join(path, filename)
+
+
 # ===============================================================
 #                          Snowglobes files
 # ===============================================================
 def snow_runtime_path():
     """Return path to temporary snowglobes runtime directory
+
+    Overridden by the environment variable SNOWFLASH_RUNTIME,
+    e.g. to give each driver invocation a private runtime
+    """
+    return os.environ.get('SNOWFLASH_RUNTIME', snow_shared_runtime_path())
+
+
+def snow_cache_path():
+    """Return path to snowglobes result cache
+
+    Overridden by the environment variable SNOWFLASH_CACHE
+    """
+    return os.environ.get('SNOWFLASH_CACHE', os.path.join(output_path(), 'snow_cache'))
+
+
+def snow_shared_runtime_path():
+    """Return path to shared snowglobes runtime directory, holding read-only tables
     """
     return os.path.join(top_path(), 'snowglobes')
 
 
+def snow_private_runtime_path(name):
+    """Return path to private snowglobes runtime directory
+    """
+    return os.path.join(scratch_path(), name)
+
+
 def snow_model_path(model_set, detector, mixing):
     """Return path to snowglobes model output directory
     """
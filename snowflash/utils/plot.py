@@ -1,8 +1,10 @@
 import numpy as np
-import matplotlib.pyplot as plt
 
 """
 Generalised plotting wrappers
+
+matplotlib is only imported once a figure is created,
+so that importing snowflash stays fast when not plotting
 """
 
 
@@ -17,6 +19,7 @@ def setup_fig_ax(ax, figsize):
     fig = None
 
     if ax is None:
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots(figsize=figsize)
 
     return fig, ax
@@ -45,6 +48,7 @@ def setup_subplots(n_sub,
     n_cols = {False: 1, True: max_cols}.get(n_sub > 1)
     figsize = (n_cols * sub_figsize[0], n_rows * sub_figsize[1])
 
+    import matplotlib.pyplot as plt
     return plt.subplots(n_rows, n_cols, figsize=figsize, **kwargs)
 
 
@@ -59,6 +63,7 @@ def check_ax(ax, figsize):
     fig = None
 
     if ax is None:
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots(figsize=figsize)
 
     return fig, ax
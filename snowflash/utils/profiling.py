@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import resource
+import threading
+import contextlib
+
+"""
+Per-stage profiling of pipeline runs
+
+Stages are wrapped in stage(), which records wall time, CPU time
+(of this process and of finished subprocesses), peak RSS,
+bytes read/written, and no. of snowglobes subprocesses started.
+Nothing is recorded unless enable() has been called.
+
+CPU, I/O, and subprocess counts are process-wide, so stages running
+concurrently in threads (e.g. streaming, or concurrent models)
+are each attributed the activity of the others while they overlap.
+Peak RSS is that of the whole process so far.
+
+Worker processes record their own stages; pass pop_records() back to
+the parent and add_records() them there, before writing the report
+"""
+
+enabled = False
+_records = []
+_n_subprocesses = 0
+_lock = threading.Lock()
+
+
+def enable():
+    """Start recording stages, in this process and any forked later
+    """
+    global enabled
+    enabled = True
+
+
+@contextlib.contextmanager
+def stage(name, model_set=None, zams=None, mixing=None):
+    """Profile a block of code as a pipeline stage
+
+    Parameters
+    ----------
+    name : str
+    model_set : str
+    zams : str
+    mixing : str
+    """
+    if not enabled:
+        yield
+        return
+
+    start = get_counters()
+
+    try:
+        yield
+    finally:
+        end = get_counters()
+        record = {'stage': name,
+                  'model_set': model_set,
+                  'zams': None if zams is None else str(zams),
+                  'mixing': mixing,
+                  'pid': os.getpid(),
+                  'start': start['time'],
+                  'max_rss_mb': end['max_rss_mb']}
+
+        for key in ['wall', 'cpu', 'child_cpu', 'read_mb', 'write_mb', 'subprocesses']:
+            record[key] = end[key] - start[key]
+
+        with _lock:
+            _records.append(record)
+
+
+def count_subprocess():
+    """Count a started subprocess
+    """
+    global _n_subprocesses
+
+    with _lock:
+        _n_subprocesses += 1
+
+
+def get_counters():
+    """Return current values of process counters
+
+    Returns : {}
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    io = read_proc_io()
+
+    return {'time': time.time(),
+            'wall': time.perf_counter(),
+            'cpu': usage.ru_utime + usage.ru_stime,
+            'child_cpu': child_usage.ru_utime + child_usage.ru_stime,
+            'max_rss_mb': usage.ru_maxrss / 1024,  # KB on Linux
+            'read_mb': io.get('rchar', 0) / 1e6,
+            'write_mb': io.get('wchar', 0) / 1e6,
+            'subprocesses': _n_subprocesses}
+
+
+def read_proc_io():
+    """Return I/O counters of this process from /proc/self/io (Linux only)
+
+    rchar/wchar count all bytes passed to read()/write(),
+    whether or not they reached the disk (e.g. page cache, tmpfs)
+
+    Returns : {counter: int}
+        empty if unavailable
+    """
+    try:
+        with open('/proc/self/io', 'r') as f:
+            return {key: int(value) for key, value in
+                    (line.split(':') for line in f if ':' in line)}
+    except OSError:
+        return {}
+
+
+def pop_records():
+    """Return and clear recorded stages of this process
+
+    Returns : [{}]
+    """
+    with _lock:
+        records = list(_records)
+        _records.clear()
+
+    return records
+
+
+def add_records(records):
+    """Add stages recorded by another process
+
+    Parameters
+    ----------
+    records : [{}]
+    """
+    with _lock:
+        _records.extend(records)
+
+
+# =======================================================
+#                 Reports
+# =======================================================
+def summarize(records, keys):
+    """Sum records grouped by keys
+
+    Returns : {group: {}}
+
+    Parameters
+    ----------
+    records : [{}]
+    keys : [str]
+        record fields to group by, e.g. ['stage']
+    """
+    summary = {}
+
+    for record in records:
+        group = ' '.join(str(record[key]) for key in keys)
+        totals = summary.setdefault(group, {'count': 0, 'wall': 0.0, 'cpu': 0.0,
+                                            'child_cpu': 0.0, 'read_mb': 0.0,
+                                            'write_mb': 0.0, 'subprocesses': 0,
+                                            'max_rss_mb': 0.0})
+        totals['count'] += 1
+        totals['max_rss_mb'] = max(totals['max_rss_mb'], record['max_rss_mb'])
+
+        for key in ['wall', 'cpu', 'child_cpu', 'read_mb', 'write_mb', 'subprocesses']:
+            totals[key] += record[key]
+
+    return summary
+
+
+def write_report(filepath):
+    """Write JSON profile of all recorded stages
+
+    Parameters
+    ----------
+    filepath : str
+    """
+    records = list(_records)
+    models = [r for r in records if r['model_set'] is not None]
+
+    report = {'created': time.time(),
+              'stages': summarize(records, keys=['stage']),
+              'models': summarize(models, keys=['model_set', 'zams']),
+              'records': records}
+
+    directory = os.path.dirname(os.path.abspath(filepath))
+    os.makedirs(directory, exist_ok=True)
+
+    with open(filepath, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    print(f'Profile saved: {filepath}')
+
+
+def print_summary():
+    """Print table of recorded stages, totalled per stage and per progenitor
+    """
+    records = list(_records)
+    models = [r for r in records if r['model_set'] is not None]
+
+    for title, summary in [('stage', summarize(records, keys=['stage'])),
+                           ('progenitor', summarize(models, keys=['model_set', 'zams']))]:
+        print(f"\n{title:<20}{'n':>6}{'wall [s]':>10}{'cpu [s]':>10}{'child [s]':>10}"
+              f"{'rss [MB]':>10}{'read [MB]':>11}{'write [MB]':>11}{'procs':>7}")
+
+        for group, t in sorted(summary.items(), key=lambda x: -x[1]['wall']):
+            print(f"{group:<20}{t['count']:>6}{t['wall']:>10.2f}{t['cpu']:>10.2f}"
+                  f"{t['child_cpu']:>10.2f}{t['max_rss_mb']:>10.1f}{t['read_mb']:>11.1f}"
+                  f"{t['write_mb']:>11.1f}{t['subprocesses']:>7}")
@@ -0,0 +1,410 @@
+import os
+import json
+import time
+import queue
+import socket
+import threading
+import multiprocessing
+
+"""
+Live progress of a batch run, in a status file and rate-limited log lines
+
+The pipeline reports events (unit started, bins completed, unit finished)
+with the module functions below. In the driver process, these go
+straight to the Tracker; worker processes send them to the driver's
+Tracker through a multiprocessing queue (see set_queue()).
+
+The Tracker atomically rewrites a small JSON status file every few seconds,
+with the running units, bins completed, throughput, estimated time
+remaining, and health of each worker, so it can be polled cheaply.
+Nothing is reported unless a Tracker has been started
+"""
+
+_tracker = None
+_events = None
+
+
+def start_unit(model_set, zams, mixing, n_bins):
+    """Report that a unit has started
+
+    Parameters
+    ----------
+    model_set : str
+    zams : str
+    mixing : str
+    n_bins : int
+    """
+    _send('start', model_set, zams, mixing, n_bins)
+
+
+def add_bins(model_set, zams, n, skipped=False):
+    """Report completed time bins of a running unit
+
+    Parameters
+    ----------
+    model_set : str
+    zams : str
+    n : int
+    skipped : bool
+        bins were already complete (e.g. incremental), rather than run
+    """
+    _send('bins', model_set, zams, n, skipped)
+
+
+def finish_unit(model_set, zams, failed=False):
+    """Report that a unit has finished
+
+    Parameters
+    ----------
+    model_set : str
+    zams : str
+    failed : bool
+    """
+    _send('finish', model_set, zams, failed)
+
+
+def _send(kind, *args):
+    """Send event to tracker, if there is one
+    """
+    if (_tracker is None) and (_events is None):
+        return
+
+    event = (kind, socket.gethostname(), os.getpid(), time.time()) + args
+
+    if _tracker is not None:
+        _tracker.handle(event)
+    else:
+        _events.put(event)
+
+
+def set_tracker(tracker):
+    """Send events of this process to tracker
+
+    Parameters
+    ----------
+    tracker : Tracker or None
+    """
+    global _tracker, _events
+    _tracker = tracker
+    _events = None
+
+
+def set_queue(events):
+    """Send events of this (worker) process to the driver's tracker
+
+    Parameters
+    ----------
+    events : multiprocessing.Queue or None
+        from Tracker.get_queue()
+    """
+    global _tracker, _events
+    _tracker = None  # forked copy of the driver's tracker
+    _events = events
+
+
+def get_queue():
+    """Return event queue for worker processes, or None if not tracking
+
+    Returns : multiprocessing.Queue or None
+    """
+    if _tracker is None:
+        return None
+
+    return _tracker.get_queue()
+
+
+class Tracker:
+    def __init__(self, n_units=None, n_bins=None,
+                 filepath=None,
+                 interval=5.0,
+                 log_interval=None,
+                 stale_after=600):
+        """Live progress of a batch run
+
+        Parameters
+        ----------
+        n_units : int
+            total no. of units in run, if known
+        n_bins : int
+            no. of time bins per unit
+        filepath : str
+            status file, rewritten every interval
+        interval : float
+            time between status file updates [s]
+        log_interval : float
+            time between progress lines [s], or None for no progress lines
+        stale_after : float
+            time since last event after which a worker is reported stale [s]
+        """
+        self.n_units = n_units
+        self.n_bins = n_bins
+        self.filepath = filepath
+        self.interval = interval
+        self.log_interval = log_interval
+        self.stale_after = stale_after
+
+        self.started = time.time()
+        self.units_done = 0
+        self.units_failed = 0
+        self.bins_run = 0
+        self.bins_skipped = 0
+        self.running = {}  # (host, pid, model_set, zams): {}
+        self.workers = {}  # (host, pid): time of last event
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._events = None
+
+    def start(self):
+        """Start tracking events of this process, and writing status in background
+
+        The worker event queue is created first, so that it already exists
+        when the background thread starts reading it, and before any pool forks.
+        Workers forked while the thread runs never use their copy of the tracker
+        (see set_queue()), so its thread and lock aren't needed in the child
+        """
+        self.get_queue()
+        set_tracker(self)
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop tracking, and write final status
+        """
+        self._stop.set()
+        self._thread.join()
+        set_tracker(None)
+
+        self._drain()
+        self.write_status(finished=True)
+        self.log()
+
+    def get_queue(self, context=None):
+        """Return queue for worker processes to send events through
+
+        Created by start(), if not before
+
+        Returns : multiprocessing.Queue
+
+        Parameters
+        ----------
+        context : multiprocessing context
+            defaults to fork, as used by pool.py
+        """
+        if self._events is None:
+            context = multiprocessing.get_context('fork') if context is None else context
+            self._events = context.Queue()
+
+        return self._events
+
+    def handle(self, event):
+        """Update progress with event
+
+        Parameters
+        ----------
+        event : tuple
+            (kind, host, pid, time, *args), from _send()
+        """
+        kind, host, pid, t, *args = event
+
+        with self._lock:
+            self.workers[(host, pid)] = t
+
+            if kind == 'start':
+                model_set, zams, mixing, n_bins = args
+                self.running[(host, pid, model_set, zams)] = {'mixing': mixing,
+                                                              'n_bins': n_bins,
+                                                              'bins_done': 0,
+                                                              'started': t}
+            elif kind == 'bins':
+                model_set, zams, n, skipped = args
+                unit = self.running.get((host, pid, model_set, zams))
+
+                if unit is not None:
+                    unit['bins_done'] += n
+
+                if skipped:
+                    self.bins_skipped += n
+                else:
+                    self.bins_run += n
+
+            elif kind == 'finish':
+                model_set, zams, failed = args
+                self.running.pop((host, pid, model_set, zams), None)
+
+                if failed:
+                    self.units_failed += 1
+                else:
+                    self.units_done += 1
+
+    def get_status(self):
+        """Return current status
+
+        Returns : {}
+        """
+        now = time.time()
+
+        with self._lock:
+            elapsed = now - self.started
+            bins_done = self.bins_run + self.bins_skipped
+            throughput = self.bins_run / elapsed if elapsed > 0 else 0.0
+
+            bins_total = None
+            eta = None
+
+            if (self.n_units is not None) and (self.n_bins is not None):
+                bins_total = self.n_units * self.n_bins
+                remaining = max(0, bins_total - bins_done)
+
+                if remaining == 0:
+                    eta = 0.0
+                elif throughput > 0:
+                    eta = remaining / throughput
+
+            running = [{'model_set': model_set,
+                        'zams': zams,
+                        'mixing': unit['mixing'],
+                        'worker': f'{host}_{pid}',
+                        'bins_done': unit['bins_done'],
+                        'n_bins': unit['n_bins'],
+                        'elapsed': now - unit['started']}
+                       for (host, pid, model_set, zams), unit in self.running.items()]
+
+            workers = {f'{host}_{pid}': {'last_event': now - t,
+                                         'health': self.get_health(host, pid, now - t)}
+                       for (host, pid), t in self.workers.items()}
+
+            return {'time': now,
+                    'elapsed': elapsed,
+                    'units_total': self.n_units,
+                    'units_done': self.units_done,
+                    'units_failed': self.units_failed,
+                    'bins_total': bins_total,
+                    'bins_done': bins_done,
+                    'throughput': throughput,
+                    'eta': eta,
+                    'running': running,
+                    'workers': workers}
+
+    def get_health(self, host, pid, age):
+        """Return health of worker
+
+        Returns : str
+            'ok' : sent an event within stale_after
+            'stale' : no event within stale_after
+            'dead' : process no longer exists, but was running a unit
+            'exited' : process no longer exists, with no unit running
+                (e.g. a pool worker that finished and was shut down)
+            Only local processes can be checked for 'dead' or 'exited'
+
+        Parameters
+        ----------
+        host : str
+        pid : int
+        age : float
+            time since last event from worker [s]
+        """
+        if host == socket.gethostname():
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                is_running = any(key[:2] == (host, pid) for key in self.running)
+                return 'dead' if is_running else 'exited'
+            except PermissionError:
+                pass
+
+        return 'stale' if age > self.stale_after else 'ok'
+
+    def write_status(self, finished=False):
+        """Atomically write status file
+
+        Parameters
+        ----------
+        finished : bool
+        """
+        if self.filepath is None:
+            return
+
+        status = self.get_status()
+        status['finished'] = finished
+        tmp_filepath = f'{self.filepath}.{os.getpid()}.tmp'
+
+        with open(tmp_filepath, 'w') as f:
+            json.dump(status, f, indent=1)
+
+        os.replace(tmp_filepath, self.filepath)
+
+    def log(self):
+        """Print single progress line
+        """
+        if self.log_interval is None:
+            return
+
+        status = self.get_status()
+        units = f"{status['units_done']}"
+        bins = f"{status['bins_done']}"
+
+        if status['units_total'] is not None:
+            units += f"/{status['units_total']}"
+            bins += f"/{status['bins_total']}"
+
+        eta = '?' if status['eta'] is None else format_seconds(status['eta'])
+
+        print(f"[progress] units {units} ({status['units_failed']} failed), "
+              f"bins {bins}, {status['throughput']:.2f} bins/s, "
+              f"elapsed {format_seconds(status['elapsed'])}, ETA {eta}", flush=True)
+
+    def _loop(self):
+        """Handle worker events, and write status/log lines every interval
+        """
+        next_write = 0.0
+        next_log = time.time() + (self.log_interval or 0)
+
+        while not self._stop.is_set():
+            self._drain(timeout=0.5)
+            now = time.time()
+
+            if now >= next_write:
+                self.write_status()
+                next_write = now + self.interval
+
+            if (self.log_interval is not None) and (now >= next_log):
+                self.log()
+                next_log = now + self.log_interval
+
+    def _drain(self, timeout=None):
+        """Handle all events waiting in worker queue
+
+        Parameters
+        ----------
+        timeout : float
+            time to wait for first event [s]
+        """
+        if self._events is None:
+            self._stop.wait(timeout or 0)
+            return
+
+        try:
+            event = self._events.get(timeout=timeout) if timeout else self._events.get_nowait()
+
+            while True:
+                self.handle(event)
+                event = self._events.get_nowait()
+        except queue.Empty:
+            pass
+
+
+def format_seconds(seconds):
+    """Format duration as H:MM:SS
+
+    Returns : str
+
+    Parameters
+    ----------
+    seconds : float
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+
+    return f'{hours}:{minutes:02d}:{seconds:02d}'
@@ -0,0 +1,254 @@
+import os
+import json
+import hashlib
+
+"""
+Provenance metadata for derived (cached) data files
+
+Derived netCDF files carry their provenance as attributes:
+    - schema_version: version of the derived-file layout
+    - provenance: JSON string of {'params': {}, 'sources': {}}
+
+A cached file is only reused if its provenance matches the expected one,
+i.e. same schema, same parameters (e.g. config bins), and unchanged source files.
+"""
+
+schema_version = 1
+
+bin_params = ['t_start', 't_end', 't_step', 'e_start', 'e_end', 'e_step']
+
+# larger files are stamped by size and mtime only, rather than hashed
+checksum_max_bytes = 256 * 2**20
+
+# checksums already computed in this process: {(path, size, mtime_ns): sha1}
+_checksums = {}
+
+
+class ProvenanceError(ValueError):
+    pass
+
+
+# ===============================================================
+#                      Create
+# ===============================================================
+def get_provenance(params, sources):
+    """Return provenance attributes for a derived file
+
+    Returns : {}
+        netCDF-compatible attributes
+
+    parameters
+    ----------
+    params : {}
+        parameters the file was derived with (must be JSON-serializable)
+    sources : {name: stamp}
+        file stamps of source files, from file_stamp()
+    """
+    record = {'params': params, 'sources': sources}
+
+    return {'schema_version': schema_version,
+            'provenance': json.dumps(record, sort_keys=True)}
+
+
+def get_bin_params(config):
+    """Return config bin parameters that derived files depend on
+
+    Returns : {}
+
+    parameters
+    ----------
+    config : Config
+    """
+    return {key: config.bins[key] for key in bin_params}
+
+
+def file_stamp(filepath, checksum=False):
+    """Return identifying stamp of a source file
+
+    Returns : {'path', 'size', 'mtime'[, 'sha1']}
+        or None if file doesn't exist
+
+    parameters
+    ----------
+    filepath : str
+    checksum : bool
+        include sha1 hash of file contents, if no larger than checksum_max_bytes.
+        If present, the hash takes precedence over mtime when validating.
+        Each file is only hashed once per process, until its size or mtime changes
+    """
+    if not os.path.isfile(filepath):
+        return None
+
+    stat = os.stat(filepath)
+    stamp = {'path': os.path.abspath(filepath),
+             'size': stat.st_size,
+             'mtime': stat.st_mtime}
+
+    if checksum and (stat.st_size <= checksum_max_bytes):
+        key = (stamp['path'], stat.st_size, stat.st_mtime_ns)
+
+        if key not in _checksums:
+            _checksums[key] = file_sha1(filepath)
+
+        stamp['sha1'] = _checksums[key]
+
+    return stamp
+
+
+def file_sha1(filepath, chunk_size=2**20, size=None):
+    """Return sha1 hex digest of file contents
+
+    parameters
+    ----------
+    filepath : str
+    chunk_size : int
+    size : int
+        only hash the first size bytes. Defaults to whole file
+    """
+    sha1 = hashlib.sha1()
+    remaining = size
+
+    with open(filepath, 'rb') as f:
+        while remaining is None or remaining > 0:
+            n = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = f.read(n)
+
+            if not chunk:
+                break
+
+            sha1.update(chunk)
+
+            if remaining is not None:
+                remaining -= len(chunk)
+
+    return sha1.hexdigest()
+
+
+def array_stamp(values):
+    """Return identifying stamp of array contents,
+    for sources that are only partly derived from (e.g. one mixing of a file)
+
+    Returns : {'shape', 'dtype', 'sha1'}
+
+    parameters
+    ----------
+    values : np.ndarray
+    """
+    return {'shape': list(values.shape),
+            'dtype': str(values.dtype),
+            'sha1': hashlib.sha1(values.tobytes(order='C')).hexdigest()}
+
+
+# ===============================================================
+#                      Validate
+# ===============================================================
+def check_provenance(attrs, params, sources, ignore=()):
+    """Check provenance attributes of a loaded file against expected values
+
+    Raises ProvenanceError if stale or incompatible
+
+    Returns : {'params': {}, 'sources': {}}
+        recorded provenance
+
+    parameters
+    ----------
+    attrs : {}
+        attributes of loaded file
+    params : {}
+        expected parameters
+    sources : {name: stamp}
+        current stamps of source files.
+        Missing sources (None) can't be checked, so are skipped
+    ignore : [str]
+        params not compared, e.g. ['t_end'] when extending a file in time
+    """
+    if attrs.get('schema_version') != schema_version:
+        raise ProvenanceError(f"schema_version {attrs.get('schema_version')} "
+                              f"!= {schema_version}")
+
+    if 'provenance' not in attrs:
+        raise ProvenanceError('no provenance metadata')
+
+    record = json.loads(attrs['provenance'])
+    expected = json.loads(json.dumps(params, sort_keys=True))
+    recorded = {key: value for key, value in record['params'].items() if key not in ignore}
+    expected = {key: value for key, value in expected.items() if key not in ignore}
+
+    if recorded != expected:
+        changed = sorted(key for key in set(recorded) | set(expected)
+                         if recorded.get(key) != expected.get(key))
+        raise ProvenanceError(f"derived with different parameters: {', '.join(changed)}")
+
+    for name, stamp in sources.items():
+        if stamp is None:
+            continue
+
+        if record['sources'].get(name) is None:
+            raise ProvenanceError(f"no record of source '{name}'")
+
+        if not stamps_match(record['sources'][name], stamp):
+            raise ProvenanceError(f"source '{name}' has changed: {stamp['path']}")
+
+    return record
+
+
+def stamps_match(recorded, current):
+    """Return True if a recorded file stamp matches the current one
+
+    parameters
+    ----------
+    recorded : {}
+    current : {}
+    """
+    if recorded['size'] != current['size']:
+        return False
+
+    if ('sha1' in recorded) and ('sha1' in current):
+        return recorded['sha1'] == current['sha1']
+
+    return recorded['mtime'] == current['mtime']
+
+
+def is_appended(recorded, filepath):
+    """Return True if file has only been appended to since it was stamped
+
+    i.e. its leading bytes are unchanged. Requires a recorded sha1,
+    otherwise returns False, as it can't be checked
+
+    parameters
+    ----------
+    recorded : {} or None
+        recorded stamp, from file_stamp(checksum=True)
+    filepath : str
+    """
+    if (recorded is None) or ('sha1' not in recorded) or (not os.path.isfile(filepath)):
+        return False
+
+    if os.path.getsize(filepath) < recorded['size']:
+        return False
+
+    return file_sha1(filepath, size=recorded['size']) == recorded['sha1']
+
+
+def is_leading_slice(recorded, values):
+    """Return True if a recorded array stamp matches the leading slice of values
+
+    i.e. values are the stamped array, extended along its first axis (e.g. time)
+
+    parameters
+    ----------
+    recorded : {} or None
+        recorded stamp, from array_stamp()
+    values : np.ndarray or None
+    """
+    if (recorded is None) or (values is None) or ('shape' not in recorded):
+        return False
+
+    n = recorded['shape'][0]
+
+    if (len(values) < n) or (list(values.shape[1:]) != recorded['shape'][1:]):
+        return False
+
+    stamp = array_stamp(values[:n])
+
+    return all(stamp[key] == recorded.get(key) for key in stamp)
@@ -2,65 +2,268 @@
 # Need working installation of snowglobes
 # This will convert FLASH data to necessary input format for snowglobes,
 # run snowglobes, extract the output, and clean up files
+#
+# Each invocation runs snowglobes in a private runtime directory
+# (<scratch>/<config>_<host>_<pid>), sharing the read-only tables,
+# so multiple configs can run at once on the same machine.
+#
+# The scratch root (default: snowglobes/runtimes/) and output root
+# (default: output/) can be set with 'scratch' and 'output' in the config
+# [paths] section, or the SNOWFLASH_SCRATCH and SNOWFLASH_OUTPUT environment
+# variables, e.g. scratch = '/dev/shm' to keep intermediate files in RAM
+#
+# Completed stages are recorded in output/<model_set>/manifest/,
+# so rerunning after an interruption picks up at the first incomplete model
+#
+# For multi-node runs, --shard k/N runs only the k-th of N shards of the
+# (model_set, zams, mixing) work units. Shards are assigned deterministically
+# and balanced by expected cost, and all write into the same output tree.
+# Alternatively, --work_queue <path> has workers on any node claim units from
+# a shared SQLite database, so faster nodes take on more of the work,
+# and units of dead workers are requeued after --stale_after seconds
+#
+# --profile <path> records wall/CPU time, peak memory, I/O, and subprocess counts
+# of each stage and progenitor, saved as JSON and printed as a table at the end
+#
+# --status <path> keeps a JSON status file (running units, bins completed,
+# throughput, ETA, and worker health) up to date, and --log_interval SEC
+# prints a progress line every SEC seconds, for batch logs
+#
+# --plan checks config paths, FLASH dat files (and their time coverage),
+# and disk space, then prints estimated costs and exits without running anything
+#
+# Usage:
+#   python flash2snowglobes.py <config_name> [recalc] [--incremental]
+#                              [--streaming [--queue_size N] [--max_bins N]]
+#                              [--batch_size N] [--concurrency N]
+#                              [--timeout SEC] [--retries N] [--cache_gb GB]
+#                              [--workers N] [--shard k/N]
+#                              [--work_queue PATH [--stale_after SEC]] [--plan]
+#                              [--profile PATH] [--status PATH] [--log_interval SEC]
 
+import os
 import sys
+import socket
+import asyncio
+import argparse
 
 # snowflash
-from snowflash import FlashModel, Config
-from snowflash.flash2snowglobes import analysis, snow_run, snow_cleanup
+from snowflash import Config
+from snowflash.flash2snowglobes import (snow_run, snow_cleanup, snow_cache, pipeline,
+                                         pool, shard, work_queue, plan)
+from snowflash.utils import paths, profiling, progress
 
-recalc = False
+parser = argparse.ArgumentParser(description='Run FLASH models through snowglobes')
+parser.add_argument('config_name',
+                    help='must match a file in snowflash/config/models/')
+parser.add_argument('recalc', nargs='?', default='false',
+                    help="'true' to rerun all stages from the FLASH dat files")
+parser.add_argument('--incremental', action='store_true',
+                    help='only run time bins not already in the output files, '
+                         'e.g. after extending t_end')
+parser.add_argument('--streaming', action='store_true',
+                    help='overlap flux writing, snowglobes, and output parsing '
+                         'of consecutive time bins')
+parser.add_argument('--queue_size', type=int, default=2,
+                    help='max no. of time bins waiting between streaming stages')
+parser.add_argument('--max_bins', type=int, default=None,
+                    help='max no. of time bins with snowglobes files on disk '
+                         'when streaming (default: config snow.max_bins_on_disk)')
+parser.add_argument('--batch_size', type=int, default=None,
+                    help='no. of time bins per snowglobes invocation '
+                         '(default: config snow.batch_size, or 1)')
+parser.add_argument('--concurrency', type=int, default=1,
+                    help='max no. of models, and of snowglobes processes, '
+                         'running at once')
+parser.add_argument('--timeout', type=float, default=None,
+                    help='max snowglobes run time per time bin [s]')
+parser.add_argument('--retries', type=int, default=2,
+                    help='no. of times to retry a failed time bin')
+parser.add_argument('--cache_gb', type=float, default=None,
+                    help='size limit of snowglobes result cache [GB] '
+                         '(default: config snow.cache_gb, or no cache)')
+parser.add_argument('--workers', type=int, default=1,
+                    help='no. of worker processes to run models in, '
+                         'each with its own runtime')
+parser.add_argument('--shard', default=None,
+                    help="only run the k-th of N shards of work units, e.g. '3/16'")
+parser.add_argument('--work_queue', default=None,
+                    help='path to shared SQLite work queue, created if needed')
+parser.add_argument('--stale_after', type=float, default=600,
+                    help='time without a heartbeat after which a work queue unit '
+                         'is requeued [s]')
+parser.add_argument('--plan', action='store_true',
+                    help='validate inputs and print estimated costs, without running')
+parser.add_argument('--profile', default=None,
+                    help='path to save JSON profile of stages to')
+parser.add_argument('--status', default=None,
+                    help='path to JSON status file, updated while running')
+parser.add_argument('--log_interval', type=float, default=None,
+                    help='print a progress line every LOG_INTERVAL seconds')
+args = parser.parse_args()
 
-if len(sys.argv) not in (2, 3):
-    print('Must provide parameter(s):'
-          + '\n1. config_name    # must match a file in snowflash/config/models/'
-          + '\n(2. recalc)'
-          )
-    sys.exit(0)
-else:
-    config_name = sys.argv[1]
-    if len(sys.argv) == 3:
-        recalc = (sys.argv[2].lower() == 'true')
+if args.profile is not None:
+    profiling.enable()
+
+if args.shard is not None and args.work_queue is not None:
+    parser.error('--shard and --work_queue are mutually exclusive')
+
+config_name = args.config_name
+recalc = (args.recalc.lower() == 'true')
 
 
 # ===== config and setup =====
 config = Config(config_name)
+paths.set_roots(scratch=config.paths.get('scratch'),
+                output=config.paths.get('output'))
+
+if args.shard is None:
+    units = shard.get_units(config)
+else:
+    k, n_shards = shard.parse_shard(args.shard)
+    units = shard.get_shard_units(config, k=k, n_shards=n_shards)
+    print(f'=== Shard {k}/{n_shards}: {len(units)} work units ===')
+
+if args.plan:
+    run_plan = plan.plan_run(config=config,
+                             units=units,
+                             streaming=args.streaming,
+                             max_bins=args.max_bins,
+                             batch_size=args.batch_size,
+                             concurrency=args.concurrency,
+                             workers=args.workers,
+                             queue=args.work_queue is not None)
+    plan.print_plan(run_plan)
+    sys.exit(1 if len(run_plan['problems']) > 0 else 0)
+
+n_units = len(units)
+units = shard.group_units(units)
+
+n_parallel = pipeline.get_n_parallel(len(units),
+                                     concurrency=args.concurrency,
+                                     workers=args.workers,
+                                     queue=args.work_queue is not None)
+pipeline.check_disk_space(config=config,
+                          streaming=args.streaming,
+                          max_bins=args.max_bins,
+                          concurrency=n_parallel)
 
 print('=== Setting up snowglobes ===')
 snow_run.setup_snowglobes(config.paths['snowglobes'])
 
+cache_gb = config.cache_gb if args.cache_gb is None else args.cache_gb
+cache = None
+
+if cache_gb:
+    cache_version = snow_run.get_cache_version(config.paths['snowglobes'])
+    cache = snow_cache.ResultCache(max_bytes=int(cache_gb * 1e9), version=cache_version)
+
+runtime_name = f'{config_name}_{socket.gethostname()}_{os.getpid()}'
+
+run_kwargs = {'recalc': recalc,
+              'incremental': args.incremental,
+              'streaming': args.streaming,
+              'queue_size': args.queue_size,
+              'max_bins': args.max_bins,
+              'batch_size': args.batch_size,
+              'timeout': args.timeout,
+              'retries': args.retries,
+              'cache': cache}
+
+
+async def run_all():
+    """Run all models, up to args.concurrency at a time
+
+    Returns : [(model_set, zams, exception)]
+        failed models
+    """
+    slots = snow_run.get_slots(args.concurrency)
+    n_running = asyncio.Semaphore(args.concurrency)
+
+    async def run_unit(model_set, zams, run, mixings):
+        # mixings share flux filenames, so must run one at a time
+        async with n_running:
+            for mixing in mixings:
+                await pipeline.run_model_async(config=config,
+                                               model_set=model_set,
+                                               zams=zams,
+                                               run=run,
+                                               mixing=mixing,
+                                               slots=slots,
+                                               **run_kwargs)
+
+    results = await asyncio.gather(*[run_unit(*unit) for unit in units],
+                                   return_exceptions=True)
+
+    return [(unit[0], unit[1], f'{type(result).__name__}: {result}')
+            for unit, result in zip(units, results)
+            if isinstance(result, Exception)]
+
+
+tracker = None
+
+if (args.status is not None) or (args.log_interval is not None):
+    # units claimed from a work queue aren't known in advance
+    tracker = progress.Tracker(n_units=None if args.work_queue else n_units,
+                               n_bins=len(config.t_bins),
+                               filepath=args.status,
+                               log_interval=args.log_interval,
+                               stale_after=args.stale_after)
+    tracker.start()
+
+try:
+    with profiling.stage('run'):
+        if args.work_queue is not None:
+            queue = work_queue.init_queue(config, filepath=args.work_queue,
+                                          stale_after=args.stale_after)
+            print(f'=== Work queue: {args.work_queue} {queue.get_summary()} ===')
+
+            if args.workers > 1:
+                failed = pool.run_queue_pool(config=config,
+                                             queue=queue,
+                                             runtime_name=runtime_name,
+                                             n_workers=args.workers,
+                                             concurrency=args.concurrency,
+                                             **run_kwargs)
+            else:
+                runtime_path = snow_run.create_runtime(runtime_name)
+
+                try:
+                    failed = work_queue.run_worker(config, queue,
+                                                   concurrency=args.concurrency,
+                                                   **run_kwargs)
+                finally:
+                    snow_cleanup.remove_runtime(runtime_path)
+
+            print(f'=== Work queue: {args.work_queue} {queue.get_summary()} ===')
+
+        elif args.workers > 1:
+            print(f'=== Running {len(units)} models on {args.workers} workers ===')
+            failed = pool.run_pool(config=config,
+                                   units=units,
+                                   runtime_name=runtime_name,
+                                   n_workers=args.workers,
+                                   concurrency=args.concurrency,
+                                   **run_kwargs)
+        else:
+            runtime_path = snow_run.create_runtime(runtime_name)
+            print(f'=== Using runtime: {runtime_path} ===')
+
+            try:
+                failed = asyncio.run(run_all())
+            finally:
+                snow_cleanup.remove_runtime(runtime_path)
+finally:
+    # also report on failed or interrupted runs
+    if tracker is not None:
+        tracker.stop()
+
+    if args.profile is not None:
+        profiling.write_report(args.profile)
+        profiling.print_summary()
+
+for model_set, zams, error in failed:
+    print(f'=== FAILED: {model_set} {zams}: {error.strip().splitlines()[-1]} ===')
 
-for mixing in config.mixing:
-    for model_set in config.model_sets:
-        for i, zams in enumerate(config.zams_list):
-            print('=== Converting flash data ===')
-            flash_model = FlashModel(zams=zams,
-                                     model_set=model_set,
-                                     run=config.run_list[i],
-                                     config_name=config_name,
-                                     recalc=recalc)
-
-            flash_model.write_snow_fluences(mixing)
-
-            print('=== Running snowglobes ===')
-            snow_run.run(model_set=model_set,
-                         zams=zams,
-                         n_bins=len(flash_model.t_bins),
-                         material=config.material,
-                         detector=config.detector)
-
-            print('=== Extracting output ===')
-            analysis.extract_counts(model_set=model_set,
-                                    zams=zams,
-                                    detector=config.detector,
-                                    channel_groups=config.channel_groups,
-                                    mixing=mixing)
-
-            analysis.analyze_output(model_set=model_set,
-                                    zams=zams,
-                                    detector=config.detector,
-                                    channel_groups=config.channel_groups,
-                                    mixing=mixing)
-
-            print('=== Cleaning up files ===')
-            snow_cleanup.clean_model()
+if len(failed) > 0:
+    sys.exit(1)
@@ -0,0 +1,34 @@
+#!/usr/bin/perl
+# Run supernova.pl on several flux files, one after another
+#
+# This only batches the launching of snowglobes: python starts (and waits on)
+# one process per batch of time bins, instead of one per bin.
+# Each flux is still a separate, unmodified run of supernova.pl, which writes
+# its own supernova.glb and runs the GLoBES binary. The binary reads the flux
+# from supernova.glb, so the channel/.glb preamble can't be shared between
+# fluxes without changing snowglobes itself.
+#
+# Must be run from the snowglobes runtime directory.
+# Exits with the number of failed fluxes (0 if all succeeded)
+#
+# Usage:
+#   ./supernova_batch.pl <material> <detector> <flux_1> [<flux_2> ...]
+use strict;
+use warnings;
+
+my ($material, $detector, @fluxes) = @ARGV;
+die "Usage: $0 <material> <detector> <flux_1> [<flux_2> ...]\n" unless @fluxes;
+
+$| = 1;
+my $n_failed = 0;
+
+foreach my $flux (@fluxes) {
+    system('./supernova.pl', $flux, $material, $detector);
+
+    if ($? != 0) {
+        warn "supernova.pl failed for $flux (status $?)\n";
+        $n_failed++;
+    }
+}
+
+exit($n_failed > 255 ? 255 : $n_failed);